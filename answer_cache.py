@@ -0,0 +1,125 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+# ⚙️ Réglages (surchargeables par variables d'environnement)
+CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "86400"))
+CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "1000"))
+
+
+def normalize_query(text):
+    return " ".join(text.lower().split())
+
+
+# 🧠 Cache sémantique des réponses : une question proche (similarité cosinus)
+# d'une question déjà posée dans la même langue reçoit la réponse mémorisée.
+class SemanticAnswerCache:
+    def __init__(self, embeddings, threshold=CACHE_THRESHOLD, ttl=CACHE_TTL, max_entries=CACHE_MAX_ENTRIES):
+        self.embeddings = embeddings
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._by_lang = {}
+        self._matrix = {}
+        self.hits = 0
+        self.misses = 0
+        self._documents_version = None
+
+    def embed(self, query):
+        vector = np.asarray(self.embeddings.embed_query(query), dtype="float32")
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def lookup(self, query, lang="fr"):
+        """Return ``(answer, vector)``; ``answer`` is None on a miss."""
+        key = normalize_query(query)
+        with self._lock:
+            entries = self._by_lang.get(lang)
+            if entries is not None and key in entries and not self._expired(entries[key]):
+                entries.move_to_end(key)
+                self.hits += 1
+                return entries[key]["answer"], entries[key]["vector"]
+
+        vector = self.embed(query)
+        with self._lock:
+            self._evict_expired(lang)
+            entries = self._by_lang.get(lang)
+            if entries:
+                keys, matrix = self._lang_matrix(lang)
+                scores = matrix @ vector
+                best = int(np.argmax(scores))
+                if scores[best] >= self.threshold:
+                    entries.move_to_end(keys[best])
+                    self.hits += 1
+                    return entries[keys[best]]["answer"], vector
+            self.misses += 1
+        return None, vector
+
+    def store(self, query, answer, lang="fr", vector=None):
+        if vector is None:
+            vector = self.embed(query)
+        key = normalize_query(query)
+        with self._lock:
+            entries = self._by_lang.setdefault(lang, OrderedDict())
+            entries[key] = {"answer": answer, "vector": vector, "created": time.monotonic()}
+            entries.move_to_end(key)
+            while len(entries) > self.max_entries:
+                entries.popitem(last=False)
+            self._matrix.pop(lang, None)
+
+    def invalidate(self, *args):
+        with self._lock:
+            self._by_lang.clear()
+            self._matrix.clear()
+
+    # 🔔 Invalidation sur modification des documents (envois, promotion, compactage, rechargement) ;
+    # les mémoires apprises en arrière-plan à chaque message ne vident pas le cache
+    def watch(self, store):
+        self._documents_version = getattr(store, "documents_version", None)
+        store.subscribe(self._on_store_change)
+
+    def _on_store_change(self, store):
+        # Sans compteur (ex. instantané partagé), chaque changement invalide
+        version = getattr(store, "documents_version", None)
+        if version is not None and version == self._documents_version:
+            return
+        self._documents_version = version
+        self.invalidate()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "size": sum(len(entries) for entries in self._by_lang.values()),
+            }
+
+    def _expired(self, entry):
+        return time.monotonic() - entry["created"] > self.ttl
+
+    def _evict_expired(self, lang):
+        entries = self._by_lang.get(lang)
+        if not entries:
+            return
+        expired = [key for key, entry in entries.items() if self._expired(entry)]
+        for key in expired:
+            del entries[key]
+        if expired:
+            self._matrix.pop(lang, None)
+
+    def _lang_matrix(self, lang):
+        cached = self._matrix.get(lang)
+        if cached is None:
+            entries = self._by_lang[lang]
+            keys = list(entries.keys())
+            cached = (keys, np.vstack([entries[key]["vector"] for key in keys]))
+            self._matrix[lang] = cached
+        return cached
@@ -1,46 +1,131 @@
 import os
+# En premier : la chronologie du démarrage inclut le temps d'import
+from startup import startup, store_warmup_steps
+import asyncio
 import chainlit as cl
-import re
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from chainlit.server import app as chainlit_server
 from dotenv import load_dotenv
-from langdetect import detect
-from langchain_community.vectorstores import FAISS
-from langchain.chains import RetrievalQA
-from langchain_openai import ChatOpenAI, OpenAIEmbeddings
-from PyPDF2 import PdfReader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-
+from fastapi import Header, HTTPException
+from fastapi.responses import JSONResponse, PlainTextResponse
+from langchain_openai import ChatOpenAI
+from vectorstore_service import get_vectorstore_manager
+from answer_cache import SemanticAnswerCache
+from embedding_cache import cached_openai_embeddings
+from ingestion import IngestionEngine
+from memory_learning import create_memory_learner
+from memory_compaction import MemoryCompactor
+from conversation_store import ConversationStore, llm_summarizer
+from intent_router import IntentRouter, detect_language
+from context_packing import build_retriever, count_tokens
+from model_router import create_model_router
+from session_index import SessionIndexStore, current_session
+from metrics import CONTENT_TYPE, llm_metrics, profile_slow, profiled, registry, span
+
+startup.mark("imports")
 
 
 # Charger la clé API
 load_dotenv()
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
-# Charger la base FAISS existante
+# Pool borné pour les appels bloquants (embeddings, FAISS, PDF) : la boucle asyncio reste libre
+blocking_executor = ThreadPoolExecutor(max_workers=int(os.getenv("BLOCKING_WORKERS", "8")))
+
+async def run_blocking(func, *args):
+    loop = asyncio.get_running_loop()
+    # Le thread du pool est échantillonné par le profil de la requête en cours (profile_slow)
+    return await loop.run_in_executor(blocking_executor, profiled(func), *args)
+
+# Charger la base FAISS existante (une seule instance partagée par tout le processus)
 def load_vectorstore(path: str):
-    embeddings = OpenAIEmbeddings(openai_api_key=OPENAI_API_KEY)
-    return FAISS.load_local(path, embeddings, allow_dangerous_deserialization=True)
+    embeddings = cached_openai_embeddings(openai_api_key=OPENAI_API_KEY)
+    return get_vectorstore_manager(path, embeddings)
+
+# Documents envoyés avec /upload : index éphémère propre à chaque session, jamais dans le vectorstore
+session_indexes = SessionIndexStore(cached_openai_embeddings(openai_api_key=OPENAI_API_KEY))
+
+HYBRID_RETRIEVAL = os.getenv("HYBRID_RETRIEVAL", "1") == "1"
 
-def create_qa_chain(vectorstore_path: str):
+def create_answer_router(vectorstore_path: str):
     db = load_vectorstore(vectorstore_path)
-    retriever = db.as_retriever()
-    llm = ChatOpenAI(model="gpt-4", temperature=0, openai_api_key=OPENAI_API_KEY)
-    return RetrievalQA.from_chain_type(llm=llm, retriever=retriever)
-
-qa_chain = create_qa_chain("vectorstore")
-
-# Historique de conversation pour GPT
-conversation_history = [
-    {
-        "role": "system",
-        "content": (
-            "Tu es un assistant expert en naturalisation française. "
-            "Tes réponses sont claires, bienveillantes et basées sur la loi. "
-            "Tu réponds dans la langue de l'utilisateur (français, anglais, espagnol, italien ou allemand). "
-            "Si tu ne comprends pas la langue, utilise le français par défaut."
-        )
-    }
-]
+    # Recherche hybride (FAISS + BM25) : meilleure précision sur les références légales,
+    # fusionnée avec les documents de la session, puis assemblage du contexte dans un budget de tokens
+    retriever = build_retriever(db, hybrid=HYBRID_RETRIEVAL, sessions=session_indexes)
+    # Modèle rapide pour les questions simples, GPT-4 seulement si nécessaire
+    return create_model_router(retriever, openai_api_key=OPENAI_API_KEY)
+
+model_router = create_answer_router("vectorstore")
+answer_cache = SemanticAnswerCache(cached_openai_embeddings(openai_api_key=OPENAI_API_KEY))
+answer_cache.watch(load_vectorstore("vectorstore"))
+ingestion_engine = IngestionEngine(load_vectorstore("vectorstore"))
+intent_router = IntentRouter(cached_openai_embeddings(openai_api_key=OPENAI_API_KEY))
+memory_learner = create_memory_learner(
+    load_vectorstore("vectorstore"),
+    ChatOpenAI(model="gpt-3.5-turbo", temperature=0, callbacks=[llm_metrics], openai_api_key=OPENAI_API_KEY)
+)
+# Fusion périodique des mémoires quasi identiques, expiration et plafond (MEMORY_COMPACTION_INTERVAL)
+memory_compactor = MemoryCompactor(load_vectorstore("vectorstore"))
+memory_compactor.start()
+
+# Historique de conversation pour GPT, propre à chaque session Chainlit et borné
+SYSTEM_PROMPT = (
+    "Tu es un assistant expert en naturalisation française. "
+    "Tes réponses sont claires, bienveillantes et basées sur la loi. "
+    "Tu réponds dans la langue de l'utilisateur (français, anglais, espagnol, italien ou allemand). "
+    "Si tu ne comprends pas la langue, utilise le français par défaut."
+)
+conversation_store = ConversationStore(
+    summarizer=llm_summarizer(ChatOpenAI(model="gpt-3.5-turbo", temperature=0, callbacks=[llm_metrics],
+                                         openai_api_key=OPENAI_API_KEY))
+)
+
+# 📈 Métriques Prometheus exposées sur le serveur Chainlit
+async def metrics_endpoint():
+    return PlainTextResponse(registry.render(), media_type=CONTENT_TYPE)
+
+def add_server_route(path, endpoint, methods):
+    chainlit_server.add_api_route(path, endpoint, methods=methods)
+    # La route ajoutée doit précéder la route « attrape-tout » de l'interface Chainlit
+    chainlit_server.router.routes.insert(0, chainlit_server.router.routes.pop())
+
+add_server_route("/metrics", metrics_endpoint, ["GET"])
+
+# 🩺 Sondes : vivant dès l'import, prêt une fois l'index chargé et la chauffe terminée
+async def health_endpoint():
+    return JSONResponse({"status": "ok"})
+
+async def ready_endpoint():
+    return JSONResponse(startup.status(), status_code=200 if startup.is_ready() else 503)
+
+add_server_route("/healthz", health_endpoint, ["GET"])
+add_server_route("/readyz", ready_endpoint, ["GET"])
+
+registry.gauge_function("llmops_answer_cache_entries", lambda: [(None, answer_cache.stats()["size"])])
+registry.gauge_function("llmops_sessions", lambda: [(None, len(conversation_store))])
+registry.gauge_function("llmops_session_index_chunks", lambda: [(None, session_indexes.stats()["chunks"])])
+registry.gauge_function("llmops_session_index_bytes", lambda: [(None, session_indexes.stats()["bytes"])])
+
+# 🔐 Administration : seule une promotion explicite fait entrer des documents de session
+# dans le vectorstore partagé (désactivée tant que ADMIN_TOKEN n'est pas défini)
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+def require_admin(token):
+    if not ADMIN_TOKEN or token != ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="accès réservé à l'administration")
+
+async def admin_sessions(x_admin_token: str = Header(default="")):
+    require_admin(x_admin_token)
+    return session_indexes.sessions()
+
+async def admin_promote(session_id: str, file_name: str = None, x_admin_token: str = Header(default="")):
+    require_admin(x_admin_token)
+    added = await run_blocking(ingestion_engine.promote, session_indexes, session_id,
+                               [file_name] if file_name else None)
+    return {"session": session_id, "added": added}
+
+add_server_route("/admin/sessions", admin_sessions, ["GET"])
+add_server_route("/admin/sessions/{session_id}/promote", admin_promote, ["POST"])
 
 translations = {
     # 🇫🇷 Français
@@ -124,13 +209,6 @@ translations = {
     }
 }
 
-def detect_language(text):
-    try:
-        lang = detect(text)
-        return lang if lang in translations else "fr"
-    except:
-        return "fr"
-
 def t(lang, key):
     return translations.get(lang, translations["fr"]).get(key, "")
 
@@ -142,107 +220,93 @@ async def start():
         "\n📎 Vous pouvez **envoyer un document PDF à tout moment** en tapant `/upload`."
     )
     await cl.Message(content=msg).send()
+
+@cl.on_chat_end
+async def end():
+    conversation_store.reset(cl.context.session.id)
+    session_indexes.drop(cl.context.session.id)
+
 @cl.on_message
 async def handle_message(message: cl.Message):
-    global conversation_history
+    with profile_slow("chainlit_message"), span("request", app="chainlit"):
+        await answer_message(message)
+
+async def answer_message(message: cl.Message):
+    session_id = cl.context.session.id
+    current_session.set(session_id)
     user_input = message.content.strip()
-    lang = detect_language(user_input)
 
-    if user_input.lower() == "guide":
-        await launch_step_by_step_guide(lang)
-        return
-    elif user_input.lower() == "checklist":
-        await send_checklist(lang)
-        return
-    elif user_input.lower() == "dépôt":
-        await send_depot_info(lang)
-        return
-    elif user_input.lower() in ["/reset", "reset"]:
-        conversation_history.clear()
-        await cl.Message(content="♻️ Conversation réinitialisée. Posez votre question !").send()
+    # 🧭 Routage avant la détection de langue et tout appel LLM
+    command = intent_router.command(user_input)
+    if command:
+        await run_command(command, cl.user_session.get("lang") or "fr")
         return
-    elif user_input.lower() == "mémoire":
-        await show_bot_memory()
-        return
-    elif user_input.lower() == "/upload":
-        await ask_for_pdf_files()
-        return
-
-    try:
-        # Réponse principale
-        result = qa_chain.invoke({"query": user_input})
-        await cl.Message(content=result["result"]).send()
-
-        # --- Analyse de la mémoire à apprendre ---
-        llm = ChatOpenAI(model="gpt-3.5-turbo", temperature=0, openai_api_key=OPENAI_API_KEY)
-        analysis_prompt = f"""
-Tu es un assistant spécialisé en naturalisation française.
 
-Analyse ce message utilisateur :
-\"{user_input}\"
-
-- S'il contient une information factuelle utile, résume-la clairement en une phrase.
-- Sinon, réponds uniquement "NON".
-"""
-        analysis = llm.predict(analysis_prompt).strip()
-        print(f"🧠 Analyse du message : {analysis}")
-
-        if analysis.upper() != "NON":
-            embeddings = OpenAIEmbeddings(openai_api_key=OPENAI_API_KEY)
-            vectordb = FAISS.load_local("vectorstore", embeddings, allow_dangerous_deserialization=True)
-
-            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            text_with_timestamp = f"[{timestamp}] {analysis}"
-
-            vectordb.add_texts([text_with_timestamp])
-            vectordb.save_local("vectorstore")
+    lang = detect_language(user_input)
+    cl.user_session.set("lang", lang)
 
-            print(f"📌 Nouvelle mémoire ajoutée : {text_with_timestamp}")
+    faq_entry, faq_score = await run_blocking(intent_router.match_faq, user_input, lang)
+    if faq_entry is not None:
+        await cl.Message(content=faq_entry["answer"]).send()
+        await run_blocking(conversation_store.add_turn, session_id, user_input, faq_entry["answer"])
+        print(f"📋 Réponse FAQ ({faq_entry['lang']}, score {faq_score:.3f}) : {intent_router.stats()}")
+        return
 
-        print("📁 Chemin absolu du vectorstore :", os.path.abspath("vectorstore"))
+    try:
+        # Réponse en cache pour une question similaire déjà posée dans cette langue, sauf si la
+        # session a ses propres documents : la réponse dépend alors de son contenu privé
+        private = session_indexes.has_documents(session_id)
+        answer, query_vector = (None, None) if private else await run_blocking(answer_cache.lookup, user_input, lang)
+        if answer is not None:
+            await cl.Message(content=answer).send()
+        else:
+            # Réponse principale, diffusée token par token depuis le modèle retenu par le routeur
+            msg = cl.Message(content="")
+            answer, _ = await cl.make_async(profiled(model_router.answer))(
+                user_input, on_token=lambda token: cl.run_sync(msg.stream_token(token))
+            )
+            if not msg.content:
+                msg.content = answer
+            await msg.send()
+            if not private:
+                answer_cache.store(user_input, answer, lang, query_vector)
+        await run_blocking(conversation_store.add_turn, session_id, user_input, answer)
+        print(f"⚡ Cache des réponses : {answer_cache.stats()}")
+
+        # --- Analyse de la mémoire à apprendre (en arrière-plan, par lots) ---
+        if not memory_learner.submit(user_input):
+            print(f"⚠️ File d'apprentissage pleine, message ignoré : {memory_learner.stats()}")
 
     except Exception as e:
         await cl.Message(content=f"❌ Erreur : {e}").send()
 
+MEMORY_VIEW_LIMIT = int(os.getenv("MEMORY_VIEW_LIMIT", "20"))
+
 async def show_bot_memory():
     try:
-        embeddings = OpenAIEmbeddings(openai_api_key=OPENAI_API_KEY)
-        vectordb = FAISS.load_local("vectorstore", embeddings, allow_dangerous_deserialization=True)
-        all_memory = list(vectordb.docstore._dict.values())
+        vectordb = load_vectorstore("vectorstore")
+        # Index secondaire trié par date : coût indépendant de la taille du corpus
+        new_memories = await run_blocking(vectordb.recent_documents, MEMORY_VIEW_LIMIT, 0, ("memory", "upload"))
+        old_memories = await run_blocking(vectordb.recent_documents, 5, 0, "preloaded")
 
-        if not all_memory:
+        if not new_memories and not old_memories:
             await cl.Message(content="🤔 Le bot n’a encore rien appris.").send()
             return
 
-        # Séparer les mémoires avec timestamp
-        new_memories = []
-        old_memories = []
-
-        for i, doc in enumerate(all_memory):
-            content = doc.page_content.strip()
-            match = re.match(r"\[(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})\]", content)
-            if match:
-                dt = datetime.strptime(match.group(1), "%Y-%m-%d %H:%M:%S")
-                new_memories.append((dt, i, content))
-            else:
-                old_memories.append((i, content))
-
-        # Trier les nouvelles mémoires du plus récent au plus ancien
-        new_memories.sort(reverse=True)
-
         message_parts = []
 
         if new_memories:
             message_parts.append("**🆕 Dernières infos apprises par le bot :**\n")
-            for dt, i, content in new_memories:
-                message_parts.append(f"{i + 1} - {content}")
+            for i, doc in enumerate(new_memories):
+                count = doc.metadata.get("count", 1)
+                message_parts.append(f"{i + 1} - {doc.page_content.strip()}" + (f" (×{count})" if count > 1 else ""))
         else:
             message_parts.append("ℹ️ Aucune nouvelle information mémorisée par conversation.")
 
         if old_memories:
             message_parts.append("\n\n**📚 Contenus préchargés (documents) :**\n")
-            for i, content in old_memories[:5]:  # limite d’affichage pour éviter surcharge
-                message_parts.append(f"{i + 1} - {content[:200]}...")
+            for i, doc in enumerate(old_memories):  # limite d’affichage pour éviter surcharge
+                message_parts.append(f"{i + 1} - {doc.page_content.strip()[:200]}...")
 
         full_output = "\n".join(message_parts)
         await cl.Message(content=full_output[:4000]).send()
@@ -262,16 +326,27 @@ async def send_checklist(lang="fr"):
 async def send_depot_info(lang="fr"):
     await cl.Message(content=t(lang, "depot")).send()
 
+async def reset_conversation(lang="fr"):
+    conversation_store.reset(cl.context.session.id)
+    await cl.Message(content="♻️ Conversation réinitialisée. Posez votre question !").send()
+
+# Table des commandes : nom renvoyé par le routeur -> action
+COMMAND_HANDLERS = {
+    "guide": launch_step_by_step_guide,
+    "checklist": send_checklist,
+    "depot": send_depot_info,
+    "memory": lambda lang: show_bot_memory(),
+    "reset": reset_conversation,
+    "upload": lambda lang: ask_for_pdf_files(),
+}
+
+async def run_command(command: str, lang: str = "fr"):
+    await COMMAND_HANDLERS[command](lang)
+
 async def handle_user_command(cmd: str, lang: str = "fr"):
-    cmd = cmd.lower()
-    if cmd == "guide":
-        await launch_step_by_step_guide(lang)
-    elif cmd == "checklist":
-        await send_checklist(lang)
-    elif cmd == "dépôt":
-        await send_depot_info(lang)
-    elif cmd == "mémoire":
-        await show_bot_memory()
+    command = intent_router.command(cmd)
+    if command in ("guide", "checklist", "depot", "memory"):
+        await run_command(command, lang)
 
 
 
@@ -283,7 +358,7 @@ async def on_action(action: cl.Action):
 
 async def ask_for_pdf_files():
     files = await cl.AskFileMessage(
-        content="📂 Envoie jusqu’à 3 fichiers PDF (questionnaire, justificatifs, etc.) pour que je les intègre.",
+        content="📂 Envoie jusqu’à 3 fichiers PDF (questionnaire, justificatifs, etc.) : ils restent propres à cette conversation.",
         accept=["application/pdf"],
         max_size_mb=10,
         max_files=3
@@ -293,35 +368,42 @@ async def ask_for_pdf_files():
         await cl.Message(content="⛔ Aucun fichier reçu. Vous pouvez réessayer plus tard avec `/upload`.").send()
         return
 
-    embeddings = OpenAIEmbeddings(openai_api_key=OPENAI_API_KEY)
-    vectordb = FAISS.load_local("vectorstore", embeddings, allow_dangerous_deserialization=True)
-
-    total_chunks = 0
-    for uploaded_file in files:
-        try:
-            pdf_reader = PdfReader(uploaded_file.path)
-            text = "\n".join([page.extract_text() for page in pdf_reader.pages if page.extract_text()])
-            if not text.strip():
-                await cl.Message(content=f"⚠️ Aucun texte lisible trouvé dans **{uploaded_file.name}**.").send()
-                continue
-
-            splitter = RecursiveCharacterTextSplitter(
-                chunk_size=800,
-                chunk_overlap=100,
-                separators=["\n\n", "\n", ".", " "]
-            )
-            chunks = splitter.split_text(text)
-            total_chunks += len(chunks)
+    progress_msg = cl.Message(content="⏳ Lecture des fichiers en cours...")
+    await progress_msg.send()
+    progress = {}
+
+    # Appelés depuis le thread d'ingestion : on repasse par la boucle Chainlit
+    def on_progress(name, pages_done, pages_total):
+        progress[name] = f"⏳ **{name}** : {pages_done}/{pages_total} pages lues"
+        progress_msg.content = "\n".join(progress.values())
+        cl.run_sync(progress_msg.update())
 
-            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            docs = [f"[{timestamp}] (Doc: {uploaded_file.name}) {chunk}" for chunk in chunks]
+    def on_file_done(report):
+        if report["error"]:
+            content = f"❌ Erreur pour **{report['file']}** : {report['error']}"
+        else:
+            content = f"✅ Fichier **{report['file']}** ajouté à votre session ({report['chunks']} morceaux"
+            if report["duplicates"]:
+                content += f", dont {report['duplicates']} déjà connus"
+            content += ")."
+        cl.run_sync(cl.Message(content=content).send())
+
+    reports = await cl.make_async(profiled(ingestion_engine.ingest_files))(
+        [(uploaded_file.path, uploaded_file.name) for uploaded_file in files],
+        on_progress,
+        on_file_done,
+        session_indexes.target(cl.context.session.id)
+    )
 
-            vectordb.add_texts(docs)
-            await cl.Message(content=f"✅ Fichier **{uploaded_file.name}** intégré ({len(chunks)} morceaux).").send()
+    if any(report["chunks"] for report in reports):
+        await cl.Message(content="📚 Tous les fichiers ont été intégrés à cette conversation. Tu peux poser tes questions maintenant !").send()
 
-        except Exception as e:
-            await cl.Message(content=f"❌ Erreur pour **{uploaded_file.name}** : {e}").send()
 
-    vectordb.save_local("vectorstore")
-    if total_chunks > 0:
-        await cl.Message(content="📚 Tous les fichiers ont été intégrés. Tu peux poser tes questions maintenant !").send()
+# 🔥 Chauffe de l'index, du détecteur de langue et du tokenizer, en arrière-plan par défaut (STARTUP_MODE)
+startup.mark("setup")
+startup.warm_up(
+    store_warmup_steps(load_vectorstore("vectorstore"), model_router.retriever, hybrid=HYBRID_RETRIEVAL) + [
+        ("language_detection", lambda: detect_language("Bonjour, je voudrais demander la nationalité française.")),
+        ("tokenizer", lambda: count_tokens("chauffe")),
+    ]
+)
@@ -1,10 +1,22 @@
-from flask import Flask, render_template, request, jsonify
-from langchain_openai import ChatOpenAI, OpenAIEmbeddings
-from langchain_community.vectorstores import FAISS
-from langchain.chains import RetrievalQA
-from dotenv import load_dotenv
 import os
-
+# En premier : la chronologie du démarrage inclut le temps d'import
+from startup import STARTUP_MODE, startup, store_warmup_steps
+from flask import Flask, Response, render_template, request, jsonify, session
+from dotenv import load_dotenv
+import json
+import uuid
+from vectorstore_service import get_vectorstore_manager
+from answer_cache import SemanticAnswerCache
+from embedding_cache import cached_openai_embeddings
+from conversation_store import HISTORY_DB_PATH, SharedConversationStore
+from metrics import CONTENT_TYPE, profile_slow, registry, span
+from shared_index import SHARED_INDEX_PATH, SharedIndexReader
+from context_packing import build_retriever
+from model_router import create_model_router
+from batch_qa import BatchAnswerer
+from intent_router import detect_language
+
+startup.mark("imports")
 
 app = Flask(__name__)
 
@@ -12,66 +24,154 @@ app = Flask(__name__)
 
 load_dotenv()  # Charge les variables d'environnement du fichier .env
 
+# 🍪 Clé de signature du cookie de session (identifiant d'historique par visiteur) ; elle doit
+# être commune à tous les workers gunicorn (exigée par wsgi.py). Sans elle (flask run, benchmark),
+# une clé éphémère suffit à un seul processus.
+app.secret_key = os.getenv("FLASK_SECRET_KEY") or os.urandom(32)
+
 openai_api_key = os.getenv("OPENAI_API_KEY")
 
-print(openai_api_key)
 if not openai_api_key:
     raise ValueError("🔑 Clé API OpenAI manquante ! Définissez OPENAI_API_KEY dans vos variables d’environnement.")
 
+HYBRID_RETRIEVAL = os.getenv("HYBRID_RETRIEVAL", "1") == "1"
+
 # 📥 Charger la base de données vectorielle FAISS
-def create_retriever(vector_db_path):
-    embeddings = OpenAIEmbeddings()
-    try:
-        faiss_db = FAISS.load_local(vector_db_path, embeddings, allow_dangerous_deserialization=True)
-        return faiss_db.as_retriever()
-    except ValueError as e:
-        print(f"❌ Erreur lors du chargement de la base FAISS : {e}")
-        return None
-
-# 🤖 Création du chatbot
-def create_chatbot(vector_db_path):
-    retriever = create_retriever(vector_db_path)
-    if retriever is None:
-        return None, None
-    llm = ChatOpenAI(model="gpt-3.5-turbo", temperature=0.7)
-    retrieval_chain = RetrievalQA.from_chain_type(llm=llm, chain_type="stuff", retriever=retriever)
-    return retrieval_chain, llm
+# (en mode "background", le chargement se fait pendant la chauffe, le serveur répond déjà aux sondes)
+def load_store(vector_db_path):
+    embeddings = cached_openai_embeddings()
+    if SHARED_INDEX_PATH:
+        # Mode production multi-workers : instantané publié, mappé en lecture seule
+        store = SharedIndexReader(SHARED_INDEX_PATH, embeddings)
+        if STARTUP_MODE == "eager":
+            store.snapshot()
+        return store
+    store = get_vectorstore_manager(vector_db_path, embeddings)
+    if STARTUP_MODE == "eager":
+        store.db  # chargement immédiat pour remonter les erreurs ici
+    return store
+
+def create_retriever(store):
+    return build_retriever(store, hybrid=HYBRID_RETRIEVAL)
+
+# 🤖 Création du chatbot : routage entre modèle rapide et GPT-4 selon la question
+def create_chatbot(store):
+    return create_model_router(create_retriever(store), temperature=0.7)
 
 # 🎭 Classe chatbot
 class Chatbot:
     def __init__(self, vector_db_path):
-        self.qa, self.llm = create_chatbot(vector_db_path)
-
-    def ask(self, question):
-        if not self.qa:
+        self.router, self.cache, self.store, self.error = None, None, None, None
+        try:
+            store = load_store(vector_db_path)
+        except (ValueError, OSError) as e:
+            print(f"❌ Erreur lors du chargement de la base FAISS : {e}")
+            self.error = e
+            return
+        self.store = store
+        self.router = create_chatbot(store)
+        # ⚡ Cache sémantique invalidé quand les documents de l'index changent
+        self.cache = SemanticAnswerCache(cached_openai_embeddings())
+        self.cache.watch(store)
+
+    def ask(self, question, lang=None):
+        if not self.router:
             return "⚠️ Erreur de chargement du modèle."
-        # 🔎 Recherche dans FAISS
-        specific_response = self.qa.run(question)
-        # 📌 Si la réponse est vide ou peu pertinente, utiliser GPT-3.5
-        if not specific_response.strip():
-            return self.llm.predict(question)
-        return specific_response.strip()
+        # Cache séparé par langue : une question en anglais ne reçoit pas une réponse française
+        lang = lang or detect_language(question)
+        cached_answer, query_vector = self.cache.lookup(question, lang)
+        if cached_answer is not None:
+            return cached_answer
+        try:
+            # En mode "background", l'index est chargé par la chauffe ou par la première requête
+            self.store.size()
+        except Exception as e:
+            print(f"❌ Erreur lors du chargement de la base FAISS : {e}")
+            return "⚠️ Erreur de chargement du modèle."
+        # 🔎 Recherche dans FAISS puis réponse du modèle choisi (relais vers GPT-4 dans le même budget)
+        answer, _ = self.router.answer(question)
+        self.cache.store(question, answer, lang, query_vector)
+        return answer
 
 # 🎨 Interface Flask
 
-vector_db_path = "C:\\Users\\daora\\IA_Naturalisation\\vectorstore"  # Adapte ce chemin
+vector_db_path = os.getenv("VECTOR_DB_PATH", "C:\\Users\\daora\\IA_Naturalisation\\vectorstore")  # Adapte ce chemin
 
 chatbot = Chatbot(vector_db_path)
 
-chat_history = []
+# Historique dans SQLite : sous gunicorn, chaque requête peut arriver sur un worker (processus) différent
+conversation_store = SharedConversationStore(HISTORY_DB_PATH)
+
+def current_session_id():
+    if "sid" not in session:
+        session["sid"] = uuid.uuid4().hex
+    return session["sid"]
 
 @app.route('/')
 def home():
+    chat_history = conversation_store.turns(current_session_id())
     return render_template('index.html', chat_history=chat_history)
 
 @app.route('/ask', methods=['POST'])
 def ask():
-    global chat_history
     question = request.form['question']
-    response = chatbot.ask(question)
-    chat_history.append((question, response))
-    return jsonify({"response": response, "chat_history": chat_history})
+    with profile_slow("flask_ask"), span("request", app="flask"):
+        response = chatbot.ask(question)
+    turn = conversation_store.add_turn(current_session_id(), question, response)
+    return jsonify({"response": response, "turn": turn})
+
+@app.route('/history')
+def history():
+    offset = request.args.get('offset', 0, type=int)
+    limit = min(request.args.get('limit', 10, type=int), 100)
+    return jsonify(conversation_store.page(current_session_id(), offset, limit))
+
+# 📦 Réponses en lot (JSON {"questions": [...]}) renvoyées en NDJSON au fil de l'eau ;
+# réservé à l'administration (désactivé tant que ADMIN_TOKEN n'est pas défini).
+# Pour des milliers de questions avec reprise : python batch_qa.py questions.txt
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+BATCH_API_MAX_QUESTIONS = int(os.getenv("BATCH_API_MAX_QUESTIONS", "1000"))
+
+@app.route('/batch', methods=['POST'])
+def batch():
+    if not ADMIN_TOKEN or request.headers.get("X-Admin-Token") != ADMIN_TOKEN:
+        return jsonify({"error": "accès réservé à l'administration"}), 403
+    if not chatbot.router:
+        return jsonify({"error": "modèle non chargé"}), 503
+    questions = (request.get_json(silent=True) or {}).get("questions") or []
+    if len(questions) > BATCH_API_MAX_QUESTIONS:
+        return jsonify({"error": f"au plus {BATCH_API_MAX_QUESTIONS} questions par appel"}), 413
+    items = [(str(item.get("id", number)), item["question"]) if isinstance(item, dict) else (str(number), item)
+             for number, item in enumerate(questions, start=1)]
+    answerer = BatchAnswerer(chatbot.store, chatbot.router, hybrid=HYBRID_RETRIEVAL)
+    records = (json.dumps(record, ensure_ascii=False) + "\n" for record in answerer.iter_answers(items))
+    return Response(records, content_type="application/x-ndjson")
+
+# 📈 Métriques au format Prometheus (latences par étape, tokens, taille de l'index)
+registry.gauge_function("llmops_sessions", lambda: [(None, len(conversation_store))])
+
+@app.route('/metrics')
+def metrics():
+    return Response(registry.render(), content_type=CONTENT_TYPE)
+
+# 🩺 Sondes : vivant dès l'import, prêt une fois l'index chargé et la chauffe terminée
+@app.route('/healthz')
+def healthz():
+    return jsonify({"status": "ok"})
+
+@app.route('/readyz')
+def readyz():
+    return jsonify(startup.status()), 200 if startup.is_ready() else 503
+
+# 🔥 Chauffe (index, pages, index lexical), en arrière-plan par défaut (STARTUP_MODE)
+startup.mark("setup")
+def report_load_error():
+    raise chatbot.error
+
+startup.warm_up(store_warmup_steps(chatbot.store, chatbot.router.retriever, hybrid=HYBRID_RETRIEVAL)
+                if chatbot.router else [("index_load", report_load_error)])
 
 if __name__ == '__main__':
-    app.run(host="0.0.0.0", port=8085, debug=True)
+    # Serveur de développement ; en production : gunicorn -c gunicorn.conf.py wsgi:application
+    app.run(host="0.0.0.0", port=8085, debug=os.getenv("FLASK_DEBUG", "1") == "1")
 
@@ -0,0 +1,271 @@
+import argparse
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+import openai
+from dotenv import load_dotenv
+
+from context_packing import CONTEXT_CANDIDATES, CONTEXT_PACKING, ContextPacker
+from hybrid_retrieval import RETRIEVER_FETCH_K, RETRIEVER_K, RRF_K, reciprocal_rank_fusion
+from metrics import registry, span
+from model_router import ModelRouter
+
+
+# ⚙️ Réglages du mode lot (surchargeables par variables d'environnement)
+BATCH_SIZE = int(os.getenv("BATCH_SIZE", "500"))  # questions embarquées et cherchées ensemble
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "8"))  # appels LLM simultanés
+BATCH_MAX_RETRIES = int(os.getenv("BATCH_MAX_RETRIES", "5"))
+BATCH_BACKOFF = float(os.getenv("BATCH_BACKOFF", "2"))  # délai de base du recul exponentiel (s)
+BATCH_MAX_BACKOFF = float(os.getenv("BATCH_MAX_BACKOFF", "60"))
+
+TRANSIENT_ERRORS = (openai.APIConnectionError, openai.APITimeoutError, openai.InternalServerError, TimeoutError)
+
+
+def read_questions(path):
+    """Yield ``(id, question)`` from a text file (one question per line) or a JSONL file.
+
+    JSONL lines carry ``question`` and optionally ``id``; the line number is the default id,
+    so that an unchanged input file gives the same ids on every run (reprise).
+    """
+    jsonl = path.endswith((".jsonl", ".ndjson"))
+    with open(path, encoding="utf-8") as f:
+        for number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            if jsonl:
+                item = json.loads(line)
+                yield str(item.get("id", number)), item["question"]
+            else:
+                yield str(number), line
+
+
+def completed_ids(path):
+    """Ids already answered without error in ``path``; a truncated last line is ignored."""
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get("error"):
+                done.discard(record["id"])
+            else:
+                done.add(record["id"])
+    return done
+
+
+def ends_with_newline(path):
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        if not f.tell():
+            return True
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b"\n"
+
+
+def retry_after(error):
+    """Delay requested by the API (``retry-after`` headers), or None."""
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    for name, scale in (("retry-after-ms", 1000.0), ("retry-after", 1.0)):
+        try:
+            return float(headers[name]) / scale
+        except (KeyError, TypeError, ValueError):
+            continue
+    return None
+
+
+# 🚧 Pause partagée : un 429 reçu par un worker suspend les nouveaux appels de tous les autres
+class RateLimitGate:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._until = 0.0
+
+    def pause(self, seconds):
+        with self._lock:
+            self._until = max(self._until, time.monotonic() + seconds)
+
+    def wait(self):
+        while True:
+            with self._lock:
+                delay = self._until - time.monotonic()
+            if delay <= 0:
+                return
+            time.sleep(delay)
+
+
+# 📦 Réponses en lot : les questions d'un lot sont embarquées ensemble et cherchées par un
+# seul appel FAISS ; le contexte est ensuite condensé puis les LLM sont appelés en parallèle
+# (concurrence bornée, reprise sur limitation de débit). La recherche du lot suivant se fait
+# pendant que les réponses du lot courant arrivent.
+class BatchAnswerer:
+    def __init__(self, store, router, hybrid=True, packing=CONTEXT_PACKING, batch_size=BATCH_SIZE,
+                 concurrency=BATCH_CONCURRENCY, max_retries=BATCH_MAX_RETRIES, backoff=BATCH_BACKOFF):
+        self.store = store
+        # Sous limitation de débit, on recule au lieu de relayer vers GPT-4 (plus de trafic)
+        self.router = router.for_batch() if isinstance(router, ModelRouter) else router
+        self.hybrid = hybrid
+        self.packer = ContextPacker(store.embeddings, store=store) if packing else None
+        self.k = CONTEXT_CANDIDATES if packing else RETRIEVER_K
+        self.fetch_k = max(RETRIEVER_FETCH_K, self.k) if hybrid else self.k
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.gate = RateLimitGate()
+
+    def retrieve(self, items):
+        """Return the candidate documents of every ``(id, question)`` and the per-item timings."""
+        questions = [question for _, question in items]
+        started = time.perf_counter()
+        with span("batch_embedding"):
+            # Même pause partagée et mêmes reprises que les appels LLM : un 429 n'interrompt pas le lot
+            vectors = self._with_retries(lambda: self.store.embeddings.embed_documents(questions),
+                                         f"Embeddings du lot de {len(questions)} question(s)")
+            vectors = np.asarray(vectors, dtype="float32")
+        embedded = time.perf_counter()
+        with span("batch_retrieval"):
+            ranked = self.store.vector_search_ids_batch(vectors, self.fetch_k)
+            if self.hybrid:
+                # BM25 question par question, fusionné comme dans HybridRetriever
+                lexical = [[doc_id for doc_id, _ in self.store.lexical_search(question, self.fetch_k)]
+                           for question in questions]
+                ranked = [reciprocal_rank_fusion(rankings, RRF_K) for rankings in zip(ranked, lexical)]
+            candidates = [self.store.get_documents(ids[:self.k]) for ids in ranked]
+        searched = time.perf_counter()
+        # Coût du lot réparti sur ses questions
+        timings = {"embedding": round((embedded - started) / len(items), 4),
+                   "retrieval": round((searched - embedded) / len(items), 4)}
+        return candidates, timings
+
+    def answer(self, item_id, question, docs, timings):
+        """Pack the context and ask the router, retrying on rate limits and transient errors."""
+        record = {"id": item_id, "question": question, "answer": None, "sources": [], "attempts": 0,
+                  "error": None, "timings": dict(timings)}
+        started = time.perf_counter()
+        try:
+            if self.packer is not None:
+                docs, _ = self.packer.pack(question, docs)
+            record["timings"]["packing"] = round(time.perf_counter() - started, 4)
+            sources = (doc.metadata.get("file_name") or doc.metadata.get("source") for doc in docs)
+            record["sources"] = [source for source in dict.fromkeys(sources) if source]
+            llm_started = time.perf_counter()
+            answer, decision = self._ask(question, docs, record)
+            record["timings"]["llm"] = round(time.perf_counter() - llm_started, 4)
+            record.update(answer=answer, tier=decision.get("tier"), winner=decision.get("winner"),
+                          escalated=decision.get("escalated"), confidence=decision.get("confidence"))
+        except Exception as e:
+            record["error"] = f"{type(e).__name__}: {e}"
+        record["timings"]["total"] = round(time.perf_counter() - started + sum(timings.values()), 4)
+        registry.inc("llmops_batch_questions_total", status="error" if record["error"] else "ok")
+        return record
+
+    def _ask(self, question, docs, record):
+        def call():
+            record["attempts"] += 1
+            return self.router.answer(question, docs=docs)
+
+        return self._with_retries(call, f"Question {record['id']}")
+
+    def _with_retries(self, call, label):
+        """Run ``call()`` behind the shared gate, retrying rate limits and transient errors with backoff."""
+        attempts = 0
+        while True:
+            self.gate.wait()
+            attempts += 1
+            try:
+                return call()
+            except openai.RateLimitError as e:
+                reason, error = "rate_limit", e
+            except TRANSIENT_ERRORS as e:
+                reason, error = "transient", e
+            if attempts > self.max_retries:
+                raise error
+            delay = min(BATCH_MAX_BACKOFF, self.backoff * 2 ** (attempts - 1)) * random.uniform(0.5, 1.0)
+            if reason == "rate_limit":
+                delay = max(delay, retry_after(error) or 0.0)
+                self.gate.pause(delay)
+            registry.inc("llmops_batch_retries_total", reason=reason)
+            print(f"⏳ {label} : {reason}, nouvel essai dans {delay:.1f} s")
+            time.sleep(delay)
+
+    def iter_answers(self, items):
+        """Yield one record per ``(id, question)`` as soon as it is answered (unordered)."""
+        items = iter(items)
+        with ThreadPoolExecutor(self.concurrency, thread_name_prefix="batch-qa") as pool:
+            running = []
+            while True:
+                batch = [item for _, item in zip(range(self.batch_size), items)]
+                if batch:
+                    candidates, timings = self.retrieve(batch)
+                    # Le lot précédent se termine pendant que celui-ci était cherché
+                    for future in as_completed(running):
+                        yield future.result()
+                    running = [pool.submit(self.answer, item_id, question, docs, timings)
+                               for (item_id, question), docs in zip(batch, candidates)]
+                else:
+                    for future in as_completed(running):
+                        yield future.result()
+                    return
+
+    def run(self, items, output_path, resume=True):
+        """Answer ``items`` into the JSONL file ``output_path`` and return a summary.
+
+        With ``resume``, the ids already answered in ``output_path`` are skipped and new
+        records are appended; failed ones are tried again.
+        """
+        done = completed_ids(output_path) if resume else set()
+        pending = (item for item in items if item[0] not in done)
+        summary = {"skipped": len(done), "answered": 0, "errors": 0}
+        started = time.perf_counter()
+        with open(output_path, "a" if resume else "w", encoding="utf-8") as out:
+            # Ligne tronquée par une interruption : la suite repart sur une nouvelle ligne
+            if resume and not ends_with_newline(output_path):
+                out.write("\n")
+            for record in self.iter_answers(pending):
+                out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                out.flush()
+                summary["errors" if record["error"] else "answered"] += 1
+        summary["seconds"] = round(time.perf_counter() - started, 3)
+        total = summary["answered"] + summary["errors"]
+        print(f"📦 Lot terminé : {summary['answered']} réponse(s), {summary['errors']} erreur(s), "
+              f"{summary['skipped']} déjà traitée(s) — {total / max(summary['seconds'], 1e-9):.1f} question(s)/s")
+        return summary
+
+
+# 🖥️ Réponses en lot depuis un fichier de questions
+def main():
+    from embedding_cache import cached_openai_embeddings
+    from model_router import create_model_router
+    from vectorstore_service import get_vectorstore_manager
+
+    parser = argparse.ArgumentParser(description="Répond à un fichier de questions (texte ou JSONL) vers un JSONL.")
+    parser.add_argument("questions")
+    parser.add_argument("-o", "--output", default="answers.jsonl")
+    parser.add_argument("--vectorstore", default=os.getenv("VECTOR_DB_PATH", "vectorstore"))
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY)
+    parser.add_argument("--max-retries", type=int, default=BATCH_MAX_RETRIES)
+    parser.add_argument("--no-hybrid", action="store_true")
+    parser.add_argument("--no-resume", action="store_true", help="réécrit le fichier de sortie")
+    args = parser.parse_args()
+
+    load_dotenv()
+    store = get_vectorstore_manager(args.vectorstore, cached_openai_embeddings())
+    # Les reprises sont gérées ici (pause partagée), pas par le client OpenAI
+    router = create_model_router(None, temperature=0, max_retries=0)
+    answerer = BatchAnswerer(store, router, hybrid=not args.no_hybrid, batch_size=args.batch_size,
+                             concurrency=args.concurrency, max_retries=args.max_retries)
+    answerer.run(read_questions(args.questions), args.output, resume=not args.no_resume)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,387 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+import numpy as np
+
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+SCENARIOS = ["faiss_load_save", "store_load", "chatbot_ask", "flask_ask", "chainlit_message", "pdf_ingestion"]
+DEFAULT_SIZES = "1000,10000,100000,1000000"
+
+QUESTIONS = [
+    "Quelle est la durée de résidence exigée pour la naturalisation ?",
+    "Quel certificat de langue B1 est accepté ?",
+    "Quels documents faut-il fournir pour le dossier ?",
+    "Que dit l'article 21-17 du code civil ?",
+    "Combien de temps dure l'instruction du dossier ?",
+    "Où déposer la demande de naturalisation ?",
+]
+
+
+# 📊 Statistiques de latence
+def summarize(samples, wall_seconds):
+    samples = np.asarray(samples, dtype="float64") * 1000
+    return {
+        "count": int(samples.size),
+        "mean_ms": round(float(samples.mean()), 3),
+        "p50_ms": round(float(np.percentile(samples, 50)), 3),
+        "p95_ms": round(float(np.percentile(samples, 95)), 3),
+        "p99_ms": round(float(np.percentile(samples, 99)), 3),
+        "throughput_per_s": round(samples.size / wall_seconds, 3) if wall_seconds else None,
+    }
+
+
+def measure(func, iterations, concurrency=1):
+    def timed(i):
+        started = time.perf_counter()
+        func(i)
+        return time.perf_counter() - started
+
+    started = time.perf_counter()
+    if concurrency > 1:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            samples = list(pool.map(timed, range(iterations)))
+    else:
+        samples = [timed(i) for i in range(iterations)]
+    return summarize(samples, time.perf_counter() - started)
+
+
+async def measure_async(coro_func, iterations, concurrency=1):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def timed(i):
+        async with semaphore:
+            started = time.perf_counter()
+            await coro_func(i)
+            return time.perf_counter() - started
+
+    started = time.perf_counter()
+    samples = await asyncio.gather(*(timed(i) for i in range(iterations)))
+    return summarize(samples, time.perf_counter() - started)
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Octets sous macOS, kilo-octets sous Linux
+    return round(peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024, 1)
+
+
+def question(i):
+    # Questions toutes différentes pour ne pas mesurer uniquement le cache des réponses
+    return f"{QUESTIONS[i % len(QUESTIONS)]} (variante {i})"
+
+
+# 🏗️ Vectorstore synthétique de `size` morceaux, construit sans appel d'embeddings
+# (format pickle de save_local pour la comparaison, puis format segmenté lu par l'application)
+def build_store(path, size, dim):
+    if os.path.exists(os.path.join(path, "index.faiss")):
+        from segment_store import SegmentStore, migrate
+        if not SegmentStore(path).exists():
+            migrate(path, None)
+        return None
+    import faiss
+    from langchain_community.docstore.in_memory import InMemoryDocstore
+    from langchain_community.vectorstores import FAISS
+    from langchain_core.documents import Document
+    from fakes import FakeOpenAIEmbeddings
+
+    started = time.perf_counter()
+    rng = np.random.default_rng(size)
+    index = faiss.IndexFlatL2(dim)
+    docs = {}
+    for start in range(0, size, 100_000):
+        count = min(100_000, size - start)
+        vectors = rng.standard_normal((count, dim)).astype("float32")
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        index.add(vectors)
+        for i in range(start, start + count):
+            docs[str(i)] = Document(page_content=f"Document synthétique n°{i} : article 21-{i % 100}, décret {i}.")
+    db = FAISS(FakeOpenAIEmbeddings(dim=dim), index, InMemoryDocstore(docs), {i: str(i) for i in range(size)})
+    db.save_local(path)
+    from segment_store import SegmentStore
+    SegmentStore(path).write(db)
+    return time.perf_counter() - started
+
+
+# 🧪 Scénarios (exécutés chacun dans un processus dédié)
+def bench_faiss_load_save(store, args, result):
+    from langchain_community.vectorstores import FAISS
+    from fakes import FakeOpenAIEmbeddings
+
+    embeddings = FakeOpenAIEmbeddings(dim=args.dim)
+    started = time.perf_counter()
+    db = FAISS.load_local(store, embeddings, allow_dangerous_deserialization=True)
+    result["startup_seconds"] = round(time.perf_counter() - started, 4)
+    iterations = max(1, min(args.iterations, 5))
+    result["load_local"] = measure(
+        lambda i: FAISS.load_local(store, embeddings, allow_dangerous_deserialization=True), iterations
+    )
+    with tempfile.TemporaryDirectory() as tmp:
+        result["save_local"] = measure(lambda i: db.save_local(tmp), iterations)
+
+
+def bench_store_load(store, args, result):
+    # Format segmenté (docstore SQLite paresseux) face à FAISS.load_local (pickle complet)
+    from langchain_community.vectorstores import FAISS
+    from fakes import FakeOpenAIEmbeddings
+    from segment_store import SegmentStore
+
+    embeddings = FakeOpenAIEmbeddings(dim=args.dim, latency=0)
+    iterations = max(1, min(args.iterations, 5))
+
+    def open_segments(i):
+        store_i = SegmentStore(store)
+        store_i.open(embeddings).similarity_search("article 21-17", k=4)
+        store_i.close()
+
+    started = time.perf_counter()
+    open_segments(0)
+    result["startup_seconds"] = round(time.perf_counter() - started, 4)
+    result["segment_open"] = measure(open_segments, iterations)
+    result["load_local"] = measure(
+        lambda i: FAISS.load_local(store, embeddings, allow_dangerous_deserialization=True)
+        .similarity_search("article 21-17", k=4), iterations
+    )
+
+    # Coût d'une sauvegarde de 50 ajouts : segment ajouté contre réécriture complète
+    texts = [f"Nouveau fait {i}." for i in range(50)]
+    with tempfile.TemporaryDirectory() as tmp:
+        copy = os.path.join(tmp, "vectorstore")
+        shutil.copytree(store, copy)
+        segments = SegmentStore(copy, compact_after=0)
+        db = segments.open(embeddings)
+
+        def append(i):
+            vectors = embeddings.embed_documents(texts)
+            db.add_embeddings(list(zip(texts, vectors)))
+            segments.append(vectors, db.docstore)
+
+        result["segment_append"] = measure(append, iterations)
+        started = time.perf_counter()
+        segments.compact()
+        result["compaction_seconds"] = round(time.perf_counter() - started, 4)
+        segments.close()
+
+        legacy = FAISS.load_local(copy, embeddings, allow_dangerous_deserialization=True)
+
+        def save(i):
+            legacy.add_texts(texts)
+            legacy.save_local(copy)
+
+        result["save_local"] = measure(save, iterations)
+
+
+def bench_chatbot_ask(store, args, result):
+    os.environ["VECTOR_DB_PATH"] = store
+    started = time.perf_counter()
+    import app_local
+    result["startup_seconds"] = round(time.perf_counter() - started, 4)
+    chatbot = app_local.chatbot
+    result["latency"] = measure(lambda i: chatbot.ask(question(i)), args.iterations, args.concurrency)
+    result["answer_cache"] = chatbot.cache.stats()
+
+
+def bench_flask_ask(store, args, result):
+    os.environ["VECTOR_DB_PATH"] = store
+    os.environ.setdefault("FLASK_SECRET_KEY", "benchmark")
+    os.environ.setdefault("HISTORY_DB_PATH", os.path.join(args.workdir, "history.sqlite"))
+    started = time.perf_counter()
+    import app_local
+    result["startup_seconds"] = round(time.perf_counter() - started, 4)
+    local = threading.local()
+
+    def ask(i):
+        if not hasattr(local, "client"):
+            local.client = app_local.app.test_client()
+        response = local.client.post("/ask", data={"question": question(i)})
+        assert response.status_code == 200, response.status_code
+
+    result["latency"] = measure(ask, args.iterations, args.concurrency)
+
+
+def bench_chainlit_message(store, args, result):
+    # app.py charge "vectorstore" depuis le répertoire courant
+    workdir = tempfile.mkdtemp()
+    os.symlink(store, os.path.join(workdir, "vectorstore"))
+    os.environ.setdefault("CHAINLIT_APP_ROOT", REPO_DIR)
+    os.chdir(workdir)
+    started = time.perf_counter()
+    import app
+    import chainlit as cl
+    from chainlit.context import init_http_context
+    result["startup_seconds"] = round(time.perf_counter() - started, 4)
+
+    async def handle(i):
+        init_http_context()
+        await app.handle_message(cl.Message(content=question(i)))
+
+    async def run():
+        return await measure_async(handle, args.iterations, args.concurrency)
+
+    result["latency"] = asyncio.run(run())
+    result["memory_learner"] = app.memory_learner.stats()
+
+
+def bench_pdf_ingestion(store, args, result):
+    from embedding_cache import CachedEmbeddings
+    from fakes import FakeOpenAIEmbeddings, write_synthetic_pdf
+    from ingestion import IngestionEngine
+    from vectorstore_service import get_vectorstore_manager
+
+    with tempfile.TemporaryDirectory() as tmp:
+        copy = os.path.join(tmp, "vectorstore")
+        shutil.copytree(store, copy)
+        files = []
+        for f in range(args.pdf_files):
+            path = os.path.join(tmp, f"document_{f}.pdf")
+            write_synthetic_pdf(path, [
+                f"Document {f}, page {p} : conditions de résidence, article 21-{p}, pièces justificatives. " * 8
+                for p in range(args.pdf_pages)
+            ])
+            files.append((path, os.path.basename(path)))
+
+        embeddings = CachedEmbeddings(FakeOpenAIEmbeddings(dim=args.dim), path=os.path.join(tmp, "cache.sqlite"))
+        manager = get_vectorstore_manager(copy, embeddings)
+        started = time.perf_counter()
+        manager.db
+        result["startup_seconds"] = round(time.perf_counter() - started, 4)
+
+        engine = IngestionEngine(manager)
+        started = time.perf_counter()
+        reports = engine.ingest_files(files)
+        manager.flush()
+        elapsed = time.perf_counter() - started
+        engine.shutdown()
+
+    pages = sum(report["pages"] for report in reports)
+    result["ingestion"] = {
+        "files": len(files),
+        "pages": pages,
+        "chunks_added": sum(report["added"] for report in reports),
+        "seconds": round(elapsed, 4),
+        "pages_per_s": round(pages / elapsed, 3) if elapsed else None,
+    }
+
+
+def run_child(args):
+    from fakes import install_fakes
+
+    install_fakes()
+    os.environ["EMBEDDING_CACHE_PATH"] = os.path.join(tempfile.mkdtemp(), "embedding_cache.sqlite")
+    store = os.path.abspath(os.path.join(args.workdir, f"vs_{args.size}_{args.dim}"))
+    result = {"scenario": args.scenario, "size": args.size}
+    globals()[f"bench_{args.scenario}"](store, args, result)
+    result["peak_rss_mb"] = peak_rss_mb()
+    # Dernière ligne de la sortie : résultat JSON lu par le processus parent
+    print(json.dumps(result), flush=True)
+    sys.stdout.flush()
+    os._exit(0)
+
+
+def child_command(args, scenario, size):
+    command = [sys.executable, os.path.abspath(__file__), "--child", "--scenario", scenario, "--size", str(size)]
+    for option in ["workdir", "dim", "iterations", "concurrency", "pdf_files", "pdf_pages"]:
+        command += [f"--{option.replace('_', '-')}", str(getattr(args, option))]
+    return command
+
+
+# 🔁 Comparaison avec un résultat précédent pour détecter les régressions
+def compare(results, baseline_path, tolerance):
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {(r["scenario"], r["size"]): r for r in json.load(f)["results"]}
+    regressions = []
+    for current in results:
+        previous = baseline.get((current["scenario"], current["size"]))
+        if not previous:
+            continue
+        for section in ["latency", "load_local", "save_local", "segment_open", "segment_append"]:
+            if section in current and section in previous:
+                before, after = previous[section]["p95_ms"], current[section]["p95_ms"]
+                if before and after > before * (1 + tolerance):
+                    regressions.append(f"{current['scenario']}@{current['size']} {section} p95 : {before} → {after} ms")
+        before, after = previous.get("startup_seconds"), current.get("startup_seconds")
+        if before and after and after > before * (1 + tolerance):
+            regressions.append(f"{current['scenario']}@{current['size']} démarrage : {before} → {after} s")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks hors-ligne (LLM et embeddings simulés).")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help="tailles du vectorstore (nombre de morceaux)")
+    parser.add_argument("--dim", type=int, default=int(os.getenv("FAKE_EMBED_DIM", "1536")))
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--pdf-files", type=int, default=4)
+    parser.add_argument("--pdf-pages", type=int, default=20)
+    parser.add_argument("--workdir", default=os.path.join(REPO_DIR, "bench_data"))
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--compare", help="fichier JSON d'un run précédent")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--scenario", help=argparse.SUPPRESS)
+    parser.add_argument("--size", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    sys.path.insert(0, REPO_DIR)
+    os.environ["FAKE_EMBED_DIM"] = str(args.dim)
+    if args.child:
+        run_child(args)
+        return
+
+    os.makedirs(args.workdir, exist_ok=True)
+    results = []
+    for size in [int(size) for size in args.sizes.split(",")]:
+        build_seconds = build_store(os.path.join(args.workdir, f"vs_{size}_{args.dim}"), size, args.dim)
+        if build_seconds is not None:
+            print(f"🏗️ Vectorstore synthétique de {size} morceaux construit en {build_seconds:.1f}s")
+        for scenario in args.scenarios.split(","):
+            completed = subprocess.run(child_command(args, scenario, size), capture_output=True, text=True)
+            if completed.returncode != 0:
+                print(f"❌ {scenario}@{size} :\n{completed.stderr[-2000:]}")
+                continue
+            result = json.loads(completed.stdout.strip().splitlines()[-1])
+            results.append(result)
+            print(f"✅ {scenario}@{size} : {json.dumps(result)}")
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "args": {key: value for key, value in vars(args).items() if key not in ("child", "scenario", "size")},
+        },
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"📄 Résultats écrits dans {args.output}")
+
+    if args.compare:
+        regressions = compare(results, args.compare, args.tolerance)
+        for regression in regressions:
+            print(f"⚠️ Régression : {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
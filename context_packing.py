@@ -0,0 +1,189 @@
+import os
+import threading
+from typing import Any, List
+
+import numpy as np
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from conversation_store import estimate_tokens
+from hybrid_retrieval import RETRIEVER_FETCH_K, RETRIEVER_K
+from memory_index import DOC_PREFIX, TIMESTAMP_PREFIX
+from metrics import registry, span
+from session_index import SessionAwareRetriever
+
+
+# ⚙️ Réglages de l'assemblage du contexte (surchargeables par variables d'environnement)
+CONTEXT_PACKING = os.getenv("CONTEXT_PACKING", "1") == "1"
+CONTEXT_CANDIDATES = int(os.getenv("CONTEXT_CANDIDATES", "20"))
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "800"))
+CONTEXT_DUP_THRESHOLD = float(os.getenv("CONTEXT_DUP_THRESHOLD", "0.92"))
+CONTEXT_MMR_LAMBDA = float(os.getenv("CONTEXT_MMR_LAMBDA", "0.7"))
+CONTEXT_MIN_OVERLAP = 20
+
+_encoder = None
+_encoder_lock = threading.Lock()
+
+
+def count_tokens(text):
+    """Count GPT tokens with tiktoken, or estimate them when the encoding is unavailable."""
+    global _encoder
+    with _encoder_lock:
+        if _encoder is None:
+            try:
+                import tiktoken
+                _encoder = tiktoken.get_encoding("cl100k_base")
+            except Exception as e:
+                print(f"⚠️ Encodage tiktoken indisponible, estimation des tokens : {e}")
+                _encoder = False
+    return len(_encoder.encode(text)) if _encoder else estimate_tokens(text)
+
+
+def strip_prefix(text):
+    """Drop the ``[timestamp] (Doc: name)`` prefix that ingested chunks and memories carry."""
+    text = text.strip()
+    match = DOC_PREFIX.match(text) or TIMESTAMP_PREFIX.match(text)
+    return text[match.end():].lstrip() if match else text
+
+
+def overlap_length(previous, following, min_length=CONTEXT_MIN_OVERLAP):
+    """Length of the longest suffix of ``previous`` that starts ``following``."""
+    for length in range(min(len(previous), len(following)), min_length - 1, -1):
+        if previous.endswith(following[:length]):
+            return length
+    return 0
+
+
+# 🧩 Assemblage du contexte : sur-échantillonnage, suppression des recouvrements et
+# quasi-doublons, reclassement MMR puis remplissage d'un budget de tokens.
+class ContextPacker:
+    def __init__(self, embeddings, token_budget=CONTEXT_TOKEN_BUDGET, dup_threshold=CONTEXT_DUP_THRESHOLD,
+                 mmr_lambda=CONTEXT_MMR_LAMBDA, baseline_k=RETRIEVER_K, store=None):
+        self.embeddings = embeddings
+        # Vecteurs des candidats relus dans l'index du store (pas d'appel d'embeddings sur le chemin chaud)
+        self.store = store
+        self.token_budget = token_budget
+        self.dup_threshold = dup_threshold
+        self.mmr_lambda = mmr_lambda
+        self.baseline_k = baseline_k
+
+    def pack(self, query, docs):
+        """Return ``(packed_docs, report)`` for the candidates ``docs`` ranked by the retriever."""
+        docs = list(docs)
+        report = {"candidates": len(docs), "passages": 0, "duplicates": 0, "tokens": 0, "baseline_tokens": 0,
+                  "tokens_saved": 0}
+        if not docs:
+            return [], report
+        # Référence : ce qu'aurait envoyé la chaîne « stuff » avec les k premiers résultats
+        report["baseline_tokens"] = sum(count_tokens(doc.page_content) for doc in docs[:self.baseline_k])
+
+        vectors = self._vectors(docs)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True) + 1e-12
+        query_vector = np.asarray(self.embeddings.embed_query(query), dtype="float32")
+        query_vector /= np.linalg.norm(query_vector) or 1.0
+        relevance = vectors @ query_vector
+        similarity = vectors @ vectors.T
+
+        # Quasi-doublons (ex. le même fait mémorisé deux fois) : seul le mieux classé est gardé
+        kept = []
+        for i in range(len(docs)):
+            if any(similarity[i, j] >= self.dup_threshold for j in kept):
+                report["duplicates"] += 1
+            else:
+                kept.append(i)
+
+        packed, chosen, used = [], [], 0
+        for i in self._mmr(kept, relevance, similarity):
+            text = self._trim_overlap(docs, i, chosen)
+            if text and docs[i].metadata.get("file_name"):
+                # Le modèle doit savoir de quel document vient le passage
+                text = f"(Doc: {docs[i].metadata['file_name']}) {text}"
+            tokens = count_tokens(text)
+            if not text or used + tokens > self.token_budget:
+                continue
+            used += tokens
+            chosen.append(i)
+            # La pertinence sert au routeur de modèles (confiance de la recherche)
+            packed.append(Document(page_content=text, metadata={**docs[i].metadata, "relevance": float(relevance[i])}))
+
+        report["passages"] = len(packed)
+        report["tokens"] = used
+        report["tokens_saved"] = max(0, report["baseline_tokens"] - used)
+        return packed, report
+
+    def _vectors(self, docs):
+        stored = {}
+        if self.store is not None:
+            ids = [doc.id for doc in docs if doc.id]
+            stored = self.store.get_vectors(ids) if ids else {}
+        # Documents hors du store (ex. envois de la session) : embeddings, via le cache disque
+        missing = [i for i, doc in enumerate(docs) if doc.id not in stored]
+        embedded = self.embeddings.embed_documents([docs[i].page_content for i in missing]) if missing else []
+        vectors = [stored.get(doc.id) for doc in docs]
+        for i, vector in zip(missing, embedded):
+            vectors[i] = vector
+        return np.asarray(vectors, dtype="float32")
+
+    def _mmr(self, candidates, relevance, similarity):
+        order, remaining = [], list(candidates)
+        while remaining:
+            def score(i):
+                redundancy = max((similarity[i, j] for j in order), default=0.0)
+                return self.mmr_lambda * relevance[i] - (1 - self.mmr_lambda) * redundancy
+            best = max(remaining, key=score)
+            order.append(best)
+            remaining.remove(best)
+        return order
+
+    @staticmethod
+    def _trim_overlap(docs, i, chosen):
+        # Les morceaux voisins d'un même fichier se recouvrent (chunk_overlap) : la partie déjà
+        # présente dans un passage retenu n'est pas envoyée une seconde fois.
+        text = strip_prefix(docs[i].page_content)
+        file_name = docs[i].metadata.get("file_name")
+        for j in chosen:
+            if docs[j].metadata.get("file_name") != file_name:
+                continue
+            other = strip_prefix(docs[j].page_content)
+            text = text[overlap_length(other, text):]
+            cut = overlap_length(text, other)
+            if cut:
+                text = text[:-cut]
+        return text.strip()
+
+
+# 🔎 Retriever qui sur-échantillonne puis confie les candidats au ContextPacker
+class PackedRetriever(BaseRetriever):
+    retriever: Any
+    packer: Any
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        docs = self.retriever.invoke(query)
+        with span("context_packing"):
+            packed, report = self.packer.pack(query, docs)
+        registry.inc("llmops_context_tokens_total", report["tokens"], kind="packed")
+        registry.inc("llmops_context_tokens_total", report["tokens_saved"], kind="saved")
+        print(f"🧩 Contexte : {report['passages']}/{report['candidates']} passage(s), {report['tokens']} tokens "
+              f"({report['tokens_saved']} économisé(s), {report['duplicates']} doublon(s))")
+        return packed
+
+
+def build_retriever(store, hybrid=True, packing=CONTEXT_PACKING, sessions=None):
+    """Build the retriever used by the QA chains, with context packing unless disabled.
+
+    With ``sessions`` (a ``SessionIndexStore``), the current session's uploads are
+    searched too and merged with the store's candidates.
+    """
+    if not packing:
+        candidates = store.as_hybrid_retriever() if hybrid else store.as_retriever()
+    elif hybrid:
+        candidates = store.as_hybrid_retriever(k=CONTEXT_CANDIDATES, fetch_k=max(RETRIEVER_FETCH_K, CONTEXT_CANDIDATES))
+    else:
+        candidates = store.as_retriever(k=CONTEXT_CANDIDATES)
+    if sessions is not None:
+        candidates = SessionAwareRetriever(retriever=candidates, sessions=sessions,
+                                           k=CONTEXT_CANDIDATES if packing else RETRIEVER_K)
+    if not packing:
+        return candidates
+    return PackedRetriever(retriever=candidates, packer=ContextPacker(store.embeddings, store=store))
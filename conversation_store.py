@@ -0,0 +1,259 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+from datetime import datetime
+
+
+# ⚙️ Réglages de l'historique (surchargeables par variables d'environnement)
+HISTORY_MAX_TURNS = int(os.getenv("HISTORY_MAX_TURNS", "20"))
+HISTORY_MAX_SESSIONS = int(os.getenv("HISTORY_MAX_SESSIONS", "10000"))
+HISTORY_SESSION_TTL = float(os.getenv("HISTORY_SESSION_TTL", "86400"))
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "0"))
+HISTORY_DB_PATH = os.getenv("HISTORY_DB_PATH", "history.sqlite")
+
+
+def estimate_tokens(text):
+    # Approximation suffisante pour un budget : ~4 caractères par token
+    return max(1, len(text) // 4)
+
+
+def turn_tokens(turn):
+    return estimate_tokens(turn["question"]) + estimate_tokens(turn["response"])
+
+
+def new_turn(question, response):
+    return {"question": question, "response": response, "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
+
+
+# 💬 Historique d'une session : tampon circulaire des derniers échanges
+# et résumé optionnel des échanges plus anciens.
+class SessionHistory:
+    def __init__(self, max_turns):
+        self.turns = deque(maxlen=max_turns)
+        self.summary = ""
+        self.total_turns = 0
+        self.last_seen = time.monotonic()
+
+    def tokens(self):
+        return estimate_tokens(self.summary) + sum(turn_tokens(turn) for turn in self.turns)
+
+
+class ConversationStore:
+    def __init__(self, max_turns=HISTORY_MAX_TURNS, max_sessions=HISTORY_MAX_SESSIONS,
+                 session_ttl=HISTORY_SESSION_TTL, token_budget=HISTORY_TOKEN_BUDGET, summarizer=None):
+        """``summarizer(summary, turns) -> str`` folds old turns into the running summary.
+
+        It is only used when ``token_budget`` is set; without it, turns that fall
+        out of the ring buffer are simply dropped.
+        """
+        self.max_turns = max_turns
+        self.max_sessions = max_sessions
+        self.session_ttl = session_ttl
+        self.token_budget = token_budget
+        self.summarizer = summarizer
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _session(self, session_id):
+        history = self._sessions.get(session_id)
+        if history is None:
+            history = SessionHistory(self.max_turns)
+            self._sessions[session_id] = history
+            self._evict()
+        self._sessions.move_to_end(session_id)
+        history.last_seen = time.monotonic()
+        return history
+
+    def _evict(self):
+        now = time.monotonic()
+        while self._sessions:
+            oldest_id, oldest = next(iter(self._sessions.items()))
+            if len(self._sessions) > self.max_sessions or now - oldest.last_seen > self.session_ttl:
+                del self._sessions[oldest_id]
+            else:
+                break
+
+    def add_turn(self, session_id, question, response):
+        turn = new_turn(question, response)
+        with self._lock:
+            history = self._session(session_id)
+            overflow = history.turns[0] if len(history.turns) == history.turns.maxlen else None
+            history.turns.append(turn)
+            history.total_turns += 1
+        if self.summarizer and self.token_budget:
+            self._compact(history, overflow)
+        return turn
+
+    def _compact(self, history, overflow):
+        # Les échanges les plus anciens sont résumés tant que le budget est dépassé
+        folded = [overflow] if overflow else []
+        with self._lock:
+            while history.tokens() > self.token_budget and len(history.turns) > 1:
+                folded.append(history.turns.popleft())
+        if folded:
+            summary = self.summarizer(history.summary, folded)
+            with self._lock:
+                history.summary = summary
+
+    def page(self, session_id, offset=0, limit=10):
+        """Return turns newest first, ``limit`` at a time starting at ``offset``."""
+        turns, summary = self._history(session_id)
+        return {
+            "turns": list(reversed(turns))[offset:offset + limit],
+            "total": len(turns),
+            "offset": offset,
+            "limit": limit,
+            "summary": summary,
+        }
+
+    def _history(self, session_id):
+        """Return the ``(turns, summary)`` of a session, oldest turn first."""
+        with self._lock:
+            history = self._sessions.get(session_id)
+            return (list(history.turns), history.summary) if history else ([], "")
+
+    def turns(self, session_id):
+        return self._history(session_id)[0]
+
+    def messages(self, session_id, system_prompt=None):
+        """Return the history as chat messages, with the summary as extra context."""
+        turns, summary = self._history(session_id)
+        messages = []
+        if system_prompt:
+            messages.append({"role": "system", "content": system_prompt})
+        if summary:
+            messages.append({"role": "system", "content": f"Résumé de la conversation précédente : {summary}"})
+        for turn in turns:
+            messages.append({"role": "user", "content": turn["question"]})
+            messages.append({"role": "assistant", "content": turn["response"]})
+        return messages
+
+    def reset(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def __len__(self):
+        return len(self._sessions)
+
+
+# 🗄️ Historique partagé dans SQLite : les workers gunicorn (un processus chacun) voient
+# les mêmes sessions, quel que soit le worker qui reçoit la requête.
+class SharedConversationStore(ConversationStore):
+    def __init__(self, path=HISTORY_DB_PATH, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        # Autocommit : les transactions sont ouvertes explicitement (BEGIN IMMEDIATE) entre processus
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS sessions (session_id TEXT PRIMARY KEY, "
+                           "summary TEXT NOT NULL DEFAULT '', last_seen REAL NOT NULL)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS turns (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                           "session_id TEXT NOT NULL, question TEXT NOT NULL, response TEXT NOT NULL, "
+                           "timestamp TEXT NOT NULL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS turns_session ON turns (session_id, id)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS sessions_last_seen ON sessions (last_seen)")
+
+    def close(self):
+        self._conn.close()
+
+    def _transaction(self, work):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = work(self._conn)
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+            return result
+
+    @staticmethod
+    def _rows(conn, session_id):
+        """Return the ``(id, turn)`` pairs of a session, oldest first."""
+        rows = conn.execute("SELECT id, question, response, timestamp FROM turns WHERE session_id = ? ORDER BY id",
+                            (session_id,))
+        return [(turn_id, {"question": question, "response": response, "timestamp": timestamp})
+                for turn_id, question, response, timestamp in rows]
+
+    @staticmethod
+    def _drop(conn, rows):
+        conn.executemany("DELETE FROM turns WHERE id = ?", [(turn_id,) for turn_id, _ in rows])
+        return [turn for _, turn in rows]
+
+    @staticmethod
+    def _delete(conn, session_id):
+        conn.execute("DELETE FROM turns WHERE session_id = ?", (session_id,))
+        conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+
+    def _evict(self, conn, current):
+        # Horloge murale : last_seen est comparé d'un processus à l'autre ; la session courante est gardée
+        expired = [row[0] for row in conn.execute(
+            "SELECT session_id FROM sessions WHERE last_seen < ? UNION SELECT session_id FROM "
+            "(SELECT session_id FROM sessions ORDER BY session_id = ? DESC, last_seen DESC LIMIT -1 OFFSET ?)",
+            (time.time() - self.session_ttl, current, self.max_sessions))]
+        for session_id in expired:
+            self._delete(conn, session_id)
+
+    def add_turn(self, session_id, question, response):
+        turn = new_turn(question, response)
+
+        def write(conn):
+            conn.execute("INSERT INTO sessions (session_id, last_seen) VALUES (?, ?) "
+                         "ON CONFLICT (session_id) DO UPDATE SET last_seen = excluded.last_seen",
+                         (session_id, time.time()))
+            conn.execute("INSERT INTO turns (session_id, question, response, timestamp) VALUES (?, ?, ?, ?)",
+                         (session_id, turn["question"], turn["response"], turn["timestamp"]))
+            self._evict(conn, session_id)
+            rows = self._rows(conn, session_id)
+            # Tampon circulaire : les échanges au-delà de max_turns sont retirés (et résumés si budget)
+            folded = self._drop(conn, rows[:max(0, len(rows) - self.max_turns)])
+            rows = rows[len(folded):]
+            if self.summarizer and self.token_budget:
+                summary = conn.execute("SELECT summary FROM sessions WHERE session_id = ?",
+                                       (session_id,)).fetchone()[0]
+                tokens = estimate_tokens(summary) + sum(turn_tokens(turn) for _, turn in rows)
+                over = 0
+                while tokens > self.token_budget and len(rows) - over > 1:
+                    tokens -= turn_tokens(rows[over][1])
+                    over += 1
+                folded += self._drop(conn, rows[:over])
+                return summary, folded
+            return None, []
+
+        summary, folded = self._transaction(write)
+        if folded:
+            # Appel du modèle hors transaction : les autres workers ne sont pas bloqués
+            summary = self.summarizer(summary, folded)
+            self._transaction(lambda conn: conn.execute("UPDATE sessions SET summary = ? WHERE session_id = ?",
+                                                        (summary, session_id)))
+        return turn
+
+    def _history(self, session_id):
+        with self._lock:
+            row = self._conn.execute("SELECT summary FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+            if row is None:
+                return [], ""
+            return [turn for _, turn in self._rows(self._conn, session_id)], row[0]
+
+    def reset(self, session_id):
+        self._transaction(lambda conn: self._delete(conn, session_id))
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+
+def llm_summarizer(llm):
+    """Build a summarizer that asks ``llm`` to fold old turns into the summary."""
+    def summarize(summary, turns):
+        exchanges = "\n".join(f"Utilisateur : {turn['question']}\nAssistant : {turn['response']}" for turn in turns)
+        prompt = (
+            "Résume en quelques phrases les informations utiles de cette conversation "
+            "sur la naturalisation française.\n\n"
+            f"Résumé existant : {summary or 'aucun'}\n\nNouveaux échanges :\n{exchanges}"
+        )
+        return llm.invoke(prompt).content.strip()
+    return summarize
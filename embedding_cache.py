@@ -0,0 +1,101 @@
+import hashlib
+import os
+import sqlite3
+import threading
+from array import array
+from typing import List
+
+from langchain_core.embeddings import Embeddings
+from langchain_openai import OpenAIEmbeddings
+
+from metrics import registry, span
+
+
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "embedding_cache.sqlite")
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "512"))
+# Limite de variables par requête SQLite
+_SQL_CHUNK = 500
+
+_connections = {}
+_connections_lock = threading.Lock()
+
+
+def _open(path):
+    key = os.path.abspath(path)
+    with _connections_lock:
+        if key not in _connections:
+            conn = sqlite3.connect(key, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)")
+            conn.commit()
+            _connections[key] = (conn, threading.Lock())
+        return _connections[key]
+
+
+# 💾 Embeddings avec cache disque adressé par contenu : sha256(modèle + texte) -> vecteur.
+# Les textes déjà vus ne déclenchent aucun appel distant, les autres sont envoyés par lots.
+class CachedEmbeddings(Embeddings):
+    def __init__(self, underlying, model_name=None, path=EMBEDDING_CACHE_PATH, batch_size=EMBEDDING_BATCH_SIZE):
+        self.underlying = underlying
+        self.model_name = model_name or getattr(underlying, "model", type(underlying).__name__)
+        self.batch_size = batch_size
+        self._conn, self._lock = _open(path)
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, text):
+        return hashlib.sha256(f"{self.model_name}\0{text}".encode("utf-8")).hexdigest()
+
+    def _fetch(self, keys):
+        found = {}
+        with self._lock:
+            for start in range(0, len(keys), _SQL_CHUNK):
+                chunk = keys[start:start + _SQL_CHUNK]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", chunk
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = array("f", blob).tolist()
+        return found
+
+    def _save(self, items):
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                [(key, array("f", vector).tobytes()) for key, vector in items],
+            )
+            self._conn.commit()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [self._key(text) for text in texts]
+        vectors = self._fetch(list(set(keys)))
+
+        # Textes manquants, dédoublonnés, puis envoyés en lots
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in vectors:
+                missing.setdefault(key, text)
+        self.hits += len(texts) - len(missing)
+        self.misses += len(missing)
+        registry.inc("llmops_embedding_cache_total", len(texts) - len(missing), result="hit")
+        registry.inc("llmops_embedding_cache_total", len(missing), result="miss")
+
+        missing_items = list(missing.items())
+        for start in range(0, len(missing_items), self.batch_size):
+            batch = missing_items[start:start + self.batch_size]
+            with span("embedding"):
+                embedded = self.underlying.embed_documents([text for _, text in batch])
+            new_vectors = [(key, array("f", vector).tolist()) for (key, _), vector in zip(batch, embedded)]
+            self._save(new_vectors)
+            vectors.update(new_vectors)
+
+        return [vectors[key] for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+def cached_openai_embeddings(**kwargs):
+    return CachedEmbeddings(OpenAIEmbeddings(**kwargs))
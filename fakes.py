@@ -0,0 +1,134 @@
+import asyncio
+import hashlib
+import os
+import time
+from typing import Any, List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from pydantic import ConfigDict
+
+
+# ⚙️ Latences simulées (secondes), surchargeables par variables d'environnement
+FAKE_LLM_LATENCY = float(os.getenv("FAKE_LLM_LATENCY", "0.05"))
+FAKE_LLM_TOKEN_LATENCY = float(os.getenv("FAKE_LLM_TOKEN_LATENCY", "0.002"))
+FAKE_EMBED_LATENCY = float(os.getenv("FAKE_EMBED_LATENCY", "0.01"))
+FAKE_EMBED_DIM = int(os.getenv("FAKE_EMBED_DIM", "1536"))
+
+FAKE_ANSWER = (
+    "Pour demander la naturalisation française, il faut en principe résider en France "
+    "depuis au moins cinq ans, justifier d'un niveau de français B1 et déposer un dossier complet."
+)
+
+
+def synthetic_vector(text, dim=FAKE_EMBED_DIM):
+    # Vecteur pseudo-aléatoire normalisé, déterministe pour un texte donné
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    vector = np.random.default_rng(seed).standard_normal(dim).astype("float32")
+    return vector / np.linalg.norm(vector)
+
+
+# 🧪 Remplaçant local d'OpenAIEmbeddings : mêmes arguments, aucun appel réseau
+class FakeOpenAIEmbeddings(Embeddings):
+    def __init__(self, dim=FAKE_EMBED_DIM, latency=FAKE_EMBED_LATENCY, model="fake-embedding", **kwargs):
+        self.dim = dim
+        self.latency = latency
+        self.model = model
+        self.calls = 0
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.calls += 1
+        time.sleep(self.latency)
+        return [synthetic_vector(text, self.dim).tolist() for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+# 🧪 Remplaçant local de ChatOpenAI : latence du premier token puis latence par token
+class FakeChatOpenAI(BaseChatModel):
+    model_config = ConfigDict(extra="allow", populate_by_name=True)
+
+    model: str = "fake-chat"
+    latency: float = FAKE_LLM_LATENCY
+    token_latency: float = FAKE_LLM_TOKEN_LATENCY
+    answer: str = FAKE_ANSWER
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat-openai"
+
+    def _reply(self, messages):
+        prompt = messages[-1].content if messages else ""
+        # Les prompts d'analyse par lots attendent une liste JSON
+        return "[]" if "JSON" in prompt else self.answer
+
+    def _tokens(self, text):
+        return [word + " " for word in text.split(" ")]
+
+    def _generate(self, messages, stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> ChatResult:
+        text = self._reply(messages)
+        time.sleep(self.latency + self.token_latency * len(self._tokens(text)))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
+
+    async def _agenerate(self, messages, stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> ChatResult:
+        text = self._reply(messages)
+        await asyncio.sleep(self.latency + self.token_latency * len(self._tokens(text)))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
+
+    def _stream(self, messages, stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any):
+        time.sleep(self.latency)
+        for token in self._tokens(self._reply(messages)):
+            time.sleep(self.token_latency)
+            if run_manager:
+                run_manager.on_llm_new_token(token)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+
+    async def _astream(self, messages, stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any):
+        await asyncio.sleep(self.latency)
+        for token in self._tokens(self._reply(messages)):
+            await asyncio.sleep(self.token_latency)
+            if run_manager:
+                await run_manager.on_llm_new_token(token)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+
+
+def install_fakes():
+    """Swap the OpenAI clients for the local fakes before the app modules are imported."""
+    import langchain_openai
+
+    os.environ.setdefault("OPENAI_API_KEY", "sk-fake")
+    langchain_openai.ChatOpenAI = FakeChatOpenAI
+    langchain_openai.OpenAIEmbeddings = FakeOpenAIEmbeddings
+
+
+def write_synthetic_pdf(path, pages):
+    """Write a minimal text PDF with one line of text per page."""
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>"]
+    kids = " ".join(f"{3 + 2 * i} 0 R" for i in range(len(pages)))
+    objects.append(f"<< /Type /Pages /Kids [{kids}] /Count {len(pages)} >>")
+    font_id = 3 + 2 * len(pages)
+    for i, text in enumerate(pages):
+        escaped = text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+        stream = f"BT /F1 11 Tf 40 750 Td ({escaped}) Tj ET"
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents {4 + 2 * i} 0 R "
+            f"/Resources << /Font << /F1 {font_id} 0 R >> >> >>"
+        )
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+    objects.append("<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+
+    content = "%PDF-1.4\n"
+    offsets = []
+    for i, obj in enumerate(objects):
+        offsets.append(len(content.encode("latin-1")))
+        content += f"{i + 1} 0 obj\n{obj}\nendobj\n"
+    xref = len(content.encode("latin-1"))
+    content += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n"
+    content += "".join(f"{offset:010d} 00000 n \n" for offset in offsets)
+    content += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n"
+    with open(path, "w", encoding="latin-1") as f:
+        f.write(content)
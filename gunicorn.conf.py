@@ -0,0 +1,16 @@
+import multiprocessing
+import os
+
+# ⚙️ Serveur de production pour app_local.py (surchargeable par variables d'environnement)
+# Chaque worker ouvre l'instantané publié dans SHARED_INDEX_PATH en mmap lecture seule :
+# l'index n'est pas dupliqué en mémoire d'un worker à l'autre.
+# L'historique des conversations est partagé entre workers dans HISTORY_DB_PATH (SQLite).
+bind = os.getenv("BIND", "0.0.0.0:8085")
+workers = int(os.getenv("WEB_WORKERS", str(multiprocessing.cpu_count() * 2 + 1)))
+threads = int(os.getenv("WEB_THREADS", "8"))
+worker_class = "gthread"
+timeout = int(os.getenv("WEB_TIMEOUT", "120"))
+graceful_timeout = 30
+# Pas de préchargement : chaque worker charge son propre état après le fork
+preload_app = False
+accesslog = "-"
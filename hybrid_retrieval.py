@@ -0,0 +1,109 @@
+import math
+import os
+import re
+import unicodedata
+from collections import Counter, defaultdict
+from typing import Any, List
+
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from metrics import span
+
+
+# ⚙️ Réglages de la recherche hybride (surchargeables par variables d'environnement)
+RETRIEVER_K = int(os.getenv("RETRIEVER_K", "4"))
+RETRIEVER_FETCH_K = int(os.getenv("RETRIEVER_FETCH_K", "20"))
+RRF_K = int(os.getenv("RRF_K", "60"))
+
+# Mots, nombres et identifiants composés : "21-17", "93-1362", "cerfa 12753"
+TOKEN_PATTERN = re.compile(r"\w+(?:[-/.]\w+)*")
+
+
+def tokenize(text):
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    tokens = []
+    for token in TOKEN_PATTERN.findall(text):
+        tokens.append(token)
+        # Un identifiant composé est aussi indexé par ses parties
+        parts = re.split(r"[-/.]", token)
+        if len(parts) > 1:
+            tokens.extend(part for part in parts if part)
+    return tokens
+
+
+# 🔤 Index inversé BM25, incrémental (ajouts au fil des uploads et des mémoires)
+class BM25Index:
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings = defaultdict(dict)
+        self.lengths = {}
+        self.total_length = 0
+
+    def add(self, doc_id, text):
+        if doc_id in self.lengths:
+            return
+        counts = Counter(tokenize(text))
+        # Longueur enregistrée avant les postings : un document vu dans une copie a toujours sa longueur
+        length = sum(counts.values())
+        self.lengths[doc_id] = length
+        for term, freq in counts.items():
+            self.postings[term][doc_id] = freq
+        self.total_length += length
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def search(self, query, k=RETRIEVER_FETCH_K):
+        return self.score(self.snapshot(set(tokenize(query))), k)
+
+    def snapshot(self, terms):
+        """Copy the postings of ``terms`` and the corpus statistics.
+
+        This is the only step that must run under the caller's lock; ``score`` can then
+        run while documents are being added (documents are never removed).
+        """
+        postings = {term: dict(self.postings[term]) for term in terms if term in self.postings}
+        return postings, len(self.lengths), self.total_length
+
+    def score(self, snapshot, k=RETRIEVER_FETCH_K):
+        term_postings, count, total_length = snapshot
+        if not count:
+            return []
+        average = total_length / count or 1
+        scores = defaultdict(float)
+        for postings in term_postings.values():
+            if not postings:
+                continue
+            idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc_id, freq in postings.items():
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[doc_id] / average)
+                scores[doc_id] += idf * freq * (self.k1 + 1) / (freq + norm)
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+
+
+def reciprocal_rank_fusion(rankings, k=RRF_K):
+    """Fuse ranked lists of ids: score(d) = sum(1 / (k + rank))."""
+    scores = defaultdict(float)
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, start=1):
+            scores[doc_id] += 1.0 / (k + rank)
+    return [doc_id for doc_id, _ in sorted(scores.items(), key=lambda item: item[1], reverse=True)]
+
+
+# 🔀 Retriever hybride : FAISS + BM25 fusionnés par RRF
+class HybridRetriever(BaseRetriever):
+    manager: Any
+    k: int = RETRIEVER_K
+    fetch_k: int = RETRIEVER_FETCH_K
+    rrf_k: int = RRF_K
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        with span("retrieval", mode="hybrid"):
+            vector_ids = self.manager.vector_search_ids(query, self.fetch_k)
+            lexical_ids = [doc_id for doc_id, _ in self.manager.lexical_search(query, self.fetch_k)]
+            fused = reciprocal_rank_fusion([vector_ids, lexical_ids], self.rrf_k)[:self.k]
+            return self.manager.get_documents(fused)
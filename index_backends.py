@@ -0,0 +1,179 @@
+import argparse
+import json
+import os
+import time
+
+import faiss
+import numpy as np
+
+from segment_store import SegmentStore, load_faiss
+
+
+# ⚙️ Type d'index et paramètres (surchargeables par variables d'environnement)
+INDEX_TYPES = ["flat", "ivf", "hnsw", "ivfpq"]
+INDEX_NLIST = int(os.getenv("INDEX_NLIST", "0"))  # 0 : 4 * sqrt(N)
+INDEX_NPROBE = int(os.getenv("INDEX_NPROBE", "16"))
+INDEX_HNSW_M = int(os.getenv("INDEX_HNSW_M", "32"))
+INDEX_EF_CONSTRUCTION = int(os.getenv("INDEX_EF_CONSTRUCTION", "80"))
+INDEX_EF_SEARCH = int(os.getenv("INDEX_EF_SEARCH", "64"))
+INDEX_PQ_M = int(os.getenv("INDEX_PQ_M", "64"))
+INDEX_PQ_NBITS = int(os.getenv("INDEX_PQ_NBITS", "8"))
+
+
+def default_nlist(count):
+    return INDEX_NLIST or max(1, min(int(4 * np.sqrt(count)), count // 39 or 1))
+
+
+# 🏗️ Construction d'un index FAISS du type demandé à partir de vecteurs existants
+def build_index(vectors, index_type="flat", nlist=None, hnsw_m=INDEX_HNSW_M, pq_m=INDEX_PQ_M,
+                pq_nbits=INDEX_PQ_NBITS):
+    vectors = np.ascontiguousarray(vectors, dtype="float32")
+    count, dim = vectors.shape
+    if index_type == "flat":
+        index = faiss.IndexFlatL2(dim)
+    elif index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, hnsw_m)
+        index.hnsw.efConstruction = INDEX_EF_CONSTRUCTION
+    elif index_type in ("ivf", "ivfpq"):
+        nlist = nlist or default_nlist(count)
+        quantizer = faiss.IndexFlatL2(dim)
+        if index_type == "ivf":
+            index = faiss.IndexIVFFlat(quantizer, dim, nlist)
+        else:
+            if dim % pq_m:
+                raise ValueError(f"INDEX_PQ_M={pq_m} doit diviser la dimension {dim}.")
+            index = faiss.IndexIVFPQ(quantizer, dim, nlist, pq_m, pq_nbits)
+        index.train(vectors)
+    else:
+        raise ValueError(f"Type d'index inconnu : {index_type} (attendu : {', '.join(INDEX_TYPES)})")
+    index.add(vectors)
+    apply_search_params(index)
+    return index
+
+
+def apply_search_params(index, nprobe=INDEX_NPROBE, ef_search=INDEX_EF_SEARCH):
+    """Set query-time knobs (nprobe, efSearch) on approximate indexes."""
+    if isinstance(index, faiss.IndexIVF):
+        index.nprobe = min(nprobe, index.nlist)
+    elif isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = ef_search
+    return index
+
+
+def index_type_of(index):
+    if isinstance(index, faiss.IndexIVFPQ):
+        return "ivfpq"
+    if isinstance(index, faiss.IndexIVF):
+        return "ivf"
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    return "flat"
+
+
+def is_lossy(index):
+    """Product-quantized indexes only keep compressed codes: reconstructed vectors are approximate."""
+    return isinstance(index, (faiss.IndexIVFPQ, faiss.IndexPQ))
+
+
+def extract_vectors(index):
+    if isinstance(index, faiss.IndexIVF):
+        index.make_direct_map()
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def make_reconstructible(index):
+    """Give IVF indexes the position map ``reconstruct`` needs; call it before sharing the index between threads."""
+    if isinstance(index, faiss.IndexIVF) and index.direct_map.no():
+        index.make_direct_map()
+    return index
+
+
+def reconstruct_vectors(index, positions):
+    """Stored vectors at ``positions`` (approximate for product-quantized indexes)."""
+    make_reconstructible(index)
+    vectors = [index.reconstruct(int(position)) for position in positions]
+    return np.vstack(vectors) if vectors else np.zeros((0, index.d), dtype="float32")
+
+
+def index_bytes(index):
+    return int(faiss.serialize_index(index).size)
+
+
+# 🎯 Évaluation : rappel@k face à la recherche exacte sur des requêtes mises de côté
+def held_out_queries(vectors, count, seed=0, noise=0.05):
+    rng = np.random.default_rng(seed)
+    picked = vectors[rng.choice(len(vectors), size=min(count, len(vectors)), replace=False)]
+    queries = picked + rng.normal(scale=noise, size=picked.shape).astype("float32")
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+    return np.ascontiguousarray(queries, dtype="float32")
+
+
+def evaluate_index(index, exact_index, queries, k=4):
+    _, truth = exact_index.search(queries, k)
+    latencies = []
+    hits = 0
+    for i, query in enumerate(queries):
+        started = time.perf_counter()
+        _, found = index.search(query.reshape(1, -1), k)
+        latencies.append(time.perf_counter() - started)
+        hits += len(set(found[0]) & set(truth[i]))
+    latencies = np.asarray(latencies) * 1000
+    return {
+        f"recall@{k}": round(hits / (len(queries) * k), 4),
+        "query_p50_ms": round(float(np.percentile(latencies, 50)), 4),
+        "query_p95_ms": round(float(np.percentile(latencies, 95)), 4),
+        "index_bytes": index_bytes(index),
+    }
+
+
+def rebuild_vectorstore(src, dst, index_type, embeddings=None, eval_queries=200, k=4, nlist=None):
+    """Rebuild the store at ``src`` into ``dst`` with ``index_type`` and return a report."""
+    db = load_faiss(src, embeddings)
+    vectors = extract_vectors(db.index)
+
+    started = time.perf_counter()
+    index = build_index(vectors, index_type, nlist=nlist)
+    build_seconds = time.perf_counter() - started
+
+    exact = faiss.IndexFlatL2(vectors.shape[1])
+    exact.add(vectors)
+    report = {
+        "source": src,
+        "destination": dst,
+        "index_type": index_type,
+        "vectors": int(vectors.shape[0]),
+        "dim": int(vectors.shape[1]),
+        "build_seconds": round(build_seconds, 4),
+    }
+    if eval_queries:
+        queries = held_out_queries(vectors, eval_queries)
+        report["exact"] = evaluate_index(exact, exact, queries, k)
+        report["approximate"] = evaluate_index(index, exact, queries, k)
+
+    db.index = index
+    SegmentStore(dst).write(db)
+    return report
+
+
+# 🖥️ python index_backends.py vectorstore vectorstore_hnsw --type hnsw
+def main():
+    parser = argparse.ArgumentParser(description="Reconstruit le vectorstore avec un index FAISS approché et l'évalue.")
+    parser.add_argument("src")
+    parser.add_argument("dst")
+    parser.add_argument("--type", choices=INDEX_TYPES, default="hnsw")
+    parser.add_argument("--nlist", type=int, default=None)
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--eval-queries", type=int, default=200)
+    parser.add_argument("--report", help="fichier JSON où écrire le rapport")
+    args = parser.parse_args()
+
+    report = rebuild_vectorstore(args.src, args.dst, args.type, eval_queries=args.eval_queries, k=args.k,
+                                 nlist=args.nlist)
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
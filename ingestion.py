@@ -0,0 +1,292 @@
+import argparse
+import hashlib
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait
+
+from dotenv import load_dotenv
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+from embedding_cache import cached_openai_embeddings
+from index_backends import INDEX_TYPES, rebuild_vectorstore
+from memory_index import now_timestamp, upload_metadata
+from metrics import registry
+from vectorstore_service import get_vectorstore_manager
+
+
+# ⚙️ Réglages de l'ingestion (surchargeables par variables d'environnement)
+INGEST_PROCESSES = int(os.getenv("INGEST_PROCESSES", str(min(4, os.cpu_count() or 1))))
+INGEST_PAGES_PER_TASK = int(os.getenv("INGEST_PAGES_PER_TASK", "8"))
+INGEST_EMBED_BATCH_SIZE = int(os.getenv("INGEST_EMBED_BATCH_SIZE", "256"))
+INGEST_EMBED_CONCURRENCY = int(os.getenv("INGEST_EMBED_CONCURRENCY", "4"))
+
+
+# 📄 Exécuté dans un processus du pool : chaque page n'est extraite qu'une seule fois
+def extract_page_range(path, start, end):
+    from PyPDF2 import PdfReader
+    pdf_reader = PdfReader(path)
+    pages = []
+    for number in range(start, end):
+        text = pdf_reader.pages[number].extract_text()
+        pages.append((number, text or ""))
+    return pages
+
+
+def chunk_hash(chunk):
+    return hashlib.sha256(" ".join(chunk.split()).encode("utf-8")).hexdigest()
+
+
+def create_splitter():
+    return RecursiveCharacterTextSplitter(
+        chunk_size=800,
+        chunk_overlap=100,
+        separators=["\n\n", "\n", ".", " "]
+    )
+
+
+# 🏭 Moteur d'ingestion : extraction parallèle des pages, découpage, dédoublonnage
+# des morceaux par hash, puis embeddings par lots avec une concurrence bornée.
+class IngestionEngine:
+    def __init__(self, vectorstore, processes=INGEST_PROCESSES, pages_per_task=INGEST_PAGES_PER_TASK,
+                 embed_batch_size=INGEST_EMBED_BATCH_SIZE, embed_concurrency=INGEST_EMBED_CONCURRENCY):
+        self.vectorstore = vectorstore
+        self.processes = processes
+        self.pages_per_task = pages_per_task
+        self.embed_batch_size = embed_batch_size
+        self.embed_concurrency = embed_concurrency
+        self.splitter = create_splitter()
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        self._seen_hashes = None
+        self._seen_lock = threading.Lock()
+        self._promote_lock = threading.Lock()
+
+    def _process_pool(self):
+        with self._pool_lock:
+            if self._pool is None:
+                # "spawn" : pas de fork d'un processus serveur multi-thread
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.processes, mp_context=multiprocessing.get_context("spawn")
+                )
+            return self._pool
+
+    def shutdown(self):
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.shutdown()
+                self._pool = None
+
+    def _load_seen_hashes(self):
+        # Appelé avec _seen_lock tenu
+        if self._seen_hashes is None:
+            self._seen_hashes = set()
+            if self.vectorstore.exists():
+                for doc in self.vectorstore.documents():
+                    if doc.metadata.get("chunk_hash"):
+                        self._seen_hashes.add(doc.metadata["chunk_hash"])
+
+    def _claim_new_chunks(self, chunks, claimed=None):
+        # Les hash sont réservés dès maintenant (deux fichiers du même envoi ne peuvent pas
+        # intégrer le même morceau) puis libérés si l'écriture échoue (_release_chunks)
+        with self._seen_lock:
+            self._load_seen_hashes()
+            # Pour un index de session, les morceaux déjà connus du vectorstore partagé sont ignorés
+            # mais ceux de la session sont réservés dans l'ensemble ``claimed`` propre à l'envoi
+            seen = self._seen_hashes if claimed is None else claimed
+            fresh = []
+            for chunk in chunks:
+                digest = chunk_hash(chunk)
+                if digest not in self._seen_hashes and digest not in seen:
+                    seen.add(digest)
+                    fresh.append((digest, chunk))
+            return fresh
+
+    def _release_chunks(self, digests, claimed=None):
+        with self._seen_lock:
+            (self._seen_hashes if claimed is None else claimed).difference_update(digests)
+
+    def ingest_files(self, files, on_progress=None, on_file_done=None, target=None):
+        """Ingest ``files`` given as ``(path, name)`` pairs and return one report per file.
+
+        ``on_progress(name, pages_done, pages_total)`` is called as page batches
+        complete, ``on_file_done(report)`` once a file's chunks are indexed.
+        ``target`` (e.g. a session index) receives the chunks instead of the vectorstore.
+        """
+        # Import différé : PyPDF2 n'est chargé qu'au premier fichier reçu
+        from PyPDF2 import PdfReader
+        pool = self._process_pool()
+        # Rapports indexés par position : deux envois peuvent porter le même nom de fichier
+        reports = []
+        page_futures = {}
+        # Un seul ensemble de hash pour tout l'envoi : les fichiers traités en parallèle voient les
+        # morceaux réservés par les autres avant même qu'ils n'arrivent dans l'index de session
+        claimed = target.hashes() if target is not None else None
+
+        for path, name in files:
+            report = {"file": name, "pages": 0, "chunks": 0, "added": 0, "duplicates": 0, "error": None}
+            position = len(reports)
+            reports.append(report)
+            try:
+                total = len(PdfReader(path).pages)
+            except Exception as e:
+                report["error"] = str(e)
+                continue
+            report["pages"] = total
+            report["_texts"] = {}
+            report["_started"] = time.perf_counter()
+            for start in range(0, total, self.pages_per_task):
+                future = pool.submit(extract_page_range, path, start, min(start + self.pages_per_task, total))
+                page_futures[future] = position
+            if total == 0:
+                report["error"] = "aucune page"
+
+        with ThreadPoolExecutor(max_workers=self.embed_concurrency) as embed_pool:
+            file_batches = {}
+            for future in as_completed(page_futures):
+                position = page_futures[future]
+                report = reports[position]
+                if report["error"]:
+                    continue
+                try:
+                    report["_texts"].update(future.result())
+                except Exception as e:
+                    report["error"] = str(e)
+                    continue
+                if on_progress:
+                    on_progress(report["file"], len(report["_texts"]), report["pages"])
+                if len(report["_texts"]) == report["pages"]:
+                    registry.observe("llmops_stage_seconds", time.perf_counter() - report.pop("_started"),
+                                     stage="pdf_extraction")
+                    file_batches[position] = self._submit_file(embed_pool, report, target, claimed)
+
+            for position, batches in file_batches.items():
+                report = reports[position]
+                wait(batches)
+                for batch in batches:
+                    try:
+                        report["added"] += batch.result()
+                    except Exception as e:
+                        report["error"] = str(e)
+                if on_file_done:
+                    on_file_done(self._public(report))
+
+        # Fichiers en erreur avant la fin de l'extraction
+        for position, report in enumerate(reports):
+            if position not in file_batches and on_file_done:
+                on_file_done(self._public(report))
+        return [self._public(report) for report in reports]
+
+    def _submit_file(self, embed_pool, report, target=None, claimed=None):
+        texts = report.pop("_texts")
+        text = "\n".join(texts[number] for number in sorted(texts) if texts[number])
+        if not text.strip():
+            report["error"] = "aucun texte lisible"
+            return []
+
+        chunks = self.splitter.split_text(text)
+        fresh = self._claim_new_chunks(chunks, claimed)
+        report["chunks"] = len(chunks)
+        report["duplicates"] = len(chunks) - len(fresh)
+
+        timestamp = now_timestamp()
+        docs = [
+            (f"[{timestamp}] (Doc: {report['file']}) {chunk}", upload_metadata(report["file"], timestamp, chunk_hash=digest))
+            for digest, chunk in fresh
+        ]
+        return [
+            embed_pool.submit(self._embed_and_add, docs[start:start + self.embed_batch_size], target, claimed)
+            for start in range(0, len(docs), self.embed_batch_size)
+        ]
+
+    def _embed_and_add(self, docs, target=None, claimed=None):
+        store = target or self.vectorstore
+        texts = [text for text, _ in docs]
+        try:
+            vectors = store.embeddings.embed_documents(texts)
+            store.add_embeddings(zip(texts, vectors), metadatas=[metadata for _, metadata in docs])
+        except Exception:
+            # Morceaux non intégrés : un prochain envoi doit pouvoir les ajouter
+            self._release_chunks((metadata["chunk_hash"] for _, metadata in docs), claimed)
+            raise
+        return len(docs)
+
+    def promote(self, sessions, session_id, file_names=None):
+        """Move a session's uploaded chunks (optionally only ``file_names``) into the vectorstore.
+
+        The embeddings are reused; chunks already in the vectorstore are skipped. The chunks
+        leave the session only once the vectorstore write succeeded, so a failure can be retried.
+        Returns the number of chunks added.
+        """
+        with self._promote_lock:
+            snapshot = sessions.snapshot(session_id)
+            if snapshot is None:
+                return 0
+            index, docs, vectors = snapshot
+            selected = [i for i, doc in enumerate(docs)
+                        if not file_names or doc.metadata.get("file_name") in file_names]
+            with self._seen_lock:
+                self._load_seen_hashes()
+                keep, digests = [], set()
+                for i in selected:
+                    digest = docs[i].metadata.get("chunk_hash")
+                    if digest in self._seen_hashes or digest in digests:
+                        continue
+                    if digest:
+                        digests.add(digest)
+                    keep.append(i)
+            if keep:
+                self.vectorstore.add_embeddings(
+                    [(docs[i].page_content, vectors[i].tolist()) for i in keep],
+                    metadatas=[docs[i].metadata for i in keep],
+                )
+                with self._seen_lock:
+                    self._seen_hashes.update(digests)
+            # Les autres fichiers restent dans l'index de la session
+            sessions.remove(session_id, index, selected)
+        print(f"📤 Session {session_id} : {len(keep)} morceau(x) promu(s) dans le vectorstore")
+        return len(keep)
+
+    @staticmethod
+    def _public(report):
+        return {key: value for key, value in report.items() if not key.startswith("_")}
+
+
+# 🖥️ Construction en masse du vectorstore à partir d'un dossier de PDF
+def main():
+    parser = argparse.ArgumentParser(description="Intègre un dossier de PDF dans le vectorstore FAISS.")
+    parser.add_argument("pdf_dir")
+    parser.add_argument("--vectorstore", default="vectorstore")
+    parser.add_argument("--processes", type=int, default=INGEST_PROCESSES)
+    parser.add_argument("--batch-size", type=int, default=INGEST_EMBED_BATCH_SIZE)
+    parser.add_argument("--concurrency", type=int, default=INGEST_EMBED_CONCURRENCY)
+    parser.add_argument("--index-type", choices=INDEX_TYPES, default="flat")
+    args = parser.parse_args()
+
+    load_dotenv()
+    manager = get_vectorstore_manager(args.vectorstore, cached_openai_embeddings(openai_api_key=os.getenv("OPENAI_API_KEY")))
+    engine = IngestionEngine(manager, processes=args.processes, embed_batch_size=args.batch_size,
+                             embed_concurrency=args.concurrency)
+
+    files = [
+        (os.path.join(args.pdf_dir, name), name)
+        for name in sorted(os.listdir(args.pdf_dir)) if name.lower().endswith(".pdf")
+    ]
+    started = time.perf_counter()
+    reports = engine.ingest_files(
+        files,
+        on_progress=lambda name, done, total: print(f"⏳ {name} : {done}/{total} pages"),
+        on_file_done=lambda report: print(f"✅ {report}" if not report["error"] else f"❌ {report}"),
+    )
+    manager.flush()
+    engine.shutdown()
+    if args.index_type != "flat":
+        report = rebuild_vectorstore(args.vectorstore, args.vectorstore, args.index_type, manager.embeddings, eval_queries=0)
+        print(f"🧭 Index reconstruit en {args.index_type} en {report['build_seconds']}s")
+    added = sum(report["added"] for report in reports)
+    print(f"📚 {len(files)} fichier(s), {added} morceau(x) ajouté(s) en {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
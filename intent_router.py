@@ -0,0 +1,222 @@
+import argparse
+import json
+import os
+import random
+import re
+import threading
+
+import numpy as np
+from dotenv import load_dotenv
+from langchain.chains import RetrievalQA
+from langchain_openai import ChatOpenAI
+
+from embedding_cache import cached_openai_embeddings
+from metrics import span
+from vectorstore_service import get_vectorstore_manager
+
+
+# ⚙️ Réglages du routeur (surchargeables par variables d'environnement)
+FAQ_PATH = os.getenv("FAQ_PATH", "faq_bank")
+FAQ_THRESHOLD = float(os.getenv("FAQ_THRESHOLD", "0.92"))
+FAQ_LANGUAGES = ["fr", "en", "es", "it", "de"]
+
+# 📋 Commandes reconnues avant toute détection de langue ou appel LLM
+COMMANDS = {
+    "guide": "guide",
+    "checklist": "checklist",
+    "dépôt": "depot",
+    "depot": "depot",
+    "mémoire": "memory",
+    "memoire": "memory",
+    "/reset": "reset",
+    "reset": "reset",
+    "/upload": "upload",
+}
+
+SEED_QUESTIONS = [
+    "Quelle est la durée de résidence exigée pour demander la naturalisation ?",
+    "Quel niveau de français faut-il pour la naturalisation ?",
+    "Quels diplômes ou certificats prouvent le niveau B1 ?",
+    "Quels documents faut-il fournir pour une demande de naturalisation ?",
+    "Comment déposer une demande de naturalisation en ligne ?",
+    "Combien de temps dure l'instruction d'un dossier de naturalisation ?",
+    "Comment se passe l'entretien d'assimilation en préfecture ?",
+    "Peut-on demander la naturalisation avec un casier judiciaire ?",
+    "Faut-il des ressources stables pour être naturalisé ?",
+    "Quel est le coût d'une demande de naturalisation ?",
+    "Qu'est-ce que la naturalisation par mariage ?",
+    "Que faire en cas de refus ou d'ajournement de la demande ?",
+]
+
+
+def detect_language(text, default="fr"):
+    """ISO code of the language of ``text`` among FAQ_LANGUAGES, else ``default``."""
+    try:
+        # Import différé : les profils de langues ne sont chargés qu'au premier appel (ou à la chauffe)
+        from langdetect import detect
+        with span("language_detection"):
+            lang = detect(text)
+    except Exception:
+        return default
+    return lang if lang in FAQ_LANGUAGES else default
+
+
+def normalize_command(text):
+    return " ".join(text.lower().split())
+
+
+# 🧭 Routeur d'intention : commandes par table de correspondance, puis
+# questions fréquentes comparées à une banque FAQ pré-calculée par langue.
+class IntentRouter:
+    def __init__(self, embeddings, path=FAQ_PATH, threshold=FAQ_THRESHOLD):
+        self.embeddings = embeddings
+        self.path = path
+        self.threshold = threshold
+        self.entries = []
+        self.vectors = None
+        self.rows = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.load()
+
+    def load(self):
+        entries_path = os.path.join(self.path, "faq.json")
+        vectors_path = os.path.join(self.path, "vectors.npy")
+        if not (os.path.exists(entries_path) and os.path.exists(vectors_path)):
+            print(f"ℹ️ Banque FAQ absente ({self.path}) : seules les commandes sont routées.")
+            return
+        with open(entries_path, encoding="utf-8") as f:
+            entries = json.load(f)
+        vectors = np.load(vectors_path)
+        # Les entrées désactivées lors de la relecture sont ignorées
+        keep = [i for i, entry in enumerate(entries) if entry.get("approved", True)]
+        # Lignes de la banque par langue, pour ne comparer la question qu'aux entrées de sa langue
+        rows = {}
+        for row, i in enumerate(keep):
+            rows.setdefault(entries[i].get("lang", "fr"), []).append(row)
+        with self._lock:
+            self.entries = [entries[i] for i in keep]
+            self.vectors = vectors[keep] if keep else None
+            self.rows = {lang: np.asarray(lang_rows) for lang, lang_rows in rows.items()}
+
+    def command(self, text):
+        return COMMANDS.get(normalize_command(text))
+
+    def match_faq(self, text, lang="fr"):
+        """Return ``(entry, score)`` for a confident FAQ match in ``lang``, else ``(None, score)``.
+
+        Only entries of ``lang`` are compared; a language without entries falls back to French.
+        """
+        with self._lock:
+            entries, vectors = self.entries, self.vectors
+            rows = self.rows.get(lang, self.rows.get("fr"))
+        if vectors is None or rows is None:
+            return None, 0.0
+        query = np.asarray(self.embeddings.embed_query(text), dtype="float32")
+        query /= np.linalg.norm(query) or 1.0
+        scores = vectors[rows] @ query
+        best = int(np.argmax(scores))
+        score = float(scores[best])
+        if score >= self.threshold:
+            self.hits += 1
+            return entries[rows[best]], score
+        self.misses += 1
+        return None, score
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "faq_entries": len(self.entries),
+            "faq_hits": self.hits,
+            "faq_misses": self.misses,
+            "faq_hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+# 🏗️ Construction hors-ligne de la banque FAQ à partir du vectorstore
+def parse_json_list(text):
+    match = re.search(r"\[.*\]", text, re.DOTALL)
+    try:
+        return json.loads(match.group(0)) if match else []
+    except ValueError:
+        return []
+
+
+def generate_questions(llm, documents, count):
+    excerpts = "\n\n".join(f"- {doc.page_content[:600]}" for doc in documents)
+    prompt = (
+        "Voici des extraits de documents sur la naturalisation française :\n\n"
+        f"{excerpts}\n\n"
+        f"Propose {count} questions fréquentes et distinctes qu'un demandeur pourrait poser, "
+        "auxquelles ces extraits permettent de répondre. "
+        "Réponds uniquement avec une liste JSON de chaînes."
+    )
+    return [str(question) for question in parse_json_list(llm.invoke(prompt).content)]
+
+
+def translate_entry(llm, question, answer, lang):
+    prompt = (
+        f"Traduis cette question et sa réponse dans la langue de code ISO « {lang} », "
+        "sans rien ajouter ni retirer.\n\n"
+        f"Question : {question}\nRéponse : {answer}\n\n"
+        'Réponds uniquement avec un objet JSON : {"question": "...", "answer": "..."}'
+    )
+    text = llm.invoke(prompt).content
+    match = re.search(r"\{.*\}", text, re.DOTALL)
+    try:
+        item = json.loads(match.group(0)) if match else {}
+    except ValueError:
+        item = {}
+    return item.get("question"), item.get("answer")
+
+
+def build_faq_bank(qa_chain, llm, embeddings, documents, out=FAQ_PATH, generated=20, languages=FAQ_LANGUAGES):
+    questions = list(SEED_QUESTIONS)
+    if generated and documents:
+        sample = random.Random(0).sample(documents, min(len(documents), 12))
+        questions += generate_questions(llm, sample, generated)
+
+    entries = []
+    for question in dict.fromkeys(questions):
+        # Réponse ancrée dans le vectorstore, comme en production
+        answer = qa_chain.invoke({"query": question})["result"].strip()
+        entries.append({"lang": "fr", "question": question, "answer": answer, "approved": True})
+        for lang in languages:
+            if lang == "fr":
+                continue
+            translated_question, translated_answer = translate_entry(llm, question, answer, lang)
+            if translated_question and translated_answer:
+                entries.append({"lang": lang, "question": translated_question, "answer": translated_answer,
+                                "approved": True})
+        print(f"❓ {question}")
+
+    vectors = np.asarray(embeddings.embed_documents([entry["question"] for entry in entries]), dtype="float32")
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    os.makedirs(out, exist_ok=True)
+    with open(os.path.join(out, "faq.json"), "w", encoding="utf-8") as f:
+        json.dump(entries, f, indent=2, ensure_ascii=False)
+    np.save(os.path.join(out, "vectors.npy"), vectors)
+    return entries
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Construit la banque FAQ multilingue à partir du vectorstore.")
+    parser.add_argument("--vectorstore", default="vectorstore")
+    parser.add_argument("--out", default=FAQ_PATH)
+    parser.add_argument("--generated", type=int, default=20, help="questions supplémentaires générées depuis le corpus")
+    args = parser.parse_args()
+
+    load_dotenv()
+    api_key = os.getenv("OPENAI_API_KEY")
+    embeddings = cached_openai_embeddings(openai_api_key=api_key)
+    manager = get_vectorstore_manager(args.vectorstore, embeddings)
+    answer_llm = ChatOpenAI(model="gpt-4", temperature=0, openai_api_key=api_key)
+    qa_chain = RetrievalQA.from_chain_type(llm=answer_llm, retriever=manager.as_hybrid_retriever())
+    entries = build_faq_bank(qa_chain, answer_llm, embeddings, manager.documents(), args.out, args.generated)
+    print(f"📚 Banque FAQ écrite dans {args.out} ({len(entries)} entrées) — à relire avant mise en production.")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,12 @@
 import os
 import streamlit as st
-from langchain_openai import ChatOpenAI, OpenAIEmbeddings
-from langchain_community.vectorstores import FAISS
-from langchain.chains import RetrievalQA
 from dotenv import load_dotenv
+from vectorstore_service import get_vectorstore_manager
+from answer_cache import SemanticAnswerCache
+from embedding_cache import cached_openai_embeddings
+from context_packing import build_retriever
+from model_router import create_model_router
+from intent_router import detect_language
 
 # 🔐 Charger la clé API OpenAI depuis les variables d’environnement
 load_dotenv()  # Charge les variables d'environnement du fichier .env
@@ -19,53 +22,90 @@ if not openai_api_key:
 
 # 📥 Charger la base de données vectorielle FAISS
 def create_retriever(vector_db_path):
-    embeddings = OpenAIEmbeddings()
+    embeddings = cached_openai_embeddings()
     try:
-        faiss_db = FAISS.load_local(
-            vector_db_path, embeddings, allow_dangerous_deserialization=True
-        )
-        return faiss_db.as_retriever()
-    except ValueError as e:
+        faiss_db = get_vectorstore_manager(vector_db_path, embeddings)
+        faiss_db.db  # chargement immédiat pour remonter les erreurs ici
+        return build_retriever(faiss_db, hybrid=os.getenv("HYBRID_RETRIEVAL", "1") == "1")
+    except (ValueError, OSError) as e:
+        # Index absent (FileNotFoundError) ou incohérent : message dans la page plutôt qu'une trace
         st.error(f"❌ Erreur lors du chargement de la base FAISS : {e}")
         return None
 
 
-# 🤖 Création du chatbot
+# 🤖 Création du chatbot : routage entre modèle rapide et GPT-4 selon la question
 def create_chatbot(vector_db_path):
     retriever = create_retriever(vector_db_path)
     if retriever is None:
-        return None, None
-    llm = ChatOpenAI(model="gpt-3.5-turbo", temperature=0.7)
-    retrieval_chain = RetrievalQA.from_chain_type(
-        llm=llm, chain_type="stuff", retriever=retriever
-    )
-    return retrieval_chain, llm
+        return None
+    return create_model_router(retriever, temperature=0.7)
 
 
 # 🎭 Classe chatbot
 class Chatbot:
     def __init__(self, vector_db_path):
-        self.qa, self.llm = create_chatbot(vector_db_path)
-
-    def ask(self, question):
-        if not self.qa:
-            return "⚠️ Erreur de chargement du modèle."
-
-        # 🔎 Recherche dans FAISS
-        specific_response = self.qa.run(question)
-
-        # 📌 Si la réponse est vide ou peu pertinente, utiliser GPT-3.5
-        if not specific_response.strip():
-            return self.llm.predict(question)
-
-        return specific_response.strip()
+        self.router = create_chatbot(vector_db_path)
+        self.cache = None
+        self.manager = None
+        self.disk_stamp = None
+        if self.router:
+            # ⚡ Cache sémantique invalidé quand les documents de l'index changent
+            self.cache = SemanticAnswerCache(cached_openai_embeddings())
+            self.manager = get_vectorstore_manager(vector_db_path)
+            self.cache.watch(self.manager)
+            self.disk_stamp = self.manager.disk_stamp()
+
+    def ask(self, question, lang=None):
+        return "".join(self.stream(question, lang)).strip()
+
+    # 🌊 Réponse diffusée morceau par morceau depuis le modèle retenu par le routeur
+    def stream(self, question, lang=None):
+        if not self.router:
+            yield "⚠️ Erreur de chargement du modèle."
+            return
+        # Cache séparé par langue : une question en anglais ne reçoit pas une réponse française
+        lang = lang or detect_language(question)
+
+        cached_answer, query_vector = self.cache.lookup(question, lang)
+        if cached_answer is not None:
+            yield cached_answer
+            return
+
+        # 🔎 Recherche dans FAISS, puis relais vers GPT-4 dans le même budget si nécessaire
+        answer = ""
+        for token in self.router.stream(question):
+            answer += token
+            yield token
+
+        self.cache.store(question, answer.strip(), lang, query_vector)
+
+    # 🔄 Index modifié sur disque par un autre processus : rechargement (le cache n'est invalidé que si des
+    # documents ont changé, pas pour les mémoires apprises)
+    def refresh_if_changed(self):
+        if self.manager is None:
+            return
+        stamp = self.manager.disk_stamp()
+        if stamp is not None and stamp != self.disk_stamp and self.manager.reload():
+            self.disk_stamp = stamp
+
+
+# ♻️ Chatbot (index, chaîne, cache) partagé par toutes les sessions et tous les reruns Streamlit
+@st.cache_resource(show_spinner="📥 Chargement de l'index…")
+def load_chatbot(vector_db_path):
+    return Chatbot(vector_db_path)
+
+
+def current_chatbot(vector_db_path):
+    chatbot = load_chatbot(vector_db_path)
+    chatbot.refresh_if_changed()
+    return chatbot
 
 
 # 🎨 Interface Streamlit
 st.title("🤖 Chatbot sur la Naturalisation Française 🇫🇷")
 
-vector_db_path = "C:\\Users\\daora\IA_Naturalisation\\vectorstore"  # Adapte ce chemin
-chatbot = Chatbot(vector_db_path)
+vector_db_path = os.getenv("VECTOR_DB_PATH", "C:\\Users\\daora\IA_Naturalisation\\vectorstore")  # Adapte ce chemin
+chatbot = current_chatbot(vector_db_path)
 
 # 📌 Système de mémoire pour sauvegarder l'historique des échanges
 if "chat_history" not in st.session_state:
@@ -74,14 +114,18 @@ if "chat_history" not in st.session_state:
 # 🔎 Champ de saisie utilisateur
 question = st.text_input("✏️ Posez votre question :")
 
+answered = False
 if st.button("🗣️ Envoyer"):
     if question:
-        response = chatbot.ask(question)
+        st.write(f"**🧑‍💼 Vous :** {question}")
+        st.write("**🤖 Chatbot :**")
+        response = st.write_stream(chatbot.stream(question))
         st.session_state.chat_history.append((question, response))  # Ajout au chat
+        answered = True
 
-# 📜 Affichage de l'historique
+# 📜 Affichage de l'historique (la réponse en cours est déjà affichée au-dessus)
 st.subheader("💬 Historique de la conversation")
-for q, r in st.session_state.chat_history:
+for q, r in (st.session_state.chat_history[:-1] if answered else st.session_state.chat_history):
     st.write(f"**🧑‍💼 Vous :** {q}")
     st.write(f"**🤖 Chatbot :** {r}")
     st.write("---")
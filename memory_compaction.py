@@ -0,0 +1,179 @@
+import argparse
+import os
+import threading
+from datetime import datetime, timedelta
+
+import faiss
+import numpy as np
+from dotenv import load_dotenv
+from langchain_core.documents import Document
+
+from context_packing import strip_prefix
+from memory_index import TIMESTAMP_FORMAT, infer_metadata, memory_metadata
+from metrics import registry, span
+
+
+# ⚙️ Réglages du compactage des mémoires (surchargeables par variables d'environnement)
+MEMORY_DUP_THRESHOLD = float(os.getenv("MEMORY_DUP_THRESHOLD", "0.92"))
+MEMORY_TTL_DAYS = float(os.getenv("MEMORY_TTL_DAYS", "180"))  # 0 : pas d'expiration
+MEMORY_MAX_ENTRIES = int(os.getenv("MEMORY_MAX_ENTRIES", "5000"))  # 0 : pas de plafond
+MEMORY_COMPACTION_INTERVAL = float(os.getenv("MEMORY_COMPACTION_INTERVAL", "3600"))  # 0 : désactivé
+
+
+def _last_seen(metadata):
+    return metadata.get("timestamp") or ""
+
+
+def merged_memory(fact, count, first_seen, last_seen):
+    metadata = {**memory_metadata(last_seen), "count": count, "first_seen": first_seen}
+    return Document(page_content=f"[{last_seen}] {fact}", metadata=metadata)
+
+
+# 🧹 Compactage des mémoires apprises : les faits quasi identiques (« je vis en France depuis
+# 5 ans » répété par des centaines d'utilisateurs) sont fusionnés en une seule entrée avec un
+# compteur et une date de dernière occurrence, puis expiration et plafond s'appliquent.
+# Les documents préchargés et les fichiers intégrés ne sont jamais modifiés.
+class MemoryCompactor:
+    def __init__(self, manager, threshold=MEMORY_DUP_THRESHOLD, ttl_days=MEMORY_TTL_DAYS,
+                 max_entries=MEMORY_MAX_ENTRIES, interval=MEMORY_COMPACTION_INTERVAL):
+        self.manager = manager
+        self.threshold = threshold
+        self.ttl_days = ttl_days
+        self.max_entries = max_entries
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+        self.last_report = None
+
+    def plan(self, vectors, entries, now=None):
+        """Return ``(kept_positions, merged, report)`` for the stored ``entries``.
+
+        ``merged`` maps the position kept for each cluster to its merged Document.
+        """
+        now = now or datetime.now()
+        report = {"memories": 0, "merged": 0, "expired": 0, "capped": 0}
+        kept, memories = [], []
+        for position, (_, doc) in enumerate(entries):
+            if infer_metadata(doc).get("source") == "memory":
+                memories.append(position)
+            else:
+                kept.append(position)
+        report["memories"] = len(memories)
+        if not memories:
+            return kept, {}, report
+
+        # Les plus récentes d'abord : chaque groupe garde la formulation la plus récente
+        memories.sort(key=lambda position: _last_seen(infer_metadata(entries[position][1])), reverse=True)
+        normalized = np.ascontiguousarray(vectors[memories], dtype="float32")
+        faiss.normalize_L2(normalized)
+        representatives = faiss.IndexFlatIP(normalized.shape[1])
+        clusters = []
+        for row, position in enumerate(memories):
+            metadata = infer_metadata(entries[position][1])
+            count = int(entries[position][1].metadata.get("count", 1))
+            first_seen = entries[position][1].metadata.get("first_seen") or _last_seen(metadata)
+            if representatives.ntotal:
+                scores, found = representatives.search(normalized[row:row + 1], 1)
+                if scores[0][0] >= self.threshold:
+                    cluster = clusters[int(found[0][0])]
+                    cluster["count"] += count
+                    cluster["first_seen"] = min(cluster["first_seen"], first_seen)
+                    cluster["members"] += 1
+                    continue
+            representatives.add(normalized[row:row + 1])
+            clusters.append({"position": position, "count": count, "first_seen": first_seen,
+                             "last_seen": _last_seen(metadata), "members": 1})
+        report["merged"] = len(memories) - len(clusters)
+
+        if self.ttl_days > 0:
+            cutoff = (now - timedelta(days=self.ttl_days)).strftime(TIMESTAMP_FORMAT)
+            fresh = [cluster for cluster in clusters if cluster["last_seen"] >= cutoff]
+            report["expired"] = len(clusters) - len(fresh)
+            clusters = fresh
+        if self.max_entries > 0 and len(clusters) > self.max_entries:
+            # Les faits les plus fréquents puis les plus récents sont gardés
+            clusters.sort(key=lambda cluster: (cluster["count"], cluster["last_seen"]), reverse=True)
+            report["capped"] = len(clusters) - self.max_entries
+            clusters = clusters[:self.max_entries]
+
+        merged = {}
+        for cluster in clusters:
+            position = cluster["position"]
+            doc = entries[position][1]
+            if cluster["members"] == 1 and cluster["count"] == int(doc.metadata.get("count", 1)):
+                kept.append(position)
+                continue
+            merged[position] = merged_memory(strip_prefix(doc.page_content), cluster["count"],
+                                             cluster["first_seen"], cluster["last_seen"])
+            kept.append(position)
+        return sorted(kept), merged, report
+
+    def compact(self):
+        """Run one compaction pass and return its report (sizes before and after)."""
+        if self.manager.is_lossy():
+            # Les vecteurs reconstruits d'un index IVF-PQ sont approchés : réentraîner dessus à chaque
+            # passe dégraderait le rappel un peu plus à chaque fois
+            print("⚠️ Compactage des mémoires ignoré : index avec perte (IVF-PQ), "
+                  "vecteurs d'origine indisponibles")
+            self.last_report = {"skipped": "lossy_index"}
+            return self.last_report
+        with span("memory_compaction"):
+            vectors, entries = self.manager.entries()
+            report = {"vectors_before": len(entries), "bytes_before": self.manager.store.disk_bytes()}
+            kept, merged, plan = self.plan(vectors, entries)
+            report.update(plan)
+            if len(kept) == len(entries) and not merged:
+                report.update(vectors_after=len(entries), bytes_after=report["bytes_before"])
+            else:
+                rebuilt = [(entries[position][0], merged.get(position, entries[position][1])) for position in kept]
+                # Seules des mémoires changent : le cache de réponses reste valide
+                self.manager.rewrite(vectors[kept], rebuilt, since=len(entries), documents=False)
+                report.update(vectors_after=self.manager.size(), bytes_after=self.manager.store.disk_bytes())
+        registry.inc("llmops_memory_compacted_total", report["merged"], kind="merged")
+        registry.inc("llmops_memory_compacted_total", report["expired"], kind="expired")
+        registry.inc("llmops_memory_compacted_total", report["capped"], kind="capped")
+        self.last_report = report
+        print(f"🧹 Mémoires compactées : {report['memories']} mémoire(s), {report['merged']} fusionnée(s), "
+              f"{report['expired']} expirée(s), {report['capped']} hors plafond — index "
+              f"{report['vectors_before']} → {report['vectors_after']} vecteurs, "
+              f"{report['bytes_before'] / 1e6:.1f} → {report['bytes_after'] / 1e6:.1f} Mo")
+        return report
+
+    # ⏱️ Tâche de fond périodique
+    def start(self):
+        if self.interval <= 0 or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="memory-compaction", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                if self.manager.exists():
+                    self.compact()
+            except Exception as e:
+                print(f"❌ Erreur lors du compactage des mémoires : {e}")
+
+
+# 🖥️ Compactage manuel
+def main():
+    from embedding_cache import cached_openai_embeddings
+    from vectorstore_service import get_vectorstore_manager
+
+    parser = argparse.ArgumentParser(description="Fusionne les mémoires quasi identiques et applique la rétention.")
+    parser.add_argument("vectorstore", nargs="?", default="vectorstore")
+    parser.add_argument("--threshold", type=float, default=MEMORY_DUP_THRESHOLD)
+    parser.add_argument("--ttl-days", type=float, default=MEMORY_TTL_DAYS)
+    parser.add_argument("--max-entries", type=int, default=MEMORY_MAX_ENTRIES)
+    args = parser.parse_args()
+
+    load_dotenv()
+    manager = get_vectorstore_manager(args.vectorstore, cached_openai_embeddings(openai_api_key=os.getenv("OPENAI_API_KEY")))
+    MemoryCompactor(manager, args.threshold, args.ttl_days, args.max_entries, interval=0).compact()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+import bisect
+import heapq
+import itertools
+import re
+from collections import defaultdict
+from datetime import datetime
+
+
+SOURCES = ("memory", "upload", "preloaded")
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+TIMESTAMP_PREFIX = re.compile(r"\[(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})\]")
+DOC_PREFIX = re.compile(r"\[[^\]]+\] \(Doc: (.+?)\) ")
+
+
+def now_timestamp():
+    return datetime.now().strftime(TIMESTAMP_FORMAT)
+
+
+def memory_metadata(timestamp=None):
+    return {"source": "memory", "timestamp": timestamp or now_timestamp()}
+
+
+def upload_metadata(file_name, timestamp=None, **extra):
+    return {"source": "upload", "file_name": file_name, "timestamp": timestamp or now_timestamp(), **extra}
+
+
+def infer_metadata(doc):
+    """Return structured metadata, deduced from the text prefix for older entries."""
+    metadata = doc.metadata or {}
+    if metadata.get("source") in SOURCES:
+        return metadata
+    content = doc.page_content.strip()
+    match = TIMESTAMP_PREFIX.match(content)
+    if not match:
+        return {"source": "preloaded", "timestamp": ""}
+    file_match = DOC_PREFIX.match(content)
+    if file_match:
+        return {"source": "upload", "file_name": file_match.group(1), "timestamp": match.group(1)}
+    return {"source": "memory", "timestamp": match.group(1)}
+
+
+# 🗂️ Index secondaire trié par date, par source et par fichier : les N entrées
+# les plus récentes se lisent sans parcourir tout le docstore.
+class MetadataIndex:
+    def __init__(self):
+        self._by_source = defaultdict(list)
+        self._by_file = defaultdict(list)
+        self._seq = itertools.count()
+        self._known = set()
+
+    def add(self, doc_id, metadata):
+        if doc_id in self._known:
+            return
+        self._known.add(doc_id)
+        # Le numéro de séquence départage les entrées de même horodatage (ordre d'insertion)
+        entry = (metadata.get("timestamp", ""), next(self._seq), doc_id)
+        bisect.insort(self._by_source[metadata.get("source", "preloaded")], entry)
+        if metadata.get("file_name"):
+            bisect.insort(self._by_file[metadata["file_name"]], entry)
+
+    def __len__(self):
+        return len(self._known)
+
+    def count(self, source=None, file_name=None):
+        if file_name:
+            return len(self._by_file.get(file_name, []))
+        if source:
+            return sum(len(self._by_source.get(name, [])) for name in self._sources(source))
+        return len(self._known)
+
+    def files(self):
+        return sorted(self._by_file)
+
+    def newest(self, limit=10, offset=0, source=None, file_name=None):
+        """Return up to ``limit`` doc ids, newest first, skipping ``offset``."""
+        wanted = offset + limit
+        if file_name:
+            lists = [self._by_file.get(file_name, [])]
+        else:
+            lists = [self._by_source.get(name, []) for name in self._sources(source)]
+        # Seules les `offset + limit` dernières entrées de chaque liste sont parcourues
+        tails = [reversed(entries[-wanted:]) for entries in lists]
+        merged = heapq.merge(*tails, reverse=True)
+        return [doc_id for _, _, doc_id in itertools.islice(merged, offset, wanted)]
+
+    @staticmethod
+    def _sources(source):
+        if source is None:
+            return SOURCES
+        if isinstance(source, str):
+            return (source,)
+        return tuple(source)
@@ -0,0 +1,183 @@
+import atexit
+import json
+import os
+import queue
+import re
+import threading
+import time
+
+from memory_index import memory_metadata, now_timestamp
+from metrics import registry, span
+
+
+# ⚙️ Réglages de l'apprentissage (surchargeables par variables d'environnement)
+LEARNING_QUEUE_SIZE = int(os.getenv("LEARNING_QUEUE_SIZE", "1000"))
+LEARNING_BATCH_SIZE = int(os.getenv("LEARNING_BATCH_SIZE", "20"))
+LEARNING_MAX_WAIT = float(os.getenv("LEARNING_MAX_WAIT", "10"))
+
+BATCH_ANALYSIS_PROMPT = """
+Tu es un assistant spécialisé en naturalisation française.
+
+Analyse chacun de ces messages utilisateur (numérotés) :
+{messages}
+
+Pour chaque message :
+- S'il contient une information factuelle utile, résume-la clairement en une phrase.
+- Sinon, réponds uniquement "NON".
+
+Réponds uniquement avec une liste JSON, un objet par message, par exemple :
+[{{"id": 1, "fact": "..."}}, {{"id": 2, "fact": "NON"}}]
+"""
+
+
+def parse_batch_analysis(text, count):
+    """Return one fact (or None) per message from the LLM batch answer."""
+    facts = [None] * count
+    match = re.search(r"\[.*\]", text, re.DOTALL)
+    try:
+        items = json.loads(match.group(0)) if match else []
+    except ValueError:
+        items = []
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        try:
+            index = int(item.get("id")) - 1
+        except (TypeError, ValueError):
+            continue
+        fact = str(item.get("fact") or "").strip()
+        if 0 <= index < count and fact and fact.upper() != "NON":
+            facts[index] = fact
+    return facts
+
+
+# 🧠 File d'apprentissage en arrière-plan : les messages sont classés par lots
+# (un seul appel LLM pour plusieurs messages) et les faits retenus sont
+# ajoutés à l'index en une seule écriture, hors du chemin de réponse.
+class MemoryLearner:
+    def __init__(self, vectorstore, llm, max_queue=LEARNING_QUEUE_SIZE, batch_size=LEARNING_BATCH_SIZE,
+                 max_wait=LEARNING_MAX_WAIT):
+        self.vectorstore = vectorstore
+        self.llm = llm
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._thread_lock = threading.Lock()
+        self._stopping = threading.Event()
+        self.submitted = 0
+        self.dropped = 0
+        self.processed = 0
+        self.learned = 0
+        self.batches = 0
+        self.errors = 0
+        self.last_lag = 0.0
+        self.last_batch_seconds = 0.0
+
+    def submit(self, message):
+        """Queue a user message without blocking; return False when the queue is full."""
+        self._ensure_started()
+        try:
+            self._queue.put_nowait((time.monotonic(), message))
+        except queue.Full:
+            self.dropped += 1
+            return False
+        self.submitted += 1
+        return True
+
+    def stats(self):
+        return {
+            "queue_depth": self._queue.qsize(),
+            "submitted": self.submitted,
+            "dropped": self.dropped,
+            "processed": self.processed,
+            "learned": self.learned,
+            "batches": self.batches,
+            "errors": self.errors,
+            "last_lag_seconds": round(self.last_lag, 3),
+            "last_batch_seconds": round(self.last_batch_seconds, 3),
+        }
+
+    def stop(self, timeout=30):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _ensure_started(self):
+        with self._thread_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="memory-learner", daemon=True)
+                self._thread.start()
+
+    def _next_batch(self):
+        try:
+            batch = [self._queue.get(timeout=1)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.batch_size and not self._stopping.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=min(remaining, 1)))
+            except queue.Empty:
+                continue
+        return batch
+
+    def _run(self):
+        while not (self._stopping.is_set() and self._queue.empty()):
+            batch = self._next_batch()
+            if not batch:
+                continue
+            try:
+                self.process_batch(batch)
+            except Exception as e:
+                self.errors += 1
+                print(f"❌ Erreur lors de l'apprentissage de la mémoire : {e}")
+
+    def process_batch(self, batch):
+        started = time.monotonic()
+        self.last_lag = started - batch[0][0]
+        messages = [message for _, message in batch]
+
+        numbered = "\n".join(f'{i + 1}. "{message}"' for i, message in enumerate(messages))
+        with span("memory_analysis"):
+            answer = self.llm.invoke(BATCH_ANALYSIS_PROMPT.format(messages=numbered))
+        facts = [fact for fact in parse_batch_analysis(answer.content, len(messages)) if fact]
+
+        if facts:
+            timestamp = now_timestamp()
+            texts = [f"[{timestamp}] {fact}" for fact in facts]
+            self.vectorstore.add_texts(texts, metadatas=[memory_metadata(timestamp) for _ in texts])
+            for text in texts:
+                print(f"📌 Nouvelle mémoire ajoutée : {text}")
+
+        self.processed += len(messages)
+        self.learned += len(facts)
+        self.batches += 1
+        self.last_batch_seconds = time.monotonic() - started
+        print(f"🧠 Lot analysé : {len(messages)} message(s), {len(facts)} fait(s) retenu(s) — {self.stats()}")
+        return facts
+
+
+_learners = []
+
+
+def _learner_queue_depth():
+    return [(None, sum(learner._queue.qsize() for learner in _learners))]
+
+
+registry.gauge_function("llmops_memory_queue_depth", _learner_queue_depth)
+
+
+def create_memory_learner(vectorstore, llm, **kwargs):
+    learner = MemoryLearner(vectorstore, llm, **kwargs)
+    _learners.append(learner)
+    return learner
+
+
+@atexit.register
+def _drain_all():
+    for learner in _learners:
+        learner.stop()
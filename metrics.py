@@ -0,0 +1,264 @@
+import functools
+import os
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+
+# ⚙️ Réglages (surchargeables par variables d'environnement)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+PROFILE_SLOW_MS = float(os.getenv("PROFILE_SLOW_MS", "0"))  # 0 : profilage désactivé
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", "0.005"))
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    escaped = [(name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for name, value in pairs]
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+# 📈 Registre minimal au format texte Prometheus (compteurs, jauges, histogrammes)
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._help = {}
+        self._counters = defaultdict(Counter)
+        self._gauges = defaultdict(dict)
+        self._gauge_functions = {}
+        self._histograms = defaultdict(dict)
+
+    def describe(self, name, kind, help_text):
+        self._help[name] = (kind, help_text)
+
+    def inc(self, name, value=1, **labels):
+        with self._lock:
+            self._counters[name][_label_key(labels)] += value
+
+    def set(self, name, value, **labels):
+        with self._lock:
+            self._gauges[name][_label_key(labels)] = value
+
+    def gauge_function(self, name, func):
+        """Register ``func() -> [(labels_dict_or_None, value), ...]`` evaluated at scrape time."""
+        self._gauge_functions[name] = func
+
+    def observe(self, name, value, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            histogram = self._histograms[name].get(key)
+            if histogram is None:
+                histogram = {"buckets": [0] * len(DEFAULT_BUCKETS), "sum": 0.0, "count": 0}
+                self._histograms[name][key] = histogram
+            for i, bound in enumerate(DEFAULT_BUCKETS):
+                if value <= bound:
+                    histogram["buckets"][i] += 1
+            histogram["sum"] += value
+            histogram["count"] += 1
+
+    def render(self):
+        lines = []
+        gauges = {}
+        for name, func in list(self._gauge_functions.items()):
+            try:
+                gauges[name] = {(_label_key(labels) if labels else ()): value for labels, value in func()}
+            except Exception as e:
+                print(f"❌ Erreur de la jauge {name} : {e}")
+        with self._lock:
+            for name in sorted(set(self._counters) | set(self._gauges) | set(gauges) | set(self._histograms)):
+                kind, help_text = self._help.get(name, (None, None))
+                if help_text:
+                    lines.append(f"# HELP {name} {help_text}")
+                if name in self._histograms:
+                    lines.append(f"# TYPE {name} histogram")
+                    for key, histogram in sorted(self._histograms[name].items()):
+                        for bound, count in zip(DEFAULT_BUCKETS, histogram["buckets"]):
+                            lines.append(f"{name}_bucket{_format_labels(key, [('le', bound)])} {count}")
+                        lines.append(f"{name}_bucket{_format_labels(key, [('le', '+Inf')])} {histogram['count']}")
+                        lines.append(f"{name}_sum{_format_labels(key)} {histogram['sum']}")
+                        lines.append(f"{name}_count{_format_labels(key)} {histogram['count']}")
+                    continue
+                if name in self._counters:
+                    lines.append(f"# TYPE {name} counter")
+                    values = self._counters[name]
+                else:
+                    lines.append(f"# TYPE {name} gauge")
+                    values = {**self._gauges.get(name, {}), **gauges.get(name, {})}
+                for key, value in sorted(values.items()):
+                    lines.append(f"{name}{_format_labels(key)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+registry.describe("llmops_stage_seconds", "histogram", "Durée de chaque étape du traitement")
+registry.describe("llmops_tokens_total", "counter", "Tokens consommés par modèle et par type")
+registry.describe("llmops_llm_requests_total", "counter", "Appels LLM par modèle")
+registry.describe("llmops_vectorstore_documents", "gauge", "Nombre de vecteurs dans l'index")
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+@contextmanager
+def span(stage, **labels):
+    """Time a block into ``llmops_stage_seconds{stage=...}``."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        registry.observe("llmops_stage_seconds", time.perf_counter() - started, stage=stage, **labels)
+
+
+# 🤖 Durée et tokens de chaque appel LLM (ajouté aux callbacks des clients ChatOpenAI)
+class LLMMetricsHandler(BaseCallbackHandler):
+    def __init__(self):
+        self._started = {}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._start(run_id, kwargs)
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._start(run_id, kwargs)
+
+    def _start(self, run_id, kwargs):
+        params = kwargs.get("invocation_params") or {}
+        self._started[run_id] = (time.perf_counter(), params.get("model_name") or params.get("model"))
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        started, model = self._started.pop(run_id, (None, None))
+        llm_output = response.llm_output or {}
+        model = llm_output.get("model_name") or model or "inconnu"
+        usage = dict(llm_output.get("token_usage") or {})
+        if not usage:
+            # Mode streaming : l'usage est porté par le message généré
+            for generations in response.generations:
+                for generation in generations:
+                    metadata = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+                    usage["prompt_tokens"] = usage.get("prompt_tokens", 0) + metadata.get("input_tokens", 0)
+                    usage["completion_tokens"] = usage.get("completion_tokens", 0) + metadata.get("output_tokens", 0)
+                    response_metadata = getattr(getattr(generation, "message", None), "response_metadata", None) or {}
+                    model = response_metadata.get("model_name", model)
+        registry.inc("llmops_llm_requests_total", model=model)
+        registry.inc("llmops_tokens_total", usage.get("prompt_tokens", 0), model=model, kind="prompt")
+        registry.inc("llmops_tokens_total", usage.get("completion_tokens", 0), model=model, kind="completion")
+        if started is not None:
+            registry.observe("llmops_stage_seconds", time.perf_counter() - started, stage="llm", model=model)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._started.pop(run_id, None)
+        registry.inc("llmops_llm_errors_total", error=type(error).__name__)
+
+
+llm_metrics = LLMMetricsHandler()
+
+
+# 🔥 Profilage par échantillonnage des requêtes lentes (piles repliées pour flame graph).
+# Seuls les threads de la requête sont échantillonnés : celui qui ouvre le profil, plus les threads
+# de travail qui exécutent une fonction enveloppée par ``profiled`` (run_in_executor, make_async).
+_current_profiler = ContextVar("current_profiler", default=None)
+
+
+class SlowRequestProfiler:
+    def __init__(self, name, threshold_ms=PROFILE_SLOW_MS, interval=PROFILE_INTERVAL, directory=PROFILE_DIR):
+        self.name = name
+        self.threshold_ms = threshold_ms
+        self.interval = interval
+        self.directory = directory
+        self.samples = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+        self._entry = None
+        self._token = None
+        self._targets = Counter()  # ident -> nombre d'entrées en cours
+        self._names = {}
+        self._targets_lock = threading.Lock()
+
+    @contextmanager
+    def sampling_thread(self):
+        """Sample the calling thread (e.g. a worker running part of the request) until exit."""
+        ident = threading.get_ident()
+        with self._targets_lock:
+            self._targets[ident] += 1
+            self._names[ident] = threading.current_thread().name
+        try:
+            yield
+        finally:
+            with self._targets_lock:
+                self._targets[ident] -= 1
+                if not self._targets[ident]:
+                    del self._targets[ident]
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            with self._targets_lock:
+                targets = [(ident, self._names[ident]) for ident in self._targets]
+            frames = sys._current_frames()
+            for ident, name in targets:
+                frame = frames.get(ident)
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                if stack:
+                    stack.append(name)
+                    self.samples[";".join(reversed(stack))] += 1
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        if self.threshold_ms > 0:
+            self._entry = self.sampling_thread()
+            self._entry.__enter__()
+            self._token = _current_profiler.set(self)
+            self._thread = threading.Thread(target=self._sample, name="profiler", daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        if self._thread is None:
+            return False
+        _current_profiler.reset(self._token)
+        self._entry.__exit__(None, None, None)
+        self._stop.set()
+        self._thread.join()
+        elapsed_ms = (time.perf_counter() - self._started) * 1000
+        if elapsed_ms >= self.threshold_ms and self.samples:
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory, f"{time.strftime('%Y%m%d-%H%M%S')}_{self.name}_{int(elapsed_ms)}ms.folded")
+            with open(path, "w", encoding="utf-8") as f:
+                for stack, count in self.samples.most_common():
+                    f.write(f"{stack} {count}\n")
+            print(f"🔥 Requête lente ({elapsed_ms:.0f} ms) : profil écrit dans {path}")
+        return False
+
+
+def profile_slow(name):
+    return SlowRequestProfiler(name)
+
+
+def profiled(func):
+    """Wrap ``func`` so that the worker thread running it is sampled by the current request's profiler.
+
+    The profiler is looked up when wrapping (in the request's context), so the wrapper can be handed
+    to any executor, even one that does not copy context variables.
+    """
+    profiler = _current_profiler.get()
+    if profiler is None:
+        return func
+
+    @functools.wraps(func)
+    def run(*args, **kwargs):
+        with profiler.sampling_thread():
+            return func(*args, **kwargs)
+
+    return run
@@ -0,0 +1,247 @@
+import copy
+import os
+import queue
+import re
+import threading
+import time
+
+import openai
+from langchain.chains.question_answering.stuff_prompt import PROMPT_SELECTOR
+from langchain_openai import ChatOpenAI
+
+from metrics import llm_metrics, registry, span
+
+
+# ⚙️ Réglages du routage entre modèles (surchargeables par variables d'environnement)
+ROUTER_FAST_MODEL = os.getenv("ROUTER_FAST_MODEL", "gpt-3.5-turbo")
+ROUTER_STRONG_MODEL = os.getenv("ROUTER_STRONG_MODEL", "gpt-4")
+ROUTER_MIN_CONFIDENCE = float(os.getenv("ROUTER_MIN_CONFIDENCE", "0.80"))
+ROUTER_HIGH_CONFIDENCE = float(os.getenv("ROUTER_HIGH_CONFIDENCE", "0.90"))
+ROUTER_SIMPLE_MAX_WORDS = int(os.getenv("ROUTER_SIMPLE_MAX_WORDS", "25"))
+ROUTER_BUDGET = float(os.getenv("ROUTER_BUDGET", "60"))
+ROUTER_HEDGE_AFTER = float(os.getenv("ROUTER_HEDGE_AFTER", "4"))
+ROUTER_CHECK_CHARS = int(os.getenv("ROUTER_CHECK_CHARS", "60"))
+
+# Questions qui demandent un raisonnement (comparaison, cas particulier, condition...)
+COMPLEX_MARKERS = re.compile(
+    r"\b(pourquoi|comparer?|diff[ée]rences?|expliqu\w*|sinon|cas|exception\w*|recours|refus\w*|"
+    r"why|compare|difference|explain|exception|appeal|"
+    r"porque|por qu[ée]|diferencia|perch[ée]|differenza|warum|unterschied)\b",
+    re.IGNORECASE,
+)
+# Début de réponse signalant que le modèle rapide n'a pas trouvé : on passe au modèle fort
+UNSURE_MARKERS = re.compile(
+    r"je ne (sais|peux|dispose)|pas d'information|aucune information|i don'?t know|i do not know|"
+    r"i'?m not sure|no lo s[ée]|non lo so|wei(ß|ss) (ich )?nicht",
+    re.IGNORECASE,
+)
+
+
+def classify_complexity(question):
+    """Return ``("simple" | "complex", reasons)`` from cheap lexical signals."""
+    reasons = []
+    if len(question.split()) > ROUTER_SIMPLE_MAX_WORDS:
+        reasons.append("longue")
+    if question.count("?") > 1:
+        reasons.append("plusieurs questions")
+    if COMPLEX_MARKERS.search(question):
+        reasons.append("raisonnement")
+    return ("complex" if reasons else "simple"), reasons
+
+
+def retrieval_confidence(docs):
+    """Best query/passage cosine recorded by the context packer, or None when unknown."""
+    scores = [doc.metadata["relevance"] for doc in docs if "relevance" in doc.metadata]
+    return max(scores) if scores else None
+
+
+def is_unsure(text):
+    return not text.strip() or bool(UNSURE_MARKERS.search(text[:ROUTER_CHECK_CHARS * 2]))
+
+
+# 🚦 Routeur : le modèle rapide répond aux questions simples ou bien couvertes par le
+# contexte, le modèle fort au reste. Tout se joue dans un seul budget de temps : si le
+# modèle rapide tarde (requête de couverture), échoue ou ne sait pas, le modèle fort
+# prend le relais sans recommencer la recherche.
+class ModelRouter:
+    def __init__(self, retriever, fast_llm, strong_llm, budget=ROUTER_BUDGET, hedge_after=ROUTER_HEDGE_AFTER,
+                 min_confidence=ROUTER_MIN_CONFIDENCE, high_confidence=ROUTER_HIGH_CONFIDENCE,
+                 raise_rate_limits=False):
+        self.retriever = retriever
+        self.tiers = {"fast": fast_llm, "strong": strong_llm}
+        self.prompt = PROMPT_SELECTOR.get_prompt(strong_llm)
+        self.budget = budget
+        self.hedge_after = hedge_after
+        self.min_confidence = min_confidence
+        self.high_confidence = high_confidence
+        # Limitation de débit remontée à l'appelant au lieu d'un relais vers le modèle fort
+        self.raise_rate_limits = raise_rate_limits
+
+    def for_batch(self):
+        """Copy for batch mode: no hedged request, rate limits are raised so the caller backs off."""
+        router = copy.copy(self)
+        router.hedge_after = None
+        router.raise_rate_limits = True
+        return router
+
+    def decide(self, question, docs):
+        complexity, reasons = classify_complexity(question)
+        confidence = retrieval_confidence(docs)
+        if not docs:
+            tier, why = "strong", "aucun contexte"
+        elif confidence is not None and confidence >= self.high_confidence:
+            tier, why = "fast", "contexte très pertinent"
+        elif complexity == "simple" and (confidence is None or confidence >= self.min_confidence):
+            tier, why = "fast", "question simple"
+        else:
+            tier, why = "strong", ", ".join(reasons) or "contexte peu pertinent"
+        return {"tier": tier, "reason": why, "complexity": complexity,
+                "confidence": None if confidence is None else round(confidence, 3)}
+
+    def answer(self, question, on_token=None, docs=None):
+        """Return ``(answer, decision)``; ``on_token`` receives the answer as it streams."""
+        decision = {}
+        parts = []
+        for token in self.stream(question, decision, docs=docs):
+            parts.append(token)
+            if on_token:
+                on_token(token)
+        return "".join(parts).strip(), decision
+
+    def stream(self, question, decision=None, docs=None):
+        """Yield answer tokens; ``decision`` (a dict) is filled with the routing outcome.
+
+        ``docs`` skips the retriever when the context was already retrieved (batch mode).
+        """
+        decision = {} if decision is None else decision
+        started = time.monotonic()
+        deadline = started + self.budget
+        if docs is None:
+            docs = self.retriever.invoke(question)
+        decision.update(self.decide(question, docs))
+        messages = self.prompt.format_prompt(
+            context="\n\n".join(doc.page_content for doc in docs), question=question
+        )
+
+        events = queue.Queue()
+        runs = {}
+
+        def launch(tier):
+            if tier not in runs:
+                runs[tier] = {"started": time.monotonic(), "first_token": None, "stop": threading.Event(), "text": ""}
+                threading.Thread(target=self._run_tier, args=(tier, messages, events, runs[tier]["stop"]),
+                                 name=f"router-{tier}", daemon=True).start()
+
+        def escalate(why):
+            if "strong" not in runs:
+                decision["escalated"] = why
+                registry.inc("llmops_router_escalations_total", reason=why)
+                launch("strong")
+
+        launch(decision["tier"])
+        winner, finished = None, set()
+        try:
+            while True:
+                now = time.monotonic()
+                hedge_at = None
+                if "fast" in runs and self.hedge_after is not None:
+                    hedge_at = runs["fast"]["started"] + self.hedge_after
+                waiting_for_hedge = winner is None and hedge_at is not None and "strong" not in runs
+                timeout = deadline - now
+                if waiting_for_hedge:
+                    timeout = min(timeout, hedge_at - now)
+                if timeout <= 0:
+                    if waiting_for_hedge and now < deadline:
+                        escalate("lent")
+                        continue
+                    raise TimeoutError(f"aucune réponse dans le budget de {self.budget:.0f} s")
+                try:
+                    tier, kind, payload = events.get(timeout=timeout)
+                except queue.Empty:
+                    continue
+                run = runs[tier]
+                if winner is not None and tier != winner:
+                    continue
+
+                if kind == "token":
+                    if run["first_token"] is None:
+                        run["first_token"] = time.monotonic() - run["started"]
+                    if winner == tier:
+                        yield payload
+                        continue
+                    run["text"] += payload
+                    # Le modèle rapide doit d'abord montrer qu'il a une vraie réponse
+                    if tier == "fast" and len(run["text"]) < ROUTER_CHECK_CHARS:
+                        continue
+                    if tier == "fast" and is_unsure(run["text"]) and "strong" not in finished:
+                        run["stop"].set()
+                        finished.add(tier)
+                        escalate("incertain")
+                        continue
+                    winner = tier
+                    self._stop_others(runs, winner)
+                    yield run["text"]
+
+                elif kind == "done":
+                    finished.add(tier)
+                    if winner == tier:
+                        break
+                    if tier == "fast" and is_unsure(run["text"]) and "strong" not in finished:
+                        escalate("incertain")
+                        continue
+                    winner = tier
+                    self._stop_others(runs, winner)
+                    yield run["text"]
+                    break
+
+                elif kind == "error":
+                    finished.add(tier)
+                    print(f"⚠️ Échec du modèle {tier} : {payload}")
+                    if winner == tier or (self.raise_rate_limits and isinstance(payload, openai.RateLimitError)):
+                        raise payload
+                    if tier == "fast":
+                        escalate("erreur")
+                    elif set(runs) <= finished:
+                        raise payload
+        finally:
+            for run in runs.values():
+                run["stop"].set()
+            decision["winner"] = winner
+            decision["seconds"] = round(time.monotonic() - started, 3)
+            self._log(decision, runs)
+
+    def _run_tier(self, tier, messages, events, stop):
+        try:
+            with span("llm_tier", tier=tier):
+                for chunk in self.tiers[tier].stream(messages):
+                    if stop.is_set():
+                        return
+                    if chunk.content:
+                        events.put((tier, "token", chunk.content))
+            events.put((tier, "done", None))
+        except Exception as e:
+            events.put((tier, "error", e))
+
+    @staticmethod
+    def _stop_others(runs, winner):
+        for tier, run in runs.items():
+            if tier != winner:
+                run["stop"].set()
+
+    @staticmethod
+    def _log(decision, runs):
+        for tier, run in runs.items():
+            if run["first_token"] is not None:
+                registry.observe("llmops_stage_seconds", run["first_token"], stage="first_token", tier=tier)
+        registry.inc("llmops_router_decisions_total", tier=decision.get("tier"),
+                     winner=decision.get("winner") or "none")
+        latencies = {tier: run["first_token"] and round(run["first_token"], 3) for tier, run in runs.items()}
+        print(f"🚦 Routage : {decision} — premier token par niveau : {latencies}")
+
+
+def create_model_router(retriever, temperature=0, **kwargs):
+    """Build the router with ChatOpenAI clients for both tiers (``kwargs`` go to both)."""
+    def client(model):
+        return ChatOpenAI(model=model, temperature=temperature, streaming=True, stream_usage=True,
+                          timeout=ROUTER_BUDGET, callbacks=[llm_metrics], **kwargs)
+    return ModelRouter(retriever, client(ROUTER_FAST_MODEL), client(ROUTER_STRONG_MODEL))
@@ -0,0 +1,539 @@
+import argparse
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections.abc import MutableMapping
+from typing import Dict, List, Union
+
+import faiss
+import numpy as np
+from langchain_community.docstore.base import AddableMixin, Docstore
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+
+from metrics import registry, span
+
+
+# ⚙️ Réglages du stockage segmenté (surchargeables par variables d'environnement)
+SEGMENT_COMPACT_AFTER = int(os.getenv("SEGMENT_COMPACT_AFTER", "8"))
+SEGMENT_ORPHAN_AGE = 600  # secondes : un fichier non référencé plus ancien vient d'une écriture interrompue
+STORE_DB = "store.sqlite"
+SEGMENT_DIR = "segments"
+
+
+def legacy_exists(path):
+    """True when ``path`` holds a ``save_local`` store (index.faiss + pickled index.pkl)."""
+    return os.path.exists(os.path.join(path, "index.faiss")) and os.path.exists(os.path.join(path, "index.pkl"))
+
+
+def iter_documents(db):
+    """Yield ``(position, doc_id, Document)`` in index order for any LangChain FAISS store."""
+    if isinstance(db.docstore, SQLiteDocstore):
+        yield from db.docstore.rows()
+    else:
+        for position, doc_id in sorted(db.index_to_docstore_id.items()):
+            yield position, doc_id, db.docstore.search(doc_id)
+
+
+def _document(doc_id, content, metadata):
+    return Document(id=doc_id, page_content=content, metadata=json.loads(metadata))
+
+
+# 📚 Docstore LangChain adossé à store.sqlite : les documents sont lus à la demande,
+# les ajouts restent en mémoire jusqu'à l'écriture du segment correspondant.
+class SQLiteDocstore(Docstore, AddableMixin):
+    def __init__(self, store):
+        self.store = store
+        self._docs = {}       # doc_id -> Document pas encore écrit
+        self._positions = {}  # position -> doc_id pas encore écrit
+        self.committed = store.query("SELECT COUNT(*) FROM docs")[0][0]
+
+    def __len__(self):
+        return self.committed + len(self._positions)
+
+    def add(self, texts: Dict[str, Document]) -> None:
+        ids = list(texts)
+        overlapping = set(ids) & set(self._docs)
+        for start in range(0, len(ids), 500):
+            batch = ids[start:start + 500]
+            overlapping.update(doc_id for (doc_id,) in self.store.query(
+                f"SELECT doc_id FROM docs WHERE doc_id IN ({','.join('?' * len(batch))})", batch
+            ))
+        if overlapping:
+            raise ValueError(f"Tried to add ids that already exist: {overlapping}")
+        self._docs.update(texts)
+
+    def search(self, search: str) -> Union[str, Document]:
+        doc = self._docs.get(search)
+        if doc is not None:
+            return doc
+        rows = self.store.query("SELECT content, metadata FROM docs WHERE doc_id = ?", (search,))
+        return _document(search, *rows[0]) if rows else f"ID {search} not found."
+
+    def mget(self, ids) -> List[Document]:
+        ids = list(ids)
+        found = {doc_id: self._docs[doc_id] for doc_id in ids if doc_id in self._docs}
+        missing = [doc_id for doc_id in ids if doc_id not in found]
+        for start in range(0, len(missing), 500):
+            batch = missing[start:start + 500]
+            for doc_id, content, metadata in self.store.query(
+                f"SELECT doc_id, content, metadata FROM docs WHERE doc_id IN ({','.join('?' * len(batch))})", batch
+            ):
+                found[doc_id] = _document(doc_id, content, metadata)
+        return [found[doc_id] for doc_id in ids if doc_id in found]
+
+    def positions(self, ids):
+        """FAISS position of each of ``ids`` that is stored, as a dict."""
+        ids = list(ids)
+        wanted = set(ids)
+        found = {doc_id: position for position, doc_id in self._positions.items() if doc_id in wanted}
+        missing = [doc_id for doc_id in ids if doc_id not in found]
+        for start in range(0, len(missing), 500):
+            batch = missing[start:start + 500]
+            found.update(self.store.query(
+                f"SELECT doc_id, position FROM docs WHERE doc_id IN ({','.join('?' * len(batch))})", batch
+            ))
+        return found
+
+    def rows(self):
+        for position, doc_id, content, metadata in self.store.query(
+            "SELECT position, doc_id, content, metadata FROM docs ORDER BY position"
+        ):
+            yield position, doc_id, _document(doc_id, content, metadata)
+        yield from self.pending_rows()
+
+    def items(self):
+        for _, doc_id, doc in self.rows():
+            yield doc_id, doc
+
+    def pending_rows(self):
+        return [(position, doc_id, self._docs[doc_id]) for position, doc_id in sorted(self._positions.items())]
+
+    def mark_committed(self, count):
+        for position in sorted(self._positions)[:count]:
+            self._docs.pop(self._positions.pop(position), None)
+        self.committed += count
+
+
+# 📝 Docstore en mémoire d'un contenu réécrit, lisible comme SQLiteDocstore (mget, positions, items)
+# le temps que ce contenu soit enregistré dans store.sqlite
+class MemoryDocstore(InMemoryDocstore):
+    def __init__(self, entries):
+        entries = list(entries)
+        super().__init__(dict(entries))
+        self._index = {doc_id: position for position, (doc_id, _) in enumerate(entries)}
+
+    def mget(self, ids) -> List[Document]:
+        return [self._dict[doc_id] for doc_id in ids if doc_id in self._dict]
+
+    def positions(self, ids):
+        return {doc_id: self._index[doc_id] for doc_id in ids if doc_id in self._index}
+
+    def items(self):
+        return list(self._dict.items())
+
+
+# 🔢 index_to_docstore_id paresseux : position FAISS -> doc_id lu dans store.sqlite
+class LazyIdMap(MutableMapping):
+    def __init__(self, docstore):
+        self.docstore = docstore
+
+    def __getitem__(self, position):
+        position = int(position)
+        doc_id = self.docstore._positions.get(position)
+        if doc_id is not None:
+            return doc_id
+        rows = self.docstore.store.query("SELECT doc_id FROM docs WHERE position = ?", (position,))
+        if not rows:
+            raise KeyError(position)
+        return rows[0][0]
+
+    def __setitem__(self, position, doc_id):
+        self.docstore._positions[int(position)] = doc_id
+
+    def __delitem__(self, position):
+        raise NotImplementedError("suppression non supportée par le stockage segmenté")
+
+    def __len__(self):
+        return len(self.docstore)
+
+    def __iter__(self):
+        return iter(range(len(self.docstore)))
+
+    def items(self):
+        return [(position, doc_id) for position, doc_id, _ in self.docstore.rows()]
+
+    def values(self):
+        return [doc_id for _, doc_id, _ in self.docstore.rows()]
+
+
+# 🧱 Stockage segmenté d'un vectorstore :
+#   store.sqlite          documents (texte + métadonnées JSON) et manifeste des fichiers de vecteurs
+#   segments/base-*.faiss index FAISS compacté
+#   segments/seg-*.npy    vecteurs ajoutés depuis, un fichier par sauvegarde, jamais réécrit
+# Une sauvegarde écrit un nouveau segment puis l'enregistre avec ses documents dans une seule
+# transaction SQLite : une coupure laisse au pire un fichier orphelin, jamais un index corrompu.
+class SegmentStore:
+    def __init__(self, path, compact_after=SEGMENT_COMPACT_AFTER):
+        self.path = path
+        self.compact_after = compact_after
+        self._conn = None
+        self._lock = threading.RLock()
+        self._compaction = None
+
+    def exists(self):
+        return self._conn is not None or os.path.exists(os.path.join(self.path, STORE_DB))
+
+    def _connect(self):
+        if self._conn is None:
+            os.makedirs(os.path.join(self.path, SEGMENT_DIR), exist_ok=True)
+            conn = sqlite3.connect(os.path.join(self.path, STORE_DB), check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=FULL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS docs (position INTEGER PRIMARY KEY, doc_id TEXT UNIQUE NOT NULL, "
+                "content TEXT NOT NULL, metadata TEXT NOT NULL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS manifest (name TEXT PRIMARY KEY, kind TEXT NOT NULL, "
+                "start INTEGER NOT NULL, count INTEGER NOT NULL)"
+            )
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            self._conn = conn
+        return self._conn
+
+    def query(self, sql, params=()):
+        with self._lock:
+            return self._connect().execute(sql, params).fetchall()
+
+    def manifest(self):
+        return self.query("SELECT name, kind, start, count FROM manifest ORDER BY start, kind")
+
+    def _meta(self, key):
+        rows = self.query("SELECT value FROM meta WHERE key = ?", (key,))
+        return rows[0][0] if rows else None
+
+    def generation(self):
+        """Bumped by every write that changes the content (not by compaction)."""
+        return self._counter("generation")
+
+    def epoch(self):
+        """Bumped when the whole content is replaced (positions renumbered): open indexes must be reopened."""
+        return self._counter("epoch")
+
+    def documents_generation(self):
+        """Bumped by the writes flagged ``documents`` (the manager leaves out learned memories)."""
+        return self._counter("documents")
+
+    def _counter(self, key):
+        return int(self._meta(key) or 0) if self.exists() else None
+
+    def _file(self, name):
+        return os.path.join(self.path, SEGMENT_DIR, name)
+
+    @staticmethod
+    def _new_name(kind, suffix):
+        return f"{kind}-{time.strftime('%Y%m%d-%H%M%S')}-{time.time_ns() % 10**9:09d}-{uuid.uuid4().hex[:6]}{suffix}"
+
+    def _write_file(self, name, writer):
+        # Écriture dans un fichier temporaire, fsync puis renommage atomique
+        path = self._file(name)
+        tmp = f"{path}.tmp"
+        writer(tmp)
+        fd = os.open(tmp, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        os.replace(tmp, path)
+
+    def _remove(self, names):
+        for name in names:
+            try:
+                os.remove(self._file(name))
+            except OSError as e:
+                print(f"⚠️ Fichier de segment non supprimé ({name}) : {e}")
+
+    def _cleanup(self):
+        referenced = {name for name, _, _, _ in self.manifest()}
+        now = time.time()
+        for name in os.listdir(os.path.join(self.path, SEGMENT_DIR)):
+            path = self._file(name)
+            if name not in referenced and now - os.path.getmtime(path) > SEGMENT_ORPHAN_AGE:
+                self._remove([name])
+
+    def open(self, embeddings, dim=None):
+        """Return a LangChain FAISS store over the segments; ``dim`` is required for a new store."""
+        if not self.exists() and dim is None:
+            raise FileNotFoundError(f"Aucun vectorstore segmenté dans {self.path}")
+        with span("faiss_load", mode="segments"):
+            self._connect()
+            if dim is not None and self._meta("dim") is None:
+                self.query("INSERT INTO meta VALUES ('dim', ?)", (str(dim),))
+            self._cleanup()
+            for attempt in range(2):
+                try:
+                    index = self._load_index(self.manifest())
+                    break
+                except FileNotFoundError:
+                    # Compactage concurrent (autre processus) : on relit le manifeste
+                    if attempt:
+                        raise
+        return self.attach(embeddings, index)
+
+    def attach(self, embeddings, index):
+        """Return a LangChain FAISS store over ``index`` (already in memory) and the committed documents."""
+        docstore = SQLiteDocstore(self)
+        if index.ntotal != docstore.committed:
+            raise ValueError(f"Vectorstore incohérent : {index.ntotal} vecteurs pour {docstore.committed} documents")
+        return FAISS(embeddings, index, docstore, LazyIdMap(docstore))
+
+    def _load_index(self, manifest):
+        index = None
+        for name, kind, _, _ in manifest:
+            if kind == "base":
+                index = faiss.read_index(self._file(name))
+                continue
+            vectors = np.load(self._file(name))
+            if index is None:
+                index = faiss.IndexFlatL2(vectors.shape[1])
+            index.add(vectors)
+        return index if index is not None else faiss.IndexFlatL2(int(self._meta("dim")))
+
+    def append(self, vectors, rows, documents=True):
+        """Persist ``(position, doc_id, Document)`` rows (a docstore's ``pending_rows``) with their ``vectors``.
+
+        The caller marks them committed in its docstore once this returns (``mark_committed``).
+        """
+        if not rows:
+            return None
+        vectors = np.ascontiguousarray(vectors, dtype="float32")
+        if len(vectors) != len(rows):
+            raise ValueError(f"{len(vectors)} vecteurs pour {len(rows)} documents à écrire")
+
+        def write(tmp):
+            with open(tmp, "wb") as f:
+                np.save(f, vectors)
+
+        name = self._new_name("seg", ".npy")
+        with span("faiss_save", mode="segment"):
+            self._write_file(name, write)
+            with self._lock:
+                conn = self._connect()
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    (expected,) = conn.execute("SELECT COALESCE(MAX(position) + 1, 0) FROM docs").fetchone()
+                    if rows[0][0] != expected:
+                        raise RuntimeError(f"Vectorstore modifié par un autre processus ({self.path}) : rechargez-le")
+                    conn.executemany("INSERT INTO docs VALUES (?, ?, ?, ?)", [
+                        (position, doc_id, doc.page_content, json.dumps(doc.metadata, ensure_ascii=False))
+                        for position, doc_id, doc in rows
+                    ])
+                    conn.execute("INSERT INTO manifest VALUES (?, 'segment', ?, ?)", (name, rows[0][0], len(rows)))
+                    self._bump(conn)
+                    if documents:
+                        self._bump(conn, "documents")
+                    conn.execute("COMMIT")
+                except BaseException:
+                    conn.execute("ROLLBACK")
+                    self._remove([name])
+                    raise
+        registry.inc("llmops_segments_written_total")
+        self._maybe_compact()
+        return name
+
+    @staticmethod
+    def _bump(conn, key="generation"):
+        conn.execute(
+            "INSERT INTO meta VALUES (?, '1') "
+            "ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1", (key,)
+        )
+
+    # 📥 Lecture incrémentale de ce qu'un autre processus a ajouté depuis l'ouverture
+    def read_since(self, start, epoch):
+        """Vectors and ``(position, doc_id, Document)`` rows stored from position ``start`` on.
+
+        Returns None when the content was replaced since ``epoch`` or when those vectors were
+        merged into a base file: the store must then be opened again.
+        """
+        with self._lock:
+            conn = self._connect()
+            # Une seule transaction de lecture : manifeste et documents d'une même sauvegarde
+            conn.execute("BEGIN")
+            try:
+                current = conn.execute("SELECT value FROM meta WHERE key = 'epoch'").fetchone()
+                manifest = conn.execute("SELECT name, kind, start, count FROM manifest ORDER BY start, kind").fetchall()
+                rows = conn.execute(
+                    "SELECT position, doc_id, content, metadata FROM docs WHERE position >= ? ORDER BY position",
+                    (start,),
+                ).fetchall()
+                dim = conn.execute("SELECT value FROM meta WHERE key = 'dim'").fetchone()
+            finally:
+                conn.execute("COMMIT")
+        if int(current[0] if current else 0) != epoch:
+            return None
+        parts = []
+        try:
+            for name, kind, first, count in manifest:
+                if first + count <= start:
+                    continue
+                if kind == "base":
+                    return None
+                parts.append(np.load(self._file(name))[max(0, start - first):])
+        except FileNotFoundError:
+            # Segments compactés entre-temps par un autre processus
+            return None
+        vectors = np.vstack(parts) if parts else np.zeros((0, int(dim[0])), dtype="float32")
+        if len(vectors) != len(rows):
+            return None
+        return vectors, [(position, doc_id, _document(doc_id, content, metadata))
+                         for position, doc_id, content, metadata in rows]
+
+    # 🗜️ Compactage : base + segments fusionnés dans une nouvelle base, puis bascule du manifeste
+    def _maybe_compact(self):
+        if self.compact_after <= 0:
+            return
+        segments = self.query("SELECT COUNT(*) FROM manifest WHERE kind = 'segment'")[0][0]
+        with self._lock:
+            if segments < self.compact_after or (self._compaction is not None and self._compaction.is_alive()):
+                return
+            self._compaction = threading.Thread(target=self._compact_in_background, name="segment-compaction",
+                                                daemon=True)
+            self._compaction.start()
+
+    def _compact_in_background(self):
+        try:
+            self.compact()
+        except Exception as e:
+            print(f"❌ Erreur lors du compactage du vectorstore : {e}")
+
+    def wait_for_compaction(self):
+        if self._compaction is not None:
+            self._compaction.join()
+
+    def compact(self):
+        """Merge the base index and every current segment into a new base; return True if done."""
+        manifest = self.manifest()
+        if not any(kind == "segment" for _, kind, _, _ in manifest):
+            return False
+        with span("segment_compaction"):
+            index = self._load_index(manifest)
+            name = self._new_name("base", ".faiss")
+            self._write_file(name, lambda tmp: faiss.write_index(index, tmp))
+        merged = [row[0] for row in manifest]
+        with self._lock:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            still_there = conn.execute(
+                f"SELECT COUNT(*) FROM manifest WHERE name IN ({','.join('?' * len(merged))})", merged
+            ).fetchone()[0]
+            if still_there != len(merged):
+                # Un autre processus a compacté entre-temps
+                conn.execute("ROLLBACK")
+                self._remove([name])
+                return False
+            conn.execute(f"DELETE FROM manifest WHERE name IN ({','.join('?' * len(merged))})", merged)
+            conn.execute("INSERT INTO manifest VALUES (?, 'base', 0, ?)", (name, index.ntotal))
+            conn.execute("COMMIT")
+        self._remove(merged)
+        print(f"🗜️ Vectorstore compacté : {len(merged)} fichier(s) fusionné(s) dans {name} ({index.ntotal} vecteurs)")
+        return True
+
+    def write(self, db, documents=True):
+        """Replace the whole content with ``db`` (any LangChain FAISS store) as a single base."""
+        return self.commit_base(db, self.write_base(db.index), documents=documents)
+
+    def write_base(self, index):
+        """Write ``index`` as a new base file, not referenced until ``commit_base``."""
+        name = self._new_name("base", ".faiss")
+        self._connect()
+        with span("faiss_save", mode="base"):
+            self._write_file(name, lambda tmp: faiss.write_index(index, tmp))
+        return name
+
+    def commit_base(self, db, name, documents=True):
+        """Make the base file ``name`` (written from ``db.index``) and ``db``'s documents the whole content."""
+        rows = list(iter_documents(db))
+        with span("faiss_save", mode="rewrite"):
+            with self._lock:
+                conn = self._connect()
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    previous = [row[0] for row in conn.execute("SELECT name FROM manifest")]
+                    conn.execute("DELETE FROM docs")
+                    conn.execute("DELETE FROM manifest")
+                    conn.executemany("INSERT INTO docs VALUES (?, ?, ?, ?)", [
+                        (position, doc_id, doc.page_content, json.dumps(doc.metadata, ensure_ascii=False))
+                        for position, doc_id, doc in rows
+                    ])
+                    conn.execute("INSERT INTO manifest VALUES (?, 'base', 0, ?)", (name, db.index.ntotal))
+                    conn.execute("INSERT OR REPLACE INTO meta VALUES ('dim', ?)", (str(db.index.d),))
+                    self._bump(conn)
+                    self._bump(conn, "epoch")
+                    if documents:
+                        self._bump(conn, "documents")
+                    conn.execute("COMMIT")
+                except BaseException:
+                    conn.execute("ROLLBACK")
+                    self._remove([name])
+                    raise
+        self._remove(previous)
+        return name
+
+    def disk_bytes(self):
+        """Size on disk of the files the manifest references, plus store.sqlite."""
+        if not self.exists():
+            return 0
+        sizes = [os.path.getsize(self._file(name)) for name, _, _, _ in self.manifest()]
+        db = os.path.join(self.path, STORE_DB)
+        sizes += [os.path.getsize(path) for path in (db, f"{db}-wal") if os.path.exists(path)]
+        return sum(sizes)
+
+    def close(self):
+        self.wait_for_compaction()
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+def load_faiss(path, embeddings):
+    """Open the vectorstore at ``path``, converting a legacy ``save_local`` store on first use."""
+    store = SegmentStore(path)
+    if not store.exists() and legacy_exists(path):
+        migrate(path, embeddings)
+    return store.open(embeddings)
+
+
+def migrate(path, embeddings):
+    # Dernière désérialisation pickle : ensuite seul le format segmenté est lu
+    started = time.perf_counter()
+    legacy = FAISS.load_local(path, embeddings, allow_dangerous_deserialization=True)
+    SegmentStore(path).write(legacy)
+    print(f"📦 Vectorstore {path} converti au format segmenté en {time.perf_counter() - started:.1f}s "
+          f"({legacy.index.ntotal} vecteurs) ; index.faiss / index.pkl ne sont plus utilisés")
+
+
+# 🖥️ Conversion ou compactage manuel
+def main():
+    parser = argparse.ArgumentParser(description="Convertit ou compacte un vectorstore au format segmenté.")
+    parser.add_argument("vectorstore")
+    parser.add_argument("--compact", action="store_true", help="fusionner les segments dans la base")
+    args = parser.parse_args()
+
+    store = SegmentStore(args.vectorstore)
+    if not store.exists():
+        if not legacy_exists(args.vectorstore):
+            parser.error(f"aucun vectorstore dans {args.vectorstore}")
+        migrate(args.vectorstore, None)
+    if args.compact and not store.compact():
+        print("ℹ️ Aucun segment à compacter.")
+    print(f"🧱 Manifeste : {store.manifest()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+import contextvars
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, List
+
+import numpy as np
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from hybrid_retrieval import RETRIEVER_K, BM25Index, reciprocal_rank_fusion
+from metrics import registry, span
+
+
+# ⚙️ Réglages des index de session (surchargeables par variables d'environnement)
+SESSION_INDEX_TTL = float(os.getenv("SESSION_INDEX_TTL", "3600"))
+SESSION_INDEX_MAX_CHUNKS = int(os.getenv("SESSION_INDEX_MAX_CHUNKS", "2000"))
+SESSION_INDEX_MAX_SESSIONS = int(os.getenv("SESSION_INDEX_MAX_SESSIONS", "200"))
+
+# Session de la requête en cours, positionnée par l'application avant d'interroger le retriever
+# (les threads lancés via cl.make_async / asyncio.to_thread en héritent)
+current_session = contextvars.ContextVar("current_session", default=None)
+
+
+class SessionIndexFull(ValueError):
+    pass
+
+
+# 📎 Index éphémère d'une session : les documents envoyés par l'utilisateur, en mémoire
+# (matrice de vecteurs normalisés + BM25), jamais écrits dans le vectorstore partagé.
+class SessionIndex:
+    def __init__(self, max_chunks):
+        self.max_chunks = max_chunks
+        self.docs = []
+        self.hashes = set()
+        self.lexical = BM25Index()
+        self._vectors = np.zeros((0, 0), dtype="float32")
+        self._pending = []
+        self.last_seen = time.monotonic()
+
+    def __len__(self):
+        return len(self.docs)
+
+    def nbytes(self):
+        vectors = self._vectors.nbytes + sum(vector.nbytes for vector in self._pending)
+        return vectors + sum(len(doc.page_content.encode("utf-8")) for doc in self.docs)
+
+    def add_embeddings(self, text_embeddings, metadatas):
+        text_embeddings = list(text_embeddings)
+        if len(self.docs) + len(text_embeddings) > self.max_chunks:
+            raise SessionIndexFull(f"limite de {self.max_chunks} morceaux par session atteinte")
+        for (text, vector), metadata in zip(text_embeddings, metadatas):
+            vector = np.asarray(vector, dtype="float32")
+            self._pending.append(vector / (np.linalg.norm(vector) or 1.0))
+            self.lexical.add(len(self.docs), text)
+            self.docs.append(Document(page_content=text, metadata=dict(metadata)))
+            if metadata.get("chunk_hash"):
+                self.hashes.add(metadata["chunk_hash"])
+        return list(range(len(self.docs) - len(text_embeddings), len(self.docs)))
+
+    def vectors(self):
+        if self._pending:
+            stacked = np.vstack(self._pending)
+            self._vectors = stacked if not len(self._vectors) else np.vstack([self._vectors, stacked])
+            self._pending = []
+        return self._vectors
+
+    def search(self, query_vector, query, k):
+        if not self.docs:
+            return []
+        scores = self.vectors() @ query_vector
+        vector_ranking = [int(i) for i in np.argsort(-scores)[:k]]
+        lexical_ranking = [i for i, _ in self.lexical.search(query, k)]
+        return [self.docs[i] for i in reciprocal_rank_fusion([vector_ranking, lexical_ranking])[:k]]
+
+
+# 🗂️ Index éphémères de toutes les sessions : expirés après SESSION_INDEX_TTL d'inactivité,
+# supprimés à la fin de la session, le plus ancien est évincé au-delà de SESSION_INDEX_MAX_SESSIONS.
+class SessionIndexStore:
+    def __init__(self, embeddings, ttl=SESSION_INDEX_TTL, max_chunks=SESSION_INDEX_MAX_CHUNKS,
+                 max_sessions=SESSION_INDEX_MAX_SESSIONS):
+        self.embeddings = embeddings
+        self.ttl = ttl
+        self.max_chunks = max_chunks
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _evict(self):
+        now = time.monotonic()
+        while self._sessions:
+            oldest_id, oldest = next(iter(self._sessions.items()))
+            if len(self._sessions) > self.max_sessions or now - oldest.last_seen > self.ttl:
+                del self._sessions[oldest_id]
+                print(f"🧹 Index de session évincé : {oldest_id} ({len(oldest)} morceaux)")
+            else:
+                break
+
+    def get(self, session_id, create=False):
+        with self._lock:
+            self._evict()
+            index = self._sessions.get(session_id)
+            if index is None and create:
+                index = SessionIndex(self.max_chunks)
+                self._sessions[session_id] = index
+                self._evict()
+            if index is not None:
+                self._sessions.move_to_end(session_id)
+                index.last_seen = time.monotonic()
+            return index
+
+    def has_documents(self, session_id):
+        index = self.get(session_id)
+        return index is not None and len(index) > 0
+
+    def target(self, session_id):
+        """Ingestion target (``embeddings`` + ``add_embeddings``) for this session's uploads."""
+        return _SessionTarget(self, session_id)
+
+    def search(self, session_id, query, k=RETRIEVER_K):
+        index = self.get(session_id)
+        if index is None or not len(index):
+            return []
+        with span("retrieval", mode="session"):
+            query_vector = np.asarray(self.embeddings.embed_query(query), dtype="float32")
+            query_vector /= np.linalg.norm(query_vector) or 1.0
+            with self._lock:
+                return index.search(query_vector, query, k)
+
+    def snapshot(self, session_id):
+        """Return ``(index, docs, vectors)`` copies of the session's chunks, or None."""
+        with self._lock:
+            index = self._sessions.get(session_id)
+            if index is None:
+                return None
+            return index, list(index.docs), index.vectors().copy()
+
+    def remove(self, session_id, index, positions):
+        """Remove the chunks at ``positions`` (from ``snapshot``) if ``index`` is still the session's."""
+        with self._lock:
+            if self._sessions.get(session_id) is not index:
+                return
+            removed = set(positions)
+            keep = [i for i in range(len(index.docs)) if i not in removed]
+            if not keep:
+                del self._sessions[session_id]
+                return
+            vectors = index.vectors()
+            rebuilt = SessionIndex(self.max_chunks)
+            rebuilt.add_embeddings([(index.docs[i].page_content, vectors[i]) for i in keep],
+                                   [index.docs[i].metadata for i in keep])
+            rebuilt.last_seen = index.last_seen
+            self._sessions[session_id] = rebuilt
+
+    def pop(self, session_id):
+        """Remove the session's index and return it (None if it had none)."""
+        with self._lock:
+            return self._sessions.pop(session_id, None)
+
+    def drop(self, session_id):
+        index = self.pop(session_id)
+        if index is not None:
+            print(f"🧹 Index de session supprimé : {session_id} ({len(index)} morceaux)")
+
+    def sessions(self):
+        with self._lock:
+            self._evict()
+            now = time.monotonic()
+            return [
+                {"session": session_id, "chunks": len(index), "bytes": index.nbytes(),
+                 "files": sorted({doc.metadata.get("file_name") for doc in index.docs} - {None}),
+                 "idle_seconds": round(now - index.last_seen, 1)}
+                for session_id, index in self._sessions.items()
+            ]
+
+    def stats(self):
+        sessions = self.sessions()
+        return {"sessions": len(sessions), "chunks": sum(item["chunks"] for item in sessions),
+                "bytes": sum(item["bytes"] for item in sessions)}
+
+
+class _SessionTarget:
+    def __init__(self, store, session_id):
+        self.store = store
+        self.session_id = session_id
+        self.embeddings = store.embeddings
+
+    def hashes(self):
+        index = self.store.get(self.session_id)
+        return set(index.hashes) if index is not None else set()
+
+    def add_embeddings(self, text_embeddings, metadatas):
+        index = self.store.get(self.session_id, create=True)
+        with self.store._lock:
+            return index.add_embeddings(text_embeddings, metadatas)
+
+
+# 🔀 Candidats du vectorstore partagé fusionnés (RRF) avec ceux de l'index de la session courante
+class SessionAwareRetriever(BaseRetriever):
+    retriever: Any
+    sessions: Any
+    k: int = RETRIEVER_K
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        docs = self.retriever.invoke(query)
+        session_id = current_session.get()
+        if session_id is None:
+            return docs
+        session_docs = self.sessions.search(session_id, query, self.k)
+        if not session_docs:
+            return docs
+        registry.inc("llmops_session_retrievals_total")
+        candidates = {("shared", i): doc for i, doc in enumerate(docs)}
+        candidates.update({("session", i): doc for i, doc in enumerate(session_docs)})
+        fused = reciprocal_rank_fusion([[("shared", i) for i in range(len(docs))],
+                                        [("session", i) for i in range(len(session_docs))]])
+        return [candidates[key] for key in fused[:max(len(docs), self.k)]]
@@ -0,0 +1,254 @@
+import argparse
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from typing import List
+
+import faiss
+import numpy as np
+from dotenv import load_dotenv
+from langchain_core.documents import Document
+
+from hybrid_retrieval import HybridRetriever, tokenize
+from index_backends import apply_search_params, make_reconstructible, reconstruct_vectors
+from metrics import span
+from segment_store import iter_documents
+
+
+# ⚙️ Réglages de l'index partagé (surchargeables par variables d'environnement)
+SHARED_INDEX_PATH = os.getenv("SHARED_INDEX_PATH", "")
+SHARED_INDEX_POLL = float(os.getenv("SHARED_INDEX_POLL", "2"))
+SHARED_INDEX_KEEP = int(os.getenv("SHARED_INDEX_KEEP", "3"))
+# Publication complète (index + docstore + FTS) : regroupée sur un délai plus long que les sauvegardes
+SHARED_INDEX_PUBLISH_INTERVAL = float(os.getenv("SHARED_INDEX_PUBLISH_INTERVAL", "300"))
+CURRENT = "CURRENT"
+# Limite de variables par requête SQLite
+_SQL_CHUNK = 500
+
+
+# 📦 Docstore compact : une base SQLite (texte, métadonnées JSON, index plein texte FTS5)
+def write_docstore(path, db):
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=OFF")
+    conn.execute(
+        "CREATE TABLE docs (position INTEGER PRIMARY KEY, doc_id TEXT UNIQUE NOT NULL, "
+        "content TEXT NOT NULL, metadata TEXT NOT NULL)"
+    )
+    conn.execute(
+        "CREATE VIRTUAL TABLE docs_fts USING fts5(content, content='docs', content_rowid='position', "
+        "tokenize='unicode61 remove_diacritics 2')"
+    )
+    rows = (
+        (position, doc_id, doc.page_content, json.dumps(doc.metadata, ensure_ascii=False))
+        for position, doc_id, doc in iter_documents(db)
+    )
+    conn.executemany("INSERT INTO docs VALUES (?, ?, ?, ?)", rows)
+    conn.execute("INSERT INTO docs_fts(docs_fts) VALUES ('rebuild')")
+    conn.commit()
+    conn.close()
+
+
+def publish_snapshot(db, root, keep=SHARED_INDEX_KEEP):
+    """Write ``db`` as a new snapshot under ``root`` and atomically make it current."""
+    os.makedirs(root, exist_ok=True)
+    # Nom triable chronologiquement, unique même entre plusieurs processus publieurs
+    name = f"{time.strftime('%Y%m%d-%H%M%S')}-{time.time_ns() % 10**9:09d}-{uuid.uuid4().hex[:6]}"
+    staging = os.path.join(root, f".{name}.tmp")
+    os.makedirs(staging)
+    faiss.write_index(db.index, os.path.join(staging, "index.faiss"))
+    write_docstore(os.path.join(staging, "docstore.sqlite"), db)
+    os.replace(staging, os.path.join(root, name))
+
+    # Le pointeur CURRENT est remplacé en une seule opération : un lecteur voit l'ancien ou le nouveau
+    pointer = os.path.join(root, f".{CURRENT}.{name}")
+    with open(pointer, "w", encoding="utf-8") as f:
+        f.write(name)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(pointer, os.path.join(root, CURRENT))
+    print(f"📤 Index publié : {os.path.join(root, name)} ({db.index.ntotal} vecteurs)")
+    _prune(root, keep)
+    return name
+
+
+def _prune(root, keep):
+    # Les lecteurs qui ont encore un ancien instantané ouvert le gardent lisible (fichiers déjà ouverts)
+    snapshots = sorted(name for name in os.listdir(root) if not name.startswith(".") and name != CURRENT)
+    with open(os.path.join(root, CURRENT), encoding="utf-8") as f:
+        current = f.read().strip()
+    for name in snapshots[:-keep]:
+        if name == current:
+            continue
+        try:
+            shutil.rmtree(os.path.join(root, name))
+        except OSError as e:
+            print(f"⚠️ Ancien instantané non supprimé ({name}) : {e}")
+
+
+class _Snapshot:
+    def __init__(self, root, name):
+        self.name = name
+        path = os.path.join(root, name)
+        with span("faiss_load", mode="mmap"):
+            # Mappé en lecture seule : les pages sont partagées entre tous les workers de la machine
+            self.index = faiss.read_index(os.path.join(path, "index.faiss"),
+                                          faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+        make_reconstructible(apply_search_params(self.index))
+        try:
+            faiss.extract_index_ivf(self.index)
+        except RuntimeError:
+            # Seules les listes inversées IVF restent sur disque ; les autres types sont recopiés
+            print("⚠️ Index non IVF : chaque worker en garde une copie en RAM (voir index_backends --type ivf).")
+        self.conn = sqlite3.connect(f"file:{os.path.join(path, 'docstore.sqlite')}?mode=ro", uri=True,
+                                    check_same_thread=False)
+        self.lock = threading.Lock()
+
+    def query(self, sql, params=()):
+        with self.lock:
+            return self.conn.execute(sql, params).fetchall()
+
+
+# 👀 Lecteur d'index publié, pour les workers WSGI : pas de copie de l'index en RAM,
+# les nouvelles publications sont détectées en relisant CURRENT à intervalle régulier.
+class SharedIndexReader:
+    def __init__(self, root, embeddings, poll_interval=SHARED_INDEX_POLL):
+        self.root = root
+        self.embeddings = embeddings
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._checked = 0.0
+        self._listeners = []
+        self.version = 0
+
+    def _current_name(self):
+        with open(os.path.join(self.root, CURRENT), encoding="utf-8") as f:
+            return f.read().strip()
+
+    def snapshot(self):
+        with self._lock:
+            now = time.monotonic()
+            if self._snapshot is not None and now - self._checked < self.poll_interval:
+                return self._snapshot
+            self._checked = now
+            name = self._current_name()
+            if self._snapshot is not None and self._snapshot.name == name:
+                return self._snapshot
+            previous, self._snapshot = self._snapshot, _Snapshot(self.root, name)
+            self.version += 1
+            print(f"🔄 Instantané d'index chargé : {name} ({self._snapshot.index.ntotal} vecteurs)")
+        if previous is not None:
+            self._notify()
+        return self._snapshot
+
+    def exists(self):
+        return os.path.exists(os.path.join(self.root, CURRENT))
+
+    def size(self):
+        return self.snapshot().index.ntotal
+
+    def as_retriever(self, **search_kwargs):
+        from vectorstore_service import LiveRetriever
+        return LiveRetriever(manager=self, search_kwargs=search_kwargs)
+
+    def as_hybrid_retriever(self, **kwargs):
+        return HybridRetriever(manager=self, **kwargs)
+
+    def _search_ids(self, snapshot, vectors, k):
+        _, found = snapshot.index.search(np.ascontiguousarray(vectors, dtype="float32"), k)
+        found = [[int(position) for position in row if position != -1] for row in found]
+        positions = sorted({position for row in found for position in row})
+        if not positions:
+            return [[] for _ in found]
+        rows = {}
+        for start in range(0, len(positions), _SQL_CHUNK):
+            chunk = positions[start:start + _SQL_CHUNK]
+            rows.update(snapshot.query(
+                f"SELECT position, doc_id FROM docs WHERE position IN ({','.join('?' * len(chunk))})", chunk
+            ))
+        return [[rows[position] for position in row if position in rows] for row in found]
+
+    def vector_search_ids(self, query: str, k: int = 4):
+        return self._search_ids(self.snapshot(), [self.embeddings.embed_query(query)], k)[0]
+
+    def vector_search_ids_batch(self, vectors, k: int = 4):
+        return self._search_ids(self.snapshot(), vectors, k)
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs):
+        snapshot = self.snapshot()
+        return self._documents(snapshot, self._search_ids(snapshot, [self.embeddings.embed_query(query)], k)[0])
+
+    # 🔤 BM25 servi par l'index FTS5 du docstore, sans index lexical en mémoire
+    def lexical_search(self, query: str, k: int = 4):
+        terms = [token for token in dict.fromkeys(tokenize(query)) if token.isalnum()]
+        if not terms:
+            return []
+        match = " OR ".join(f'"{term}"' for term in terms)
+        rows = self.snapshot().query(
+            "SELECT docs.doc_id, bm25(docs_fts) FROM docs_fts JOIN docs ON docs.position = docs_fts.rowid "
+            "WHERE docs_fts MATCH ? ORDER BY bm25(docs_fts) LIMIT ?", (match, k)
+        )
+        return [(doc_id, -score) for doc_id, score in rows]
+
+    def get_documents(self, ids):
+        return self._documents(self.snapshot(), ids)
+
+    def get_vectors(self, ids):
+        """Stored vector of each of ``ids``, read back from the snapshot's index, as a dict."""
+        snapshot = self.snapshot()
+        ids = list(ids)
+        positions = {}
+        for start in range(0, len(ids), _SQL_CHUNK):
+            chunk = ids[start:start + _SQL_CHUNK]
+            positions.update(snapshot.query(
+                f"SELECT doc_id, position FROM docs WHERE doc_id IN ({','.join('?' * len(chunk))})", chunk
+            ))
+        return dict(zip(positions, reconstruct_vectors(snapshot.index, list(positions.values()))))
+
+    @staticmethod
+    def _documents(snapshot, ids) -> List[Document]:
+        ids = list(ids)
+        if not ids:
+            return []
+        rows = {
+            doc_id: Document(id=doc_id, page_content=content, metadata=json.loads(metadata))
+            for doc_id, content, metadata in snapshot.query(
+                f"SELECT doc_id, content, metadata FROM docs WHERE doc_id IN ({','.join('?' * len(ids))})", ids
+            )
+        }
+        return [rows[doc_id] for doc_id in ids if doc_id in rows]
+
+    # 🔔 Même contrat que VectorStoreManager : les abonnés sont prévenus à chaque nouvel instantané
+    def subscribe(self, callback):
+        self._listeners.append(callback)
+
+    def _notify(self):
+        for callback in list(self._listeners):
+            try:
+                callback(self)
+            except Exception as e:
+                print(f"❌ Erreur dans un abonné de l'index partagé : {e}")
+
+
+# 🖥️ Publication manuelle d'un vectorstore existant
+def main():
+    from embedding_cache import cached_openai_embeddings
+    from vectorstore_service import get_vectorstore_manager
+
+    parser = argparse.ArgumentParser(description="Publie un vectorstore FAISS pour les workers WSGI (mmap + SQLite).")
+    parser.add_argument("vectorstore")
+    parser.add_argument("out", nargs="?", default=SHARED_INDEX_PATH or "shared_index")
+    parser.add_argument("--keep", type=int, default=SHARED_INDEX_KEEP)
+    args = parser.parse_args()
+
+    load_dotenv()
+    manager = get_vectorstore_manager(args.vectorstore, cached_openai_embeddings())
+    publish_snapshot(manager.db, args.out, args.keep)
+
+
+if __name__ == "__main__":
+    main()
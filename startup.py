@@ -0,0 +1,131 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+# ⚙️ Réglages du démarrage (surchargeables par variables d'environnement)
+STARTUP_MODE = os.getenv("STARTUP_MODE", "background")  # background : le serveur répond pendant le chargement ; eager
+WARMUP_TOUCH_INDEX = os.getenv("WARMUP_TOUCH_INDEX", "1") == "1"
+WARMUP_QUERIES = int(os.getenv("WARMUP_QUERIES", "0"))  # requêtes de chauffe complètes (appels d'embeddings payants)
+
+WARMUP_QUESTIONS = [
+    "Quelle est la durée de résidence exigée pour la naturalisation ?",
+    "Quels documents faut-il fournir pour le dossier ?",
+    "Où déposer la demande de naturalisation ?",
+]
+
+
+def touch_files(path, chunk_size=1 << 24):
+    """Read every file under ``path`` once so that the index and docstore pages sit in the page cache."""
+    total = 0
+    for directory, _, names in os.walk(path):
+        for name in names:
+            with open(os.path.join(directory, name), "rb") as f:
+                while True:
+                    data = f.read(chunk_size)
+                    if not data:
+                        break
+                    total += len(data)
+    return total
+
+
+def _index_path(store):
+    # Lecteur d'index partagé : seul l'instantané courant est utile
+    if hasattr(store, "snapshot"):
+        return os.path.join(store.root, store.snapshot().name)
+    return store.path
+
+
+def _missing_index(store):
+    def fail():
+        raise FileNotFoundError(f"index introuvable : {getattr(store, 'path', None) or store.root}")
+    return fail
+
+
+def store_warmup_steps(store, retriever=None, hybrid=True, required=True):
+    """Standard warm-up for a vectorstore manager or shared-index reader.
+
+    A ``required`` store that does not exist yields a failing ``index_load`` step, so that
+    the readiness probe reports the error instead of sending traffic to a broken instance.
+    """
+    if not store.exists():
+        return [("index_load", _missing_index(store))] if required else []
+    steps = [("index_load", store.size)]
+    if hybrid:
+        steps.append(("lexical_index", lambda: store.lexical_search("naturalisation", 1)))
+    if WARMUP_TOUCH_INDEX:
+        steps.append(("page_cache", lambda: touch_files(_index_path(store))))
+    if retriever is not None and WARMUP_QUERIES:
+        steps.append(("queries", lambda: [retriever.invoke(question)
+                                          for question in (WARMUP_QUESTIONS * WARMUP_QUERIES)[:WARMUP_QUERIES]]))
+    return steps
+
+
+# ⏱️ Chronologie du démarrage : imports, construction des objets puis chauffe (en arrière-plan
+# par défaut) ; exposée par les routes de santé et la métrique llmops_startup_seconds.
+class StartupReport:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self._last = self.started
+        self.stages = {}
+        self.errors = {}
+        self.ready = threading.Event()
+        self._thread = None
+
+    def mark(self, stage):
+        """Record the time elapsed since the previous mark (sequential startup phases)."""
+        now = time.perf_counter()
+        self.stages[stage] = round(now - self._last, 4)
+        self._last = now
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = round(time.perf_counter() - started, 4)
+
+    def warm_up(self, steps, mode=STARTUP_MODE):
+        """Run ``[(name, func), ...]`` in a background thread, or inline when ``mode`` is "eager"."""
+        from metrics import registry
+        registry.gauge_function("llmops_startup_seconds",
+                                lambda: [({"stage": name}, seconds) for name, seconds in list(self.stages.items())])
+        if mode == "eager":
+            self._run(steps)
+        else:
+            self._thread = threading.Thread(target=self._run, args=(steps,), name="warm-up", daemon=True)
+            self._thread.start()
+        return self
+
+    def _run(self, steps):
+        for name, func in steps:
+            try:
+                with self.stage(name):
+                    func()
+            except Exception as e:
+                self.errors[name] = str(e)
+                print(f"❌ Chauffe « {name} » en échec : {e}")
+        self.stages["ready"] = round(time.perf_counter() - self.started, 4)
+        self.ready.set()
+        breakdown = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in self.stages.items())
+        print(f"⏱️ Démarrage : {breakdown}")
+
+    def wait(self, timeout=None):
+        return self.ready.wait(timeout)
+
+    def status(self):
+        ready = self.ready.is_set()
+        return {
+            "status": "ready" if ready and not self.errors else ("error" if self.errors else "starting"),
+            "uptime_seconds": round(time.perf_counter() - self.started, 3),
+            "stages": dict(self.stages),
+            "errors": dict(self.errors),
+        }
+
+    def is_ready(self):
+        return self.ready.is_set() and not self.errors
+
+
+startup = StartupReport()
@@ -0,0 +1,94 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from answer_cache import SemanticAnswerCache
+from fakes import FakeOpenAIEmbeddings
+from vectorstore_service import VectorStoreManager
+
+
+class KeywordEmbeddings:
+    """Deterministic embeddings: one dimension per known keyword."""
+
+    vocabulary = ["résidence", "b1", "documents", "durée", "naturalisation"]
+
+    def __init__(self):
+        self.calls = 0
+
+    def embed_query(self, text):
+        self.calls += 1
+        words = text.lower()
+        return [1.0 if word in words else 0.0 for word in self.vocabulary] + [0.1]
+
+
+class SemanticAnswerCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.embeddings = KeywordEmbeddings()
+        self.cache = SemanticAnswerCache(self.embeddings, threshold=0.95, ttl=60, max_entries=2)
+
+    def test_similar_query_hits(self):
+        """A reworded question with the same meaning returns the cached answer."""
+        answer, vector = self.cache.lookup("Quelle durée de résidence ?", "fr")
+        self.assertIsNone(answer)
+        self.cache.store("Quelle durée de résidence ?", "5 ans", "fr", vector)
+
+        answer, _ = self.cache.lookup("Durée de résidence exigée", "fr")
+        self.assertEqual(answer, "5 ans")
+        self.assertEqual(self.cache.stats()["hits"], 1)
+
+    def test_exact_query_skips_embedding(self):
+        """An identical question is served without calling the embeddings."""
+        self.cache.store("Niveau B1 ?", "Oui", "fr")
+        calls = self.embeddings.calls
+        answer, _ = self.cache.lookup("  niveau b1 ? ", "fr")
+        self.assertEqual(answer, "Oui")
+        self.assertEqual(self.embeddings.calls, calls)
+
+    def test_language_scope(self):
+        """Cached answers are never returned for another language."""
+        self.cache.store("documents", "Liste des documents", "fr")
+        answer, _ = self.cache.lookup("documents", "en")
+        self.assertIsNone(answer)
+
+    def test_lru_eviction(self):
+        """The least recently used entry is evicted past max_entries."""
+        self.cache.store("résidence", "a", "fr")
+        self.cache.store("b1", "b", "fr")
+        self.cache.lookup("résidence", "fr")
+        self.cache.store("documents", "c", "fr")
+        self.assertIsNone(self.cache.lookup("b1", "fr")[0])
+        self.assertEqual(self.cache.lookup("résidence", "fr")[0], "a")
+
+    def test_ttl_expiry(self):
+        """Entries older than the TTL are ignored."""
+        with patch("answer_cache.time.monotonic", return_value=0):
+            self.cache.store("naturalisation", "réponse", "fr")
+        with patch("answer_cache.time.monotonic", return_value=120):
+            self.assertIsNone(self.cache.lookup("naturalisation", "fr")[0])
+
+    def test_invalidate(self):
+        """Invalidation drops every cached answer."""
+        self.cache.store("b1", "Oui", "fr")
+        self.cache.invalidate()
+        self.assertIsNone(self.cache.lookup("b1", "fr")[0])
+        self.assertEqual(self.cache.stats()["size"], 0)
+
+    def test_memories_do_not_invalidate(self):
+        """Saving a conversation memory keeps the cache; adding a document clears it."""
+        manager = VectorStoreManager(os.path.join(tempfile.mkdtemp(), "vectorstore"),
+                                     FakeOpenAIEmbeddings(dim=16, latency=0), publish_path="")
+        self.addCleanup(manager.store.close)
+        self.cache.watch(manager)
+        self.cache.store("b1", "Oui", "fr")
+
+        manager.add_texts(["Q: b1 ? R: Oui"], metadatas=[{"source": "memory"}])
+        self.assertEqual(self.cache.lookup("b1", "fr")[0], "Oui")
+
+        manager.add_texts(["Niveau de français B1."], metadatas=[{"source": "preloaded", "file_name": "b1.pdf"}])
+        self.assertIsNone(self.cache.lookup("b1", "fr")[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,136 @@
+import json
+import os
+import tempfile
+import unittest
+from types import SimpleNamespace
+
+import httpx
+import openai
+
+from batch_qa import BatchAnswerer, read_questions
+from fakes import FakeOpenAIEmbeddings
+from model_router import ModelRouter
+from vectorstore_service import VectorStoreManager
+
+
+def rate_limit_error():
+    response = httpx.Response(429, headers={"retry-after": "0"},
+                              request=httpx.Request("POST", "https://api.openai.com/v1/chat/completions"))
+    return openai.RateLimitError("Rate limit reached", response=response, body=None)
+
+
+class FakeRouter:
+    """Answers with the first context passage; the listed questions are rate-limited once."""
+
+    def __init__(self, rate_limited=()):
+        self.rate_limited = set(rate_limited)
+        self.calls = []
+
+    def answer(self, question, docs=None):
+        self.calls.append(question)
+        if question in self.rate_limited:
+            self.rate_limited.discard(question)
+            raise rate_limit_error()
+        return docs[0].page_content if docs else "", {"tier": "fast", "winner": "fast"}
+
+
+class ThrottledLLM:
+    """Streaming model whose first ``failures`` calls hit the rate limit."""
+
+    def __init__(self, answer, failures=0):
+        self.answer = answer
+        self.failures = failures
+        self.calls = 0
+
+    def stream(self, messages):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise rate_limit_error()
+        for word in self.answer.split(" "):
+            yield SimpleNamespace(content=word + " ")
+
+
+class BatchAnswererTests(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.manager = VectorStoreManager(os.path.join(self.root, "vectorstore"),
+                                          FakeOpenAIEmbeddings(dim=16, latency=0), publish_path="")
+        self.addCleanup(self.manager.store.close)
+        self.manager.add_texts(["Résidence de cinq ans.", "Niveau de français B1.", "Dossier en préfecture."],
+                               metadatas=[{"source": "preloaded", "file_name": f"doc{i}.pdf"} for i in range(3)])
+        self.searches = []
+        search = self.manager.vector_search_ids_batch
+        self.manager.vector_search_ids_batch = lambda vectors, k=4: self.searches.append(len(vectors)) or search(vectors, k)
+
+    def answerer(self, router, **kwargs):
+        return BatchAnswerer(self.manager, router, packing=False, backoff=0, **kwargs)
+
+    def test_batch_is_searched_once_and_rate_limits_are_retried(self):
+        path = os.path.join(self.root, "questions.txt")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("Quel niveau de français ?\n\nCombien d'années de résidence ?\nOù déposer ?\n")
+        output = os.path.join(self.root, "answers.jsonl")
+
+        router = FakeRouter(rate_limited={"Où déposer ?"})
+        summary = self.answerer(router).run(read_questions(path), output)
+
+        self.assertEqual(self.searches, [3])
+        self.assertEqual((summary["answered"], summary["errors"]), (3, 0))
+        with open(output, encoding="utf-8") as f:
+            records = {record["id"]: record for record in map(json.loads, f)}
+        self.assertEqual(set(records), {"1", "3", "4"})
+        self.assertEqual(records["4"]["attempts"], 2)
+        self.assertTrue(records["1"]["sources"])
+        self.assertLessEqual(set(records["1"]["timings"]), {"embedding", "retrieval", "packing", "llm", "total"})
+
+    def test_rate_limited_embedding_is_retried(self):
+        """A 429 on the batch embedding waits behind the gate and retries instead of aborting the run."""
+        embed = self.manager.embeddings.embed_documents
+        calls = []
+
+        def throttled(texts):
+            calls.append(len(texts))
+            if len(calls) == 1:
+                raise rate_limit_error()
+            return embed(texts)
+
+        self.manager.embeddings.embed_documents = throttled
+        records = list(self.answerer(FakeRouter()).iter_answers([("1", "Quel niveau ?"), ("2", "Où déposer ?")]))
+
+        self.assertEqual(calls, [2, 2])
+        self.assertEqual(sorted((record["id"], record["error"]) for record in records), [("1", None), ("2", None)])
+
+    def test_resume_skips_answered_questions(self):
+        """Answered ids are skipped, failed ones retried, a truncated last line is tolerated."""
+        output = os.path.join(self.root, "answers.jsonl")
+        with open(output, "w", encoding="utf-8") as f:
+            f.write(json.dumps({"id": "a", "answer": "ok", "error": None}) + "\n")
+            f.write(json.dumps({"id": "b", "answer": None, "error": "RateLimitError"}) + "\n")
+            f.write('{"id": "c", "answ')
+        items = [("a", "Quel niveau ?"), ("b", "Où déposer ?"), ("c", "Combien d'années ?")]
+
+        router = FakeRouter()
+        summary = self.answerer(router, max_retries=0, batch_size=1).run(items, output)
+
+        self.assertEqual(sorted(router.calls), ["Combien d'années ?", "Où déposer ?"])
+        self.assertEqual((summary["skipped"], summary["answered"]), (1, 2))
+        self.assertEqual(self.searches, [1, 1])
+        with open(output, encoding="utf-8") as f:
+            lines = f.read().splitlines()
+        self.assertEqual([json.loads(line)["id"] for line in lines[3:]], ["b", "c"])
+
+    def test_rate_limited_fast_tier_backs_off_instead_of_escalating(self):
+        fast = ThrottledLLM("Il faut résider en France depuis au moins cinq ans avant la demande.", failures=1)
+        strong = ThrottledLLM("Réponse du modèle fort.")
+        router = ModelRouter(None, fast, strong, budget=5, min_confidence=0)
+
+        [record] = self.answerer(router).iter_answers([("1", "Combien d'années de résidence ?")])
+
+        self.assertEqual((record["error"], record["attempts"], record["winner"]), (None, 2, "fast"))
+        self.assertEqual((fast.calls, strong.calls), (2, 0))
+        self.assertFalse(router.raise_rate_limits)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+import unittest
+import zlib
+
+import numpy as np
+from langchain_core.documents import Document
+
+from context_packing import ContextPacker, overlap_length, strip_prefix
+
+
+class BagOfWordsEmbeddings:
+    """Texts sharing most of their words get close vectors."""
+
+    def embed_documents(self, texts):
+        return [self.embed_query(text) for text in texts]
+
+    def embed_query(self, text):
+        vector = np.zeros(64, dtype="float32")
+        for word in strip_prefix(text).lower().split():
+            vector[zlib.crc32(word.encode("utf-8")) % 64] += 1
+        return vector.tolist()
+
+
+def upload(text, name="guide.pdf"):
+    return Document(page_content=f"[2025-01-01 10:00:00] (Doc: {name}) {text}", metadata={"file_name": name})
+
+
+class ContextPackingTests(unittest.TestCase):
+
+    def test_prefix_and_overlap(self):
+        self.assertEqual(strip_prefix("[2025-01-01 10:00:00] (Doc: a.pdf) texte"), "texte")
+        self.assertEqual(strip_prefix("[2025-01-01 10:00:00] A le niveau B1"), "A le niveau B1")
+        previous = "La demande se fait en ligne sur le site de l'administration."
+        following = "sur le site de l'administration. Un récépissé est délivré."
+        self.assertEqual(overlap_length(previous, following), len("sur le site de l'administration."))
+        self.assertEqual(overlap_length("aucun rapport", "entre ces deux textes"), 0)
+
+    def test_near_duplicates_are_dropped(self):
+        """The same fact learned twice is only sent once."""
+        docs = [
+            Document(page_content="[2025-01-01 10:00:00] Réside en France depuis cinq ans", metadata={}),
+            Document(page_content="[2025-02-01 10:00:00] Réside en France depuis cinq ans", metadata={}),
+            Document(page_content="[2025-02-01 10:00:00] Possède un diplôme de niveau B1", metadata={}),
+        ]
+        packed, report = ContextPacker(BagOfWordsEmbeddings()).pack("résidence en France", docs)
+        self.assertEqual(report["duplicates"], 1)
+        self.assertEqual(len(packed), 2)
+
+    def test_overlap_is_trimmed_and_budget_respected(self):
+        """Neighbouring chunks lose their shared text and the budget caps the context."""
+        shared = " ".join(["recouvrement"] * 10)
+        docs = [upload(f"début du premier morceau {shared}"), upload(f"{shared} suite du second morceau")]
+        packed, report = ContextPacker(BagOfWordsEmbeddings(), dup_threshold=1.1).pack("morceau", docs)
+        self.assertEqual(sum(doc.page_content.count("recouvrement") for doc in packed), 10)
+        self.assertGreater(report["tokens_saved"], 0)
+
+        long_docs = [upload(f"passage {i} " + "mot " * 200, name=f"{i}.pdf") for i in range(5)]
+        packed, report = ContextPacker(BagOfWordsEmbeddings(), token_budget=450, dup_threshold=1.1).pack("passage", long_docs)
+        self.assertLessEqual(report["tokens"], 450)
+        self.assertEqual(report["passages"], len(packed))
+        self.assertLess(len(packed), 5)
+
+    def test_stored_vectors_are_reused_and_sources_kept(self):
+        """Candidates from the store are not re-embedded; the file name stays in the passage."""
+        embeddings = BagOfWordsEmbeddings()
+        docs = [upload("Résidence de cinq ans en France."), upload("Niveau de français B1.", name="b1.pdf")]
+        for i, doc in enumerate(docs):
+            doc.id = f"id{i}"
+
+        class Store:
+            def get_vectors(self, ids):
+                return {doc.id: embeddings.embed_query(doc.page_content) for doc in docs if doc.id in ids}
+
+        class NoDocumentEmbeddings(BagOfWordsEmbeddings):
+            def embed_documents(self, texts):
+                raise AssertionError("appel d'embeddings inattendu")
+
+        packed, _ = ContextPacker(NoDocumentEmbeddings(), store=Store()).pack("résidence", docs)
+        self.assertEqual({doc.page_content for doc in packed},
+                         {"(Doc: guide.pdf) Résidence de cinq ans en France.", "(Doc: b1.pdf) Niveau de français B1."})
+
+
+if __name__ == '__main__':
+    unittest.main()
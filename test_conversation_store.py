@@ -0,0 +1,87 @@
+import os
+import tempfile
+import unittest
+
+from conversation_store import ConversationStore, SharedConversationStore
+
+
+class ConversationStoreTests(unittest.TestCase):
+
+    def create_store(self, **kwargs):
+        return ConversationStore(**kwargs)
+
+    def test_sessions_are_isolated(self):
+        """Each session has its own history and reset only affects it."""
+        store = self.create_store()
+        store.add_turn("a", "q1", "r1")
+        store.add_turn("b", "q2", "r2")
+        store.reset("a")
+        self.assertEqual(store.turns("a"), [])
+        self.assertEqual([turn["question"] for turn in store.turns("b")], ["q2"])
+
+    def test_ring_buffer_is_bounded(self):
+        """Only the last max_turns turns are kept."""
+        store = self.create_store(max_turns=3)
+        for i in range(10):
+            store.add_turn("s", f"q{i}", f"r{i}")
+        self.assertEqual([turn["question"] for turn in store.turns("s")], ["q7", "q8", "q9"])
+
+    def test_page_is_newest_first(self):
+        """History pages start with the most recent turn."""
+        store = self.create_store()
+        for i in range(5):
+            store.add_turn("s", f"q{i}", f"r{i}")
+        page = store.page("s", offset=1, limit=2)
+        self.assertEqual([turn["question"] for turn in page["turns"]], ["q3", "q2"])
+        self.assertEqual(page["total"], 5)
+
+    def test_max_sessions_evicts_least_recent(self):
+        """The least recently active session is dropped past max_sessions."""
+        store = self.create_store(max_sessions=2)
+        store.add_turn("a", "q", "r")
+        store.add_turn("b", "q", "r")
+        store.add_turn("a", "q", "r")
+        store.add_turn("c", "q", "r")
+        self.assertEqual(len(store), 2)
+        self.assertEqual(store.turns("b"), [])
+
+    def test_old_turns_are_summarized_over_budget(self):
+        """Turns beyond the token budget are folded into the summary."""
+        folded = []
+
+        def summarizer(summary, turns):
+            folded.extend(turn["question"] for turn in turns)
+            return "résumé"
+
+        store = self.create_store(max_turns=10, token_budget=30, summarizer=summarizer)
+        for i in range(4):
+            store.add_turn("s", f"question {i} " * 5, "réponse " * 5)
+        self.assertTrue(folded)
+        messages = store.messages("s", system_prompt="système")
+        self.assertEqual(messages[1]["content"], "Résumé de la conversation précédente : résumé")
+
+
+class SharedConversationStoreTests(ConversationStoreTests):
+    """Same behaviour as the in-memory store, backed by SQLite."""
+
+    def setUp(self):
+        self.path = os.path.join(tempfile.mkdtemp(), "history.sqlite")
+
+    def create_store(self, **kwargs):
+        store = SharedConversationStore(self.path, **kwargs)
+        self.addCleanup(store.close)
+        return store
+
+    def test_workers_share_the_history(self):
+        """A turn added by one worker (process) is paged by another one."""
+        first, second = self.create_store(), self.create_store()
+        first.add_turn("s", "q1", "r1")
+        second.add_turn("s", "q2", "r2")
+        page = first.page("s")
+        self.assertEqual([turn["question"] for turn in page["turns"]], ["q2", "q1"])
+        second.reset("s")
+        self.assertEqual(first.turns("s"), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
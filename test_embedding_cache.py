@@ -0,0 +1,56 @@
+import os
+import tempfile
+import unittest
+
+from embedding_cache import CachedEmbeddings
+
+
+class CountingEmbeddings:
+    """Fake remote embeddings recording every batch it receives."""
+
+    model = "fake-model"
+
+    def __init__(self):
+        self.batches = []
+
+    def embed_documents(self, texts):
+        self.batches.append(list(texts))
+        return [[float(len(text)), 1.0] for text in texts]
+
+
+class CachedEmbeddingsTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "cache.sqlite")
+        self.underlying = CountingEmbeddings()
+        self.embeddings = CachedEmbeddings(self.underlying, path=self.path, batch_size=2)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_misses_are_deduplicated_and_batched(self):
+        """Only unique unseen texts are sent, in batches of batch_size."""
+        vectors = self.embeddings.embed_documents(["a", "bb", "a", "ccc"])
+        self.assertEqual(self.underlying.batches, [["a", "bb"], ["ccc"]])
+        self.assertEqual(vectors[0], vectors[2])
+
+    def test_hits_skip_remote_call(self):
+        """Texts already embedded are served from the on-disk store."""
+        first = self.embeddings.embed_documents(["bonjour", "merci"])
+        reopened = CachedEmbeddings(self.underlying, path=self.path)
+        self.underlying.batches.clear()
+        self.assertEqual(reopened.embed_documents(["merci", "bonjour"]), first[::-1])
+        self.assertEqual(reopened.embed_query("bonjour"), first[0])
+        self.assertEqual(self.underlying.batches, [])
+
+    def test_model_name_is_part_of_key(self):
+        """The same text embedded with another model is a miss."""
+        self.embeddings.embed_query("bonjour")
+        other = CachedEmbeddings(self.underlying, model_name="other-model", path=self.path)
+        other.embed_query("bonjour")
+        self.assertEqual(len(self.underlying.batches), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
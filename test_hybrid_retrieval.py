@@ -0,0 +1,83 @@
+import os
+import tempfile
+import threading
+import unittest
+from unittest.mock import patch
+
+from fakes import FakeOpenAIEmbeddings
+from hybrid_retrieval import BM25Index, reciprocal_rank_fusion, tokenize
+from vectorstore_service import VectorStoreManager
+
+
+class HybridRetrievalTests(unittest.TestCase):
+
+    def test_tokenize_keeps_legal_identifiers(self):
+        """Compound identifiers are indexed whole and by parts, accents are folded."""
+        tokens = tokenize("Décret 93-1362, article 21-17")
+        self.assertIn("93-1362", tokens)
+        self.assertIn("21-17", tokens)
+        self.assertIn("1362", tokens)
+        self.assertIn("decret", tokens)
+
+    def test_bm25_ranks_exact_identifier_first(self):
+        """The document quoting the identifier outranks generic ones."""
+        index = BM25Index()
+        index.add("a", "La naturalisation exige une résidence de cinq ans.")
+        index.add("b", "Le formulaire cerfa 12753 doit être joint au dossier de naturalisation.")
+        index.add("c", "Le dossier de naturalisation est déposé en préfecture.")
+        results = index.search("cerfa 12753", k=2)
+        self.assertEqual(results[0][0], "b")
+        self.assertEqual(len(results), 1)
+
+    def test_bm25_is_incremental(self):
+        """Documents added later are searchable and duplicates are ignored."""
+        index = BM25Index()
+        index.add("a", "article 21-17")
+        index.add("a", "article 21-17")
+        index.add("b", "article 21-24")
+        self.assertEqual(len(index), 2)
+        self.assertEqual(index.search("21-24")[0][0], "b")
+
+    def test_snapshot_is_scored_while_documents_are_added(self):
+        """A snapshot is not affected by documents added before it is scored."""
+        index = BM25Index()
+        index.add("a", "article 21-17")
+        snapshot = index.snapshot(set(tokenize("article")))
+        index.add("b", "article 21-24")
+        self.assertEqual([doc_id for doc_id, _ in index.score(snapshot)], ["a"])
+
+    def test_manager_scores_outside_its_lock(self):
+        """BM25 scoring does not hold the manager lock that FAISS searches and adds need."""
+        manager = VectorStoreManager(os.path.join(tempfile.mkdtemp(), "vectorstore"),
+                                     FakeOpenAIEmbeddings(dim=16, latency=0), publish_path="")
+        self.addCleanup(manager.store.close)
+        manager.add_texts(["Le formulaire cerfa 12753.", "Dépôt en préfecture."])
+        held = []
+        score = BM25Index.score
+
+        def write_once():
+            with manager._lock.write():
+                pass
+
+        def check_lock(index, snapshot, k):
+            # Un ajout (verrou exclusif) doit pouvoir passer pendant le calcul des scores
+            writer = threading.Thread(target=write_once, daemon=True)
+            writer.start()
+            writer.join(timeout=2)
+            held.append(writer.is_alive())
+            return score(index, snapshot, k)
+
+        with patch.object(BM25Index, "score", check_lock):
+            results = manager.lexical_search("cerfa 12753", k=2)
+        self.assertEqual(len(results), 1)
+        self.assertEqual(held, [False])
+
+    def test_reciprocal_rank_fusion(self):
+        """Ids ranked well in both lists come first."""
+        fused = reciprocal_rank_fusion([["x", "y", "z"], ["y", "w"]])
+        self.assertEqual(fused[0], "y")
+        self.assertEqual(set(fused), {"x", "y", "z", "w"})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from fakes import FakeOpenAIEmbeddings
+from index_backends import INDEX_TYPES, build_index, index_type_of, rebuild_vectorstore
+from segment_store import SegmentStore
+from vectorstore_service import VectorStoreManager
+
+
+class IndexBackendsTests(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmpdir = tempfile.TemporaryDirectory()
+        cls.root = cls.tmpdir.name
+        # Dimension 64 : INDEX_PQ_M (64 par défaut) doit la diviser ; 300 vecteurs pour entraîner le PQ
+        cls.embeddings = FakeOpenAIEmbeddings(dim=64, latency=0)
+        cls.source = os.path.join(cls.root, "flat")
+        manager = VectorStoreManager(cls.source, cls.embeddings, publish_path="")
+        manager.add_texts([f"Article {i} du code civil sur la naturalisation." for i in range(300)],
+                          metadatas=[{"source": "preloaded", "file_name": f"doc{i}.pdf"} for i in range(300)])
+        manager.flush()
+        manager.store.close()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmpdir.cleanup()
+
+    def test_each_index_type_is_rebuilt_reopened_and_evaluated(self):
+        """Every backend gives a reopenable store of the same documents and a recall report."""
+        for index_type in INDEX_TYPES:
+            with self.subTest(index_type=index_type):
+                destination = os.path.join(self.root, index_type)
+                report = rebuild_vectorstore(self.source, destination, index_type, eval_queries=20, nlist=4)
+
+                self.assertEqual((report["index_type"], report["vectors"], report["dim"]), (index_type, 300, 64))
+                self.assertEqual(report["exact"]["recall@4"], 1.0)
+                self.assertGreater(report["approximate"]["recall@4"], 0)
+                self.assertLessEqual(report["approximate"]["recall@4"], 1.0)
+
+                store = SegmentStore(destination)
+                self.addCleanup(store.close)
+                db = store.open(self.embeddings)
+                self.assertEqual((index_type_of(db.index), db.index.ntotal), (index_type, 300))
+                docs = db.similarity_search("Article 7 du code civil sur la naturalisation.", k=4)
+                self.assertEqual(len(docs), 4)
+                self.assertTrue(all(doc.metadata["file_name"].startswith("doc") for doc in docs))
+
+    def test_unknown_type_and_invalid_pq_are_rejected(self):
+        """Unknown index types and a PQ split that does not divide the dimension raise ValueError."""
+        vectors = np.random.default_rng(0).normal(size=(50, 48)).astype("float32")
+        with self.assertRaises(ValueError):
+            build_index(vectors, "lsh")
+        with self.assertRaises(ValueError):
+            build_index(vectors, "ivfpq", nlist=2, pq_m=64)
+
+
+if __name__ == '__main__':
+    unittest.main()
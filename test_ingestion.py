@@ -0,0 +1,80 @@
+import os
+import tempfile
+import unittest
+
+from fakes import FakeOpenAIEmbeddings, write_synthetic_pdf
+from ingestion import IngestionEngine
+from session_index import SessionIndexStore
+from vectorstore_service import VectorStoreManager
+
+
+class FlakyEmbeddings(FakeOpenAIEmbeddings):
+    """Fails the next ``failures`` embedding calls."""
+
+    failures = 0
+
+    def embed_documents(self, texts):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("embeddings indisponibles")
+        return super().embed_documents(texts)
+
+
+class IngestionEngineTests(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.root = tempfile.mkdtemp()
+        cls.files = {}
+        for name, pages in [("guide", ["Residence de cinq ans en France.", "Niveau B1 en francais."]),
+                            ("autre", ["Depot du dossier en prefecture."])]:
+            cls.files[name] = os.path.join(cls.root, f"{name}.pdf")
+            write_synthetic_pdf(cls.files[name], pages)
+
+    def setUp(self):
+        self.embeddings = FlakyEmbeddings(dim=16, latency=0)
+        self.manager = VectorStoreManager(tempfile.mkdtemp(dir=self.root), self.embeddings, flush_delay=60,
+                                          publish_path="")
+        self.addCleanup(self.manager.store.close)
+        self.engine = IngestionEngine(self.manager, processes=1)
+        self.addCleanup(self.engine.shutdown)
+
+    def test_known_chunks_are_not_embedded_twice(self):
+        [first] = self.engine.ingest_files([(self.files["guide"], "guide.pdf")])
+        self.assertEqual((first["added"], first["duplicates"], first["error"]), (first["chunks"], 0, None))
+        calls = self.embeddings.calls
+
+        [second] = self.engine.ingest_files([(self.files["guide"], "guide.pdf")])
+        self.assertEqual((second["added"], second["duplicates"]), (0, second["chunks"]))
+        self.assertEqual(self.embeddings.calls, calls)
+
+    def test_failed_batch_can_be_ingested_again(self):
+        """Chunks of a failed embedding batch are not reported as duplicates afterwards."""
+        self.embeddings.failures = 1
+        [failed] = self.engine.ingest_files([(self.files["guide"], "guide.pdf")])
+        self.assertEqual((failed["added"], failed["error"]), (0, "embeddings indisponibles"))
+        self.assertFalse(self.manager.exists())
+
+        [retried] = self.engine.ingest_files([(self.files["guide"], "guide.pdf")])
+        self.assertEqual((retried["added"], retried["duplicates"], retried["error"]), (retried["chunks"], 0, None))
+
+    def test_files_with_the_same_name_get_their_own_report(self):
+        reports = self.engine.ingest_files([(self.files["guide"], "scan.pdf"), (self.files["autre"], "scan.pdf")])
+        self.assertEqual(len(reports), 2)
+        self.assertEqual([report["added"] for report in reports], [1, 1])
+        self.assertEqual(self.manager.size(), 2)
+
+    def test_session_upload_embeds_a_shared_chunk_once(self):
+        """Two files of one session upload that share a chunk only add it once to the session index."""
+        sessions = SessionIndexStore(self.embeddings, ttl=60, max_chunks=10)
+        # Embeddings lents : le second fichier est découpé avant que le premier n'arrive dans la session
+        self.embeddings.latency = 0.5
+        reports = self.engine.ingest_files([(self.files["autre"], "a.pdf"), (self.files["autre"], "b.pdf")],
+                                           target=sessions.target("s1"))
+        self.assertEqual(sorted((report["added"], report["duplicates"]) for report in reports), [(0, 1), (1, 0)])
+        self.assertEqual(len(sessions.get("s1")), 1)
+        self.assertFalse(self.manager.exists())
+
+
+if __name__ == '__main__':
+    unittest.main()
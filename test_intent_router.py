@@ -0,0 +1,67 @@
+import json
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from intent_router import IntentRouter
+
+
+class KeywordEmbeddings:
+    """One dimension per keyword, so similar questions share a direction."""
+
+    vocabulary = ["résidence", "residence", "b1", "documents"]
+
+    def embed_query(self, text):
+        words = text.lower()
+        return [1.0 if word in words else 0.0 for word in self.vocabulary] + [0.05]
+
+
+class IntentRouterTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        embeddings = KeywordEmbeddings()
+        entries = [
+            {"lang": "fr", "question": "Durée de résidence ?", "answer": "5 ans", "approved": True},
+            {"lang": "en", "question": "Residence duration?", "answer": "5 years", "approved": True},
+            {"lang": "fr", "question": "Documents ?", "answer": "Liste", "approved": False},
+        ]
+        vectors = np.asarray([embeddings.embed_query(entry["question"]) for entry in entries], dtype="float32")
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        with open(os.path.join(self.tmpdir.name, "faq.json"), "w", encoding="utf-8") as f:
+            json.dump(entries, f)
+        np.save(os.path.join(self.tmpdir.name, "vectors.npy"), vectors)
+        self.router = IntentRouter(embeddings, path=self.tmpdir.name, threshold=0.95)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_commands_are_table_lookups(self):
+        """Commands are recognised regardless of case and spacing."""
+        self.assertEqual(self.router.command("  Dépôt "), "depot")
+        self.assertEqual(self.router.command("/upload"), "upload")
+        self.assertIsNone(self.router.command("guide moi"))
+
+    def test_faq_match_returns_answer_in_entry_language(self):
+        """A confident match returns the vetted answer of the matching language."""
+        entry, score = self.router.match_faq("What is the residence duration required?", "en")
+        self.assertEqual(entry["answer"], "5 years")
+        self.assertGreaterEqual(score, 0.95)
+
+    def test_faq_match_is_restricted_to_the_question_language(self):
+        """French questions get French answers; a language without entries falls back to French."""
+        self.assertEqual(self.router.match_faq("Durée de résidence ?", "fr")[0]["answer"], "5 ans")
+        self.assertIsNone(self.router.match_faq("Durée de résidence ?", "en")[0])
+        self.assertEqual(self.router.match_faq("Residenzdauer (résidence) ?", "de")[0]["answer"], "5 ans")
+
+    def test_unapproved_entries_and_low_scores_are_ignored(self):
+        """Disabled entries never match and unrelated questions fall through."""
+        self.assertIsNone(self.router.match_faq("Quels documents ?")[0])
+        self.assertIsNone(self.router.match_faq("Niveau B1 ?")[0])
+        self.assertEqual(self.router.stats()["faq_entries"], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+import os
+import tempfile
+import unittest
+from datetime import datetime
+
+import numpy as np
+from langchain_core.documents import Document
+
+from fakes import FakeOpenAIEmbeddings
+from index_backends import rebuild_vectorstore
+from memory_compaction import MemoryCompactor
+from memory_index import memory_metadata
+from vectorstore_service import VectorStoreManager
+
+
+def memory(fact, timestamp):
+    return Document(page_content=f"[{timestamp}] {fact}", metadata=memory_metadata(timestamp))
+
+
+class MemoryCompactionTests(unittest.TestCase):
+
+    def test_plan_merges_expires_and_caps_memories_only(self):
+        """Near-duplicates collapse into one counted entry, preloaded documents are left alone."""
+        base = np.eye(8, dtype="float32")
+        close = base[1] + 0.01 * base[2]
+        vectors = np.vstack([base[0], base[1], close, base[1], base[3], base[4]])
+        entries = [
+            ("doc", Document(page_content="Article 21-17 du code civil.", metadata={"source": "preloaded"})),
+            ("m1", memory("Réside en France depuis 5 ans", "2025-01-01 10:00:00")),
+            ("m2", memory("Vit en France depuis cinq ans", "2025-03-01 10:00:00")),
+            ("m3", memory("Réside en France depuis 5 ans", "2025-02-01 10:00:00")),
+            ("old", memory("A déposé son dossier", "2023-01-01 10:00:00")),
+            ("m4", memory("A le niveau B1", "2025-01-15 10:00:00")),
+        ]
+        compactor = MemoryCompactor(manager=None, ttl_days=365, max_entries=10)
+        kept, merged, report = compactor.plan(vectors, entries, now=datetime(2025, 6, 1))
+
+        self.assertEqual(kept, [0, 2, 5])
+        self.assertEqual(report, {"memories": 5, "merged": 2, "expired": 1, "capped": 0})
+        self.assertEqual(merged[2].page_content, "[2025-03-01 10:00:00] Vit en France depuis cinq ans")
+        self.assertEqual(merged[2].metadata["count"], 3)
+        self.assertEqual(merged[2].metadata["first_seen"], "2025-01-01 10:00:00")
+
+        compactor.max_entries = 1
+        kept, _, report = compactor.plan(vectors, entries, now=datetime(2025, 6, 1))
+        self.assertEqual((kept, report["capped"]), ([0, 2], 1))
+
+    def test_compact_rewrites_the_store(self):
+        with tempfile.TemporaryDirectory() as root:
+            embeddings = FakeOpenAIEmbeddings(dim=16, latency=0)
+            manager = VectorStoreManager(os.path.join(root, "vectorstore"), embeddings, flush_delay=60,
+                                         publish_path="")
+            self.addCleanup(manager.store.close)
+            manager.add_texts(["Article 21-17 du code civil."], metadatas=[{"source": "preloaded"}])
+            now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            for _ in range(3):
+                # Même fait appris trois fois : vecteurs identiques
+                manager.add_texts([f"[{now}] Réside en France depuis 5 ans"], metadatas=[memory_metadata(now)])
+
+            report = MemoryCompactor(manager).compact()
+            self.assertEqual((report["vectors_before"], report["vectors_after"], report["merged"]), (4, 2, 2))
+            self.assertGreater(report["bytes_before"], 0)
+            docs = manager.documents()
+            self.assertEqual(docs[0].metadata, {"source": "preloaded"})
+            self.assertEqual(docs[1].metadata["count"], 3)
+            self.assertEqual(manager.recent_documents(5, source="memory"), [docs[1]])
+
+    def test_lossy_index_is_not_compacted(self):
+        """Reconstructed IVF-PQ vectors are approximate: the store is left untouched."""
+        with tempfile.TemporaryDirectory() as root:
+            embeddings = FakeOpenAIEmbeddings(dim=64, latency=0)
+            source = VectorStoreManager(os.path.join(root, "flat"), embeddings, publish_path="")
+            self.addCleanup(source.store.close)
+            now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            source.add_texts([f"[{now}] Fait numéro {i}" for i in range(300)],
+                             metadatas=[memory_metadata(now)] * 300)
+            source.flush()
+            rebuild_vectorstore(source.path, os.path.join(root, "ivfpq"), "ivfpq", eval_queries=0, nlist=4)
+            manager = VectorStoreManager(os.path.join(root, "ivfpq"), embeddings, publish_path="")
+            self.addCleanup(manager.store.close)
+            generation = manager.disk_stamp()
+
+            self.assertEqual(MemoryCompactor(manager).compact(), {"skipped": "lossy_index"})
+            self.assertEqual(manager.disk_stamp(), generation)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,42 @@
+import unittest
+from types import SimpleNamespace
+
+from memory_index import MetadataIndex, infer_metadata
+
+
+def doc(content, metadata=None):
+    return SimpleNamespace(page_content=content, metadata=metadata or {})
+
+
+class MetadataIndexTests(unittest.TestCase):
+
+    def setUp(self):
+        self.index = MetadataIndex()
+        self.index.add("p1", {"source": "preloaded", "timestamp": ""})
+        self.index.add("m1", {"source": "memory", "timestamp": "2025-01-01 10:00:00"})
+        self.index.add("u1", {"source": "upload", "file_name": "a.pdf", "timestamp": "2025-01-02 10:00:00"})
+        self.index.add("m2", {"source": "memory", "timestamp": "2025-01-03 10:00:00"})
+        self.index.add("u2", {"source": "upload", "file_name": "b.pdf", "timestamp": "2025-01-04 10:00:00"})
+
+    def test_newest_across_sources(self):
+        """Entries from several sources are merged newest first."""
+        self.assertEqual(self.index.newest(3, source=("memory", "upload")), ["u2", "m2", "u1"])
+
+    def test_pagination_and_filters(self):
+        """Offset pages through results, source and file narrow them."""
+        self.assertEqual(self.index.newest(2, offset=1, source=("memory", "upload")), ["m2", "u1"])
+        self.assertEqual(self.index.newest(10, source="memory"), ["m2", "m1"])
+        self.assertEqual(self.index.newest(10, file_name="a.pdf"), ["u1"])
+        self.assertEqual(self.index.count(source="upload"), 2)
+
+    def test_infer_metadata_from_legacy_prefix(self):
+        """Entries without metadata are classified from their text prefix."""
+        self.assertEqual(infer_metadata(doc("[2025-01-01 10:00:00] Vit en France"))["source"], "memory")
+        upload = infer_metadata(doc("[2025-01-01 10:00:00] (Doc: titre.pdf) Texte"))
+        self.assertEqual((upload["source"], upload["file_name"]), ("upload", "titre.pdf"))
+        self.assertEqual(infer_metadata(doc("Texte officiel"))["source"], "preloaded")
+        self.assertEqual(infer_metadata(doc("x", {"source": "memory", "timestamp": "t"}))["timestamp"], "t")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import unittest
+from types import SimpleNamespace
+
+from memory_learning import MemoryLearner, parse_batch_analysis
+
+
+class FakeLLM:
+    """Answers every batch with a fixed JSON payload."""
+
+    def __init__(self, content):
+        self.content = content
+        self.prompts = []
+
+    def invoke(self, prompt):
+        self.prompts.append(prompt)
+        return SimpleNamespace(content=self.content)
+
+
+class FakeVectorStore:
+
+    def __init__(self):
+        self.writes = []
+
+    def add_texts(self, texts, metadatas=None):
+        self.writes.append(list(texts))
+        self.metadatas = metadatas
+
+
+class MemoryLearnerTests(unittest.TestCase):
+
+    def test_parse_batch_analysis(self):
+        """Facts are mapped back to their message, NON and garbage are dropped."""
+        text = 'Voici : [{"id": 2, "fact": "Réside en France depuis 5 ans"}, {"id": 1, "fact": "NON"}, {"id": 9}]'
+        self.assertEqual(parse_batch_analysis(text, 3), [None, "Réside en France depuis 5 ans", None])
+        self.assertEqual(parse_batch_analysis("pas de JSON", 2), [None, None])
+
+    def test_batch_is_classified_in_one_call_and_written_once(self):
+        """A whole batch costs one LLM call and one vectorstore write."""
+        llm = FakeLLM('[{"id": 1, "fact": "A le B1"}, {"id": 2, "fact": "NON"}, {"id": 3, "fact": "Marié"}]')
+        store = FakeVectorStore()
+        learner = MemoryLearner(store, llm)
+        facts = learner.process_batch([(0.0, "j'ai le B1"), (0.0, "bonjour"), (0.0, "je suis marié")])
+
+        self.assertEqual(facts, ["A le B1", "Marié"])
+        self.assertEqual(len(llm.prompts), 1)
+        self.assertEqual(len(store.writes), 1)
+        self.assertEqual([metadata["source"] for metadata in store.metadatas], ["memory", "memory"])
+        self.assertEqual(learner.stats()["learned"], 2)
+
+    def test_full_queue_drops_messages(self):
+        """Submissions beyond the queue bound are rejected instead of blocking."""
+        learner = MemoryLearner(FakeVectorStore(), FakeLLM("[]"), max_queue=1)
+        learner._ensure_started = lambda: None
+        self.assertTrue(learner.submit("premier"))
+        self.assertFalse(learner.submit("second"))
+        self.assertEqual(learner.stats()["dropped"], 1)
+        self.assertEqual(learner.stats()["queue_depth"], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
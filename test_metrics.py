@@ -0,0 +1,102 @@
+import asyncio
+import os
+import tempfile
+import threading
+import time
+import unittest
+import uuid
+
+from langchain_core.outputs import LLMResult
+
+from metrics import LLMMetricsHandler, MetricsRegistry, SlowRequestProfiler, profiled, registry, span
+
+
+class MetricsTests(unittest.TestCase):
+
+    def test_render_prometheus_text(self):
+        """Counters, gauges and histograms are rendered in the exposition format."""
+        metrics = MetricsRegistry()
+        metrics.inc("requests_total", model="gpt-4")
+        metrics.inc("requests_total", 2, model="gpt-4")
+        metrics.gauge_function("documents", lambda: [({"path": "vs"}, 42)])
+        metrics.observe("latency_seconds", 0.02, stage="retrieval")
+        text = metrics.render()
+
+        self.assertIn('requests_total{model="gpt-4"} 3', text)
+        self.assertIn('documents{path="vs"} 42', text)
+        self.assertIn('latency_seconds_bucket{stage="retrieval",le="0.01"} 0', text)
+        self.assertIn('latency_seconds_bucket{stage="retrieval",le="0.025"} 1', text)
+        self.assertIn('latency_seconds_count{stage="retrieval"} 1', text)
+
+    def test_llm_handler_counts_tokens(self):
+        """Token usage reported by the model is counted per model and kind."""
+        handler = LLMMetricsHandler()
+        run_id = uuid.uuid4()
+        handler.on_llm_start({}, ["question"], run_id=run_id)
+        handler.on_llm_end(LLMResult(generations=[], llm_output={
+            "model_name": "test-model", "token_usage": {"prompt_tokens": 12, "completion_tokens": 5},
+        }), run_id=run_id)
+        text = registry.render()
+        self.assertIn('llmops_tokens_total{kind="prompt",model="test-model"} 12', text)
+        self.assertIn('llmops_tokens_total{kind="completion",model="test-model"} 5', text)
+        self.assertIn('llmops_stage_seconds_count{model="test-model",stage="llm"} 1', text)
+
+    def test_span_records_duration(self):
+        with span("test_stage"):
+            pass
+        self.assertIn('llmops_stage_seconds_count{stage="test_stage"} 1', registry.render())
+
+    def test_slow_request_writes_folded_stacks(self):
+        """Only requests above the threshold leave a flame graph file."""
+        with tempfile.TemporaryDirectory() as directory:
+            with SlowRequestProfiler("fast", threshold_ms=10_000, interval=0.001, directory=directory):
+                time.sleep(0.02)
+            self.assertEqual(os.listdir(directory), [])
+
+            with SlowRequestProfiler("slow", threshold_ms=1, interval=0.001, directory=directory):
+                time.sleep(0.05)
+            files = os.listdir(directory)
+            self.assertEqual(len(files), 1)
+            with open(os.path.join(directory, files[0]), encoding="utf-8") as f:
+                line = f.readline()
+            self.assertRegex(line, r";.* \d+$")
+
+    def test_profiler_samples_only_the_request_thread(self):
+        """Stacks of other busy threads are not mixed into the request's profile."""
+        stop = threading.Event()
+
+        def other_request():
+            while not stop.is_set():
+                time.sleep(0.001)
+
+        other = threading.Thread(target=other_request, name="other-request")
+        other.start()
+        self.addCleanup(other.join)
+        self.addCleanup(stop.set)
+        with tempfile.TemporaryDirectory() as directory:
+            with SlowRequestProfiler("slow", threshold_ms=1, interval=0.001, directory=directory) as profiler:
+                time.sleep(0.05)
+        self.assertTrue(profiler.samples)
+        roots = {stack.split(";")[0] for stack in profiler.samples}
+        self.assertEqual(roots, {threading.current_thread().name})
+        self.assertFalse(any("other_request" in stack for stack in profiler.samples))
+
+
+    def test_profiler_samples_the_request_worker_threads(self):
+        """Work handed to a thread by the request (asyncio.to_thread, executors) is in its profile."""
+        def blocking_work():
+            time.sleep(0.05)
+
+        async def request():
+            with SlowRequestProfiler("async", threshold_ms=1, interval=0.001, directory=directory) as profiler:
+                await asyncio.to_thread(profiled(blocking_work))
+            return profiler
+
+        with tempfile.TemporaryDirectory() as directory:
+            profiler = asyncio.run(request())
+        self.assertTrue(any("blocking_work" in stack for stack in profiler.samples))
+        self.assertIs(profiled(blocking_work), blocking_work)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+import time
+import unittest
+from types import SimpleNamespace
+
+from langchain_core.documents import Document
+
+from model_router import ModelRouter, classify_complexity
+
+
+class FakeStreamingLLM:
+    """Streams a fixed answer word by word, after an optional delay or error."""
+
+    def __init__(self, answer, delay=0.0, error=None):
+        self.answer = answer
+        self.delay = delay
+        self.error = error
+        self.calls = 0
+
+    def stream(self, messages):
+        self.calls += 1
+        time.sleep(self.delay)
+        if self.error:
+            raise self.error
+        for word in self.answer.split(" "):
+            yield SimpleNamespace(content=word + " ")
+
+
+class FakeRetriever:
+
+    def __init__(self, relevance=0.95):
+        self.docs = [] if relevance is None else [Document(page_content="Résidence de cinq ans.",
+                                                           metadata={"relevance": relevance})]
+
+    def invoke(self, question):
+        return self.docs
+
+
+FAST_ANSWER = "Il faut résider en France depuis au moins cinq ans avant de déposer la demande."
+STRONG_ANSWER = "Selon l'article 21-17 du Code civil, la résidence habituelle doit être de cinq ans."
+
+
+class ModelRouterTests(unittest.TestCase):
+
+    def router(self, fast, strong, relevance=0.95, hedge_after=5):
+        return ModelRouter(FakeRetriever(relevance), fast, strong, budget=5, hedge_after=hedge_after)
+
+    def test_classify_complexity(self):
+        self.assertEqual(classify_complexity("Quel niveau de français ?")[0], "simple")
+        self.assertEqual(classify_complexity("Pourquoi ma demande a-t-elle été refusée ?")[0], "complex")
+
+    def test_decision(self):
+        router = self.router(FakeStreamingLLM(FAST_ANSWER), FakeStreamingLLM(STRONG_ANSWER))
+        docs = FakeRetriever(0.85).docs
+        self.assertEqual(router.decide("Quel niveau de français ?", docs)["tier"], "fast")
+        self.assertEqual(router.decide("Pourquoi un refus ?", docs)["tier"], "strong")
+        self.assertEqual(router.decide("Pourquoi un refus ?", FakeRetriever(0.95).docs)["tier"], "fast")
+        self.assertEqual(router.decide("Quel niveau ?", [])["tier"], "strong")
+
+    def test_simple_question_stays_on_fast_tier(self):
+        fast, strong = FakeStreamingLLM(FAST_ANSWER), FakeStreamingLLM(STRONG_ANSWER)
+        answer, decision = self.router(fast, strong).answer("Quelle durée de résidence ?")
+        self.assertEqual(answer, FAST_ANSWER)
+        self.assertEqual((decision["winner"], strong.calls), ("fast", 0))
+
+    def test_unsure_fast_answer_escalates(self):
+        """An "I don't know" from the fast tier is replaced by the strong tier's answer."""
+        fast = FakeStreamingLLM("Je ne sais pas, le contexte ne précise pas ce point pour votre situation.")
+        answer, decision = self.router(fast, FakeStreamingLLM(STRONG_ANSWER)).answer("Quelle durée ?")
+        self.assertEqual(answer, STRONG_ANSWER)
+        self.assertEqual(decision["escalated"], "incertain")
+
+    def test_slow_or_failing_fast_tier_is_hedged(self):
+        answer, decision = self.router(FakeStreamingLLM(FAST_ANSWER, delay=1), FakeStreamingLLM(STRONG_ANSWER),
+                                       hedge_after=0.05).answer("Quelle durée ?")
+        self.assertEqual((answer, decision["escalated"]), (STRONG_ANSWER, "lent"))
+
+        answer, decision = self.router(FakeStreamingLLM("", error=RuntimeError("503")),
+                                       FakeStreamingLLM(STRONG_ANSWER)).answer("Quelle durée ?")
+        self.assertEqual((answer, decision["escalated"]), (STRONG_ANSWER, "erreur"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from langchain_community.vectorstores import FAISS
+
+from fakes import FakeOpenAIEmbeddings
+from segment_store import SEGMENT_DIR, SegmentStore, load_faiss
+from vectorstore_service import VectorStoreManager
+
+
+class SegmentStoreTests(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.TemporaryDirectory()
+        self.addCleanup(self.root.cleanup)
+        self.path = os.path.join(self.root.name, "vectorstore")
+        self.embeddings = FakeOpenAIEmbeddings(dim=16, latency=0)
+
+    def manager(self):
+        manager = VectorStoreManager(self.path, self.embeddings, flush_delay=60, publish_path="")
+        self.addCleanup(manager.store.close)
+        return manager
+
+    def test_flush_appends_segments_and_survives_interrupted_writes(self):
+        """Each flush adds one segment; a file never recorded in the manifest is ignored."""
+        manager = self.manager()
+        manager.add_texts(["La résidence de cinq ans.", "Le niveau B1."], metadatas=[{"n": 0}, {"n": 1}])
+        manager.flush()
+        manager.add_texts(["Le dossier en préfecture."], metadatas=[{"n": 2}])
+        manager.flush()
+        self.assertEqual([kind for _, kind, _, _ in manager.store.manifest()], ["segment", "segment"])
+        self.assertEqual(manager.disk_stamp(), 2)
+
+        # Écriture interrompue avant la transaction : segment orphelin
+        with open(os.path.join(self.path, SEGMENT_DIR, "seg-orphelin.npy"), "wb") as f:
+            f.write(b"incomplet")
+
+        store = SegmentStore(self.path)
+        self.addCleanup(store.close)
+        db = store.open(self.embeddings)
+        self.assertEqual(db.index.ntotal, 3)
+        self.assertEqual(db.similarity_search("Le dossier en préfecture.", k=1)[0].metadata, {"n": 2})
+        self.assertEqual([doc.page_content for _, doc in db.docstore.items()][0], "La résidence de cinq ans.")
+
+    def test_compaction_swaps_in_a_single_base(self):
+        manager = self.manager()
+        manager.store.compact_after = 0
+        for i in range(3):
+            manager.add_texts([f"Fait numéro {i}."])
+            manager.flush()
+        generation = manager.disk_stamp()
+        self.assertTrue(manager.store.compact())
+        self.assertEqual([(kind, count) for _, kind, _, count in manager.store.manifest()], [("base", 3)])
+        self.assertEqual(sorted(os.listdir(os.path.join(self.path, SEGMENT_DIR))), [manager.store.manifest()[0][0]])
+        self.assertEqual(manager.disk_stamp(), generation)
+
+        manager.add_texts(["Fait numéro 3."])
+        manager.flush()
+        self.assertTrue(manager.reload())
+        self.assertEqual(manager.size(), 4)
+        self.assertEqual(manager.similarity_search("Fait numéro 1.", k=1)[0].page_content, "Fait numéro 1.")
+
+    def test_reload_reads_only_new_segments(self):
+        """Another process's segments are added in place; only document writes change documents_version."""
+        writer = self.manager()
+        writer.add_texts(["Le formulaire cerfa 12753."], metadatas=[{"source": "preloaded"}])
+        writer.flush()
+        reader = VectorStoreManager(self.path, self.embeddings, publish_path="")
+        self.addCleanup(reader.store.close)
+        reader.lexical_search("cerfa")
+        version = reader.documents_version
+
+        writer.add_texts(["Q: délai ? R: douze mois"], metadatas=[{"source": "memory"}])
+        writer.flush()
+        with patch.object(reader.store, "open", side_effect=AssertionError("relecture complète")):
+            self.assertTrue(reader.reload())
+        self.assertEqual(reader.size(), 2)
+        self.assertEqual(len(reader.lexical_search("douze mois")), 1)
+        self.assertEqual(reader.documents_version, version)
+
+        writer.add_texts(["Le décret 93-1362."], metadatas=[{"source": "preloaded"}])
+        writer.flush()
+        self.assertTrue(reader.reload())
+        self.assertEqual(reader.documents_version, version + 1)
+
+        # Réécriture (compactage des mémoires) : positions renumérotées, relecture complète
+        vectors, entries = writer.entries()
+        writer.rewrite(vectors[[0, 2]], [entries[0], entries[2]], since=3, documents=False)
+        self.assertTrue(reader.reload())
+        self.assertEqual(reader.size(), 2)
+        self.assertEqual(reader.lexical_search("douze mois"), [])
+        self.assertEqual(reader.documents_version, version + 1)
+
+    def test_legacy_store_is_converted_once(self):
+        legacy = FAISS.from_texts(["Ancien document."], self.embeddings, metadatas=[{"source": "preloaded"}])
+        legacy.save_local(self.path)
+        db = load_faiss(self.path, self.embeddings)
+        self.addCleanup(db.docstore.store.close)
+        self.assertTrue(SegmentStore(self.path).exists())
+        self.assertEqual(db.similarity_search("Ancien document.", k=1)[0].metadata, {"source": "preloaded"})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+import tempfile
+import time
+import unittest
+
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from fakes import FakeOpenAIEmbeddings
+from ingestion import IngestionEngine
+from memory_index import upload_metadata
+from session_index import SessionAwareRetriever, SessionIndexFull, SessionIndexStore, current_session
+from vectorstore_service import VectorStoreManager
+
+
+class StaticRetriever(BaseRetriever):
+    docs: list
+
+    def _get_relevant_documents(self, query, *, run_manager):
+        return list(self.docs)
+
+
+def add_upload(store, session_id, texts, file_name="avis.pdf"):
+    vectors = store.embeddings.embed_documents(texts)
+    metadatas = [upload_metadata(file_name, "2025-01-01 10:00:00", chunk_hash=f"{file_name}-{i}") for i in range(len(texts))]
+    store.target(session_id).add_embeddings(zip(texts, vectors), metadatas)
+
+
+class SessionIndexTests(unittest.TestCase):
+
+    def setUp(self):
+        self.embeddings = FakeOpenAIEmbeddings(dim=32, latency=0)
+        self.store = SessionIndexStore(self.embeddings, ttl=60, max_chunks=3)
+
+    def test_uploads_are_only_seen_by_their_session(self):
+        """The session's chunks are merged with the shared results, other sessions don't see them."""
+        add_upload(self.store, "a", ["Récépissé de dépôt numéro 4521 du dossier."])
+        shared = Document(page_content="La naturalisation exige cinq ans de résidence.", metadata={})
+        retriever = SessionAwareRetriever(retriever=StaticRetriever(docs=[shared]), sessions=self.store)
+
+        token = current_session.set("a")
+        try:
+            docs = retriever.invoke("récépissé 4521")
+        finally:
+            current_session.reset(token)
+        self.assertEqual({doc.page_content for doc in docs},
+                         {shared.page_content, "Récépissé de dépôt numéro 4521 du dossier."})
+
+        token = current_session.set("b")
+        try:
+            self.assertEqual(retriever.invoke("récépissé 4521"), [shared])
+        finally:
+            current_session.reset(token)
+        self.assertFalse(self.store.has_documents("b"))
+
+    def test_cap_ttl_and_end_of_session(self):
+        add_upload(self.store, "a", ["un", "deux"])
+        with self.assertRaises(SessionIndexFull):
+            add_upload(self.store, "a", ["trois", "quatre"])
+        self.assertEqual(self.store.stats()["chunks"], 2)
+
+        self.store.drop("a")
+        self.assertFalse(self.store.has_documents("a"))
+
+        add_upload(self.store, "b", ["cinq"])
+        self.store.get("b").last_seen = time.monotonic() - 61
+        self.assertEqual(self.store.stats()["sessions"], 0)
+
+    def test_promotion_moves_chunks_into_the_vectorstore(self):
+        """Only an explicit promotion writes uploads to the shared store, without re-embedding."""
+        with tempfile.TemporaryDirectory() as path:
+            manager = VectorStoreManager(path, self.embeddings, flush_delay=60)
+            engine = IngestionEngine(manager)
+            add_upload(self.store, "a", ["Récépissé 4521."], file_name="recu.pdf")
+            add_upload(self.store, "a", ["Avis favorable."], file_name="avis.pdf")
+            calls = self.embeddings.calls
+            self.assertFalse(manager.exists())
+
+            self.assertEqual(engine.promote(self.store, "a", ["recu.pdf"]), 1)
+            self.assertEqual(self.embeddings.calls, calls)
+            self.assertEqual([doc.page_content for doc in manager.documents()], ["Récépissé 4521."])
+            self.assertEqual([doc.page_content for doc in self.store.get("a").docs], ["Avis favorable."])
+            manager.flush()
+
+    def test_failed_promotion_keeps_the_session_chunks(self):
+        with tempfile.TemporaryDirectory() as path:
+            manager = VectorStoreManager(path, self.embeddings, flush_delay=60)
+            engine = IngestionEngine(manager)
+            add_upload(self.store, "a", ["Récépissé 4521."], file_name="recu.pdf")
+            add_embeddings = manager.add_embeddings
+
+            def broken(*args, **kwargs):
+                raise OSError("disque plein")
+            manager.add_embeddings = broken
+            with self.assertRaises(OSError):
+                engine.promote(self.store, "a")
+            self.assertTrue(self.store.has_documents("a"))
+
+            manager.add_embeddings = add_embeddings
+            self.assertEqual(engine.promote(self.store, "a"), 1)
+            self.assertFalse(self.store.has_documents("a"))
+            manager.flush()
+
+
+if __name__ == '__main__':
+    unittest.main()
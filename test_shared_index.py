@@ -0,0 +1,68 @@
+import os
+import tempfile
+import unittest
+
+from langchain_community.vectorstores import FAISS
+
+from fakes import FakeOpenAIEmbeddings
+from shared_index import CURRENT, SharedIndexReader, publish_snapshot
+from vectorstore_service import VectorStoreManager
+
+
+TEXTS = [
+    "La naturalisation exige une résidence de cinq ans.",
+    "Le formulaire cerfa 12753 doit être joint au dossier.",
+    "Le dossier est déposé en préfecture.",
+]
+
+
+class SharedIndexTests(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.TemporaryDirectory()
+        self.addCleanup(self.root.cleanup)
+        self.embeddings = FakeOpenAIEmbeddings(dim=32, latency=0)
+        self.db = FAISS.from_texts(TEXTS, self.embeddings, metadatas=[{"n": i} for i in range(len(TEXTS))])
+
+    def test_reader_serves_published_snapshot(self):
+        """Vector, lexical and document lookups are answered from the snapshot."""
+        publish_snapshot(self.db, self.root.name)
+        reader = SharedIndexReader(self.root.name, self.embeddings)
+
+        self.assertEqual(reader.size(), 3)
+        self.assertEqual(reader.similarity_search(TEXTS[2], k=1)[0].metadata, {"n": 2})
+        doc_id, _ = reader.lexical_search("cerfa 12753", k=2)[0]
+        self.assertEqual(reader.get_documents([doc_id])[0].page_content, TEXTS[1])
+        self.assertEqual(len(reader.as_hybrid_retriever(k=2).invoke("préfecture")), 2)
+
+    def test_new_snapshot_is_picked_up_and_old_ones_pruned(self):
+        """Readers switch to the new snapshot and notify their subscribers."""
+        publish_snapshot(self.db, self.root.name, keep=1)
+        reader = SharedIndexReader(self.root.name, self.embeddings, poll_interval=0)
+        notified = []
+        reader.subscribe(notified.append)
+        reader.snapshot()
+
+        self.db.add_texts(["Le décret 93-1362 fixe la procédure."])
+        publish_snapshot(self.db, self.root.name, keep=1)
+        self.assertEqual(reader.size(), 4)
+        self.assertEqual(notified, [reader])
+        self.assertEqual(sorted(name for name in os.listdir(self.root.name) if name != CURRENT), [reader._snapshot.name])
+
+    def test_saves_are_published_on_a_longer_delay(self):
+        """Each flush appends a segment; the full snapshot is only written by the publish timer."""
+        published = os.path.join(self.root.name, "published")
+        manager = VectorStoreManager(os.path.join(self.root.name, "vectorstore"), self.embeddings, flush_every=1,
+                                     publish_path=published, publish_interval=60)
+        self.addCleanup(manager.store.close)
+        manager.add_texts(TEXTS[:1])
+        manager.add_texts(TEXTS[1:])
+        self.assertFalse(os.path.exists(published))
+
+        manager.publish()
+        self.assertEqual(SharedIndexReader(published, self.embeddings).size(), 3)
+        self.assertIsNone(manager._publish_timer)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+import os
+import tempfile
+import unittest
+
+from fakes import FakeOpenAIEmbeddings
+from startup import StartupReport, store_warmup_steps, touch_files
+from vectorstore_service import VectorStoreManager
+
+
+class StartupTests(unittest.TestCase):
+
+    def test_background_warm_up_reports_each_stage(self):
+        report = StartupReport()
+        report.mark("imports")
+        calls = []
+        report.warm_up([("index_load", lambda: calls.append("index")), ("tokenizer", lambda: calls.append("tok"))],
+                       mode="background")
+        self.assertTrue(report.wait(5))
+        self.assertEqual(calls, ["index", "tok"])
+        self.assertTrue(report.is_ready())
+        self.assertEqual(set(report.status()["stages"]), {"imports", "index_load", "tokenizer", "ready"})
+
+    def test_failed_step_keeps_the_service_unready(self):
+        """A failing step is reported, the remaining steps still run."""
+        def broken():
+            raise OSError("index absent")
+
+        report = StartupReport().warm_up([("index_load", broken), ("tokenizer", lambda: None)], mode="eager")
+        self.assertFalse(report.is_ready())
+        self.assertEqual(report.status()["status"], "error")
+        self.assertEqual(report.status()["errors"], {"index_load": "index absent"})
+        self.assertIn("tokenizer", report.status()["stages"])
+
+    def test_missing_store_keeps_the_service_unready(self):
+        with tempfile.TemporaryDirectory() as root:
+            manager = VectorStoreManager(os.path.join(root, "absent"), FakeOpenAIEmbeddings(dim=8, latency=0),
+                                         publish_path="")
+            report = StartupReport().warm_up(store_warmup_steps(manager), mode="eager")
+            self.assertFalse(report.is_ready())
+            self.assertIn("index_load", report.status()["errors"])
+            self.assertEqual(store_warmup_steps(manager, required=False), [])
+
+    def test_touch_files_reads_everything(self):
+        with tempfile.TemporaryDirectory() as root:
+            os.makedirs(os.path.join(root, "segments"))
+            for name, size in [("store.sqlite", 100), (os.path.join("segments", "base.faiss"), 50)]:
+                with open(os.path.join(root, name), "wb") as f:
+                    f.write(b"x" * size)
+            self.assertEqual(touch_files(root, chunk_size=16), 150)
+
+
+if __name__ == '__main__':
+    unittest.main()
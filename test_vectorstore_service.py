@@ -0,0 +1,133 @@
+import os
+import tempfile
+import threading
+import unittest
+from unittest.mock import patch
+
+from fakes import FakeOpenAIEmbeddings
+from vectorstore_service import ReadWriteLock, VectorStoreManager
+
+
+class ReadWriteLockTests(unittest.TestCase):
+
+    def hold(self, context, released):
+        """Enter ``context`` in a thread and keep it until ``released`` is set; return once it is held."""
+        entered = threading.Event()
+
+        def run():
+            with context:
+                entered.set()
+                released.wait()
+
+        threading.Thread(target=run, daemon=True).start()
+        self.addCleanup(released.set)
+        return entered
+
+    def test_readers_share_and_writer_waits(self):
+        """Readers run together; a writer waits for them and holds back new readers."""
+        lock = ReadWriteLock()
+        released = threading.Event()
+        self.assertTrue(self.hold(lock.read(), released).wait(1))
+        self.assertTrue(self.hold(lock.read(), threading.Event()).wait(1))
+
+        writer = self.hold(lock.write(), threading.Event())
+        self.assertFalse(writer.wait(0.1))
+        late_reader = self.hold(lock.read(), threading.Event())
+        self.assertFalse(late_reader.wait(0.1))
+
+    def test_writer_can_reenter_and_read(self):
+        lock = ReadWriteLock()
+        with lock.write():
+            with lock.write(), lock.read():
+                pass
+        with lock.read(), lock.read():
+            pass
+        with lock.write():
+            pass
+
+
+class VectorStoreManagerLockTests(unittest.TestCase):
+
+    def setUp(self):
+        self.manager = VectorStoreManager(os.path.join(tempfile.mkdtemp(), "vectorstore"),
+                                          FakeOpenAIEmbeddings(dim=16, latency=0), flush_delay=60, publish_path="")
+        self.addCleanup(self.manager.store.close)
+        self.manager.add_texts(["Résidence de cinq ans.", "Niveau de français B1."])
+
+    def test_searches_run_concurrently(self):
+        """A search is not blocked by another one in progress."""
+        released = threading.Event()
+        entered = threading.Event()
+
+        def long_search():
+            with self.manager._lock.read():
+                entered.set()
+                released.wait()
+
+        threading.Thread(target=long_search, daemon=True).start()
+        self.addCleanup(released.set)
+        self.assertTrue(entered.wait(1))
+
+        done = threading.Event()
+        threading.Thread(target=lambda: self.manager.similarity_search("Résidence", k=1) and done.set(),
+                         daemon=True).start()
+        self.assertTrue(done.wait(2))
+
+
+    def test_searches_continue_while_a_segment_is_written(self):
+        """The segment write (file, fsync, SQLite) does not hold the search lock."""
+        writing, released = threading.Event(), threading.Event()
+        append = self.manager.store.append
+
+        def slow_append(*args, **kwargs):
+            writing.set()
+            released.wait(5)
+            return append(*args, **kwargs)
+
+        self.manager.store.append = slow_append
+        flush = threading.Thread(target=self.manager.flush)
+        flush.start()
+        self.addCleanup(flush.join)
+        self.addCleanup(released.set)
+        self.assertTrue(writing.wait(1))
+
+        found = []
+        search = threading.Thread(target=lambda: found.extend(self.manager.similarity_search("Niveau B1", k=1)))
+        search.start()
+        search.join(1)
+        self.assertEqual(len(found), 1)
+        released.set()
+        flush.join()
+        self.assertEqual([kind for _, kind, _, _ in self.manager.store.manifest()], ["segment"])
+        self.assertEqual(sorted(doc.page_content for doc in self.manager.documents()),
+                         ["Niveau de français B1.", "Résidence de cinq ans."])
+
+
+    def test_rewrite_swaps_in_the_rebuilt_content(self):
+        """Searches keep working during a rewrite and nothing is reloaded from disk afterwards."""
+        self.manager.add_texts(["Dépôt du dossier en préfecture."])
+        self.manager.lexical_search("préfecture")
+        self.manager.count_documents()
+        vectors, entries = self.manager.entries()
+        during = []
+        commit_base = self.manager.store.commit_base
+
+        def commit_while_searching(*args, **kwargs):
+            search = threading.Thread(target=lambda: during.extend(
+                self.manager.get_documents(self.manager.vector_search_ids("Résidence de cinq ans.", k=1))))
+            search.start()
+            search.join(1)
+            return commit_base(*args, **kwargs)
+
+        with patch.object(self.manager.store, "commit_base", commit_while_searching), \
+                patch.object(self.manager.store, "open", side_effect=AssertionError("relu depuis le disque")):
+            self.manager.rewrite(vectors[:2], entries[:2], since=3)
+            self.assertEqual([doc.page_content for doc in during], ["Résidence de cinq ans."])
+            self.assertEqual(self.manager.size(), 2)
+            self.assertEqual(self.manager.lexical_search("préfecture"), [])
+            self.assertEqual(self.manager.count_documents(), 2)
+            self.assertEqual(len(self.manager.get_vectors([entries[0][0]])), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,498 @@
+import atexit
+import os
+import threading
+from contextlib import contextmanager
+from typing import Any, List
+
+import numpy as np
+from langchain_community.vectorstores import FAISS
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from hybrid_retrieval import BM25Index, HybridRetriever, tokenize
+from index_backends import (apply_search_params, build_index, extract_vectors, index_type_of, is_lossy,
+                            make_reconstructible, reconstruct_vectors)
+from memory_index import MetadataIndex, infer_metadata
+from metrics import registry, span
+from segment_store import MemoryDocstore, SegmentStore, legacy_exists, load_faiss
+from shared_index import SHARED_INDEX_PATH, SHARED_INDEX_PUBLISH_INTERVAL, publish_snapshot
+
+
+# 🚦 Verrou lecteurs / rédacteur : les recherches FAISS (sûres en parallèle) se partagent l'index,
+# les modifications en place (ajout, bascule) l'ont pour elles seules. Un rédacteur en attente
+# bloque les nouveaux lecteurs pour ne pas être affamé.
+class ReadWriteLock:
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = None
+        self._depth = 0
+        self._waiting = 0
+        self._local = threading.local()
+
+    @contextmanager
+    def read(self):
+        depth = getattr(self._local, "depth", 0)
+        if depth or self._writer == threading.get_ident():
+            # Lecture imbriquée, ou lecture par le rédacteur : pas d'attente
+            self._local.depth = depth + 1
+            try:
+                yield
+            finally:
+                self._local.depth = depth
+            return
+        with self._cond:
+            while self._writer is not None or self._waiting:
+                self._cond.wait()
+            self._readers += 1
+        self._local.depth = 1
+        try:
+            yield
+        finally:
+            self._local.depth = 0
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def write(self):
+        """Exclusive access; re-entrant for the writing thread. A reader must not ask to write."""
+        me = threading.get_ident()
+        with self._cond:
+            if self._writer != me:
+                self._waiting += 1
+                try:
+                    while self._writer is not None or self._readers:
+                        self._cond.wait()
+                finally:
+                    self._waiting -= 1
+                self._writer = me
+            self._depth += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._depth -= 1
+                if not self._depth:
+                    self._writer = None
+                    self._cond.notify_all()
+
+
+# 🗄️ Gestionnaire unique de la base FAISS pour tout le processus :
+# l'index est chargé une seule fois, les recherches se font en parallèle (verrou en lecture),
+# les ajouts en mémoire sous verrou exclusif
+# et l'écriture sur disque (un segment ajouté, voir segment_store) est regroupée après un court délai.
+# Avec ``publish_path``, un instantané est aussi publié pour les workers WSGI, au plus une fois
+# par ``publish_interval`` (la publication réécrit tout l'index, contrairement aux segments).
+class VectorStoreManager:
+    def __init__(self, path: str, embeddings, flush_delay: float = 5.0, flush_every: int = 50,
+                 publish_path: str = SHARED_INDEX_PATH, publish_interval: float = SHARED_INDEX_PUBLISH_INTERVAL):
+        self.path = path
+        self.embeddings = embeddings
+        self.flush_delay = flush_delay
+        self.flush_every = flush_every
+        self.publish_path = publish_path
+        self.publish_interval = publish_interval
+        self._publish_timer = None
+        self._publish_due = False
+        self.store = SegmentStore(path)
+        self._lock = ReadWriteLock()
+        self._load_lock = threading.Lock()
+        # Écritures (ajouts, réécriture, publication) sérialisées sans bloquer les recherches
+        self._write_lock = threading.RLock()
+        self._db = None
+        self._pending = 0
+        self._unsaved = []
+        self._unsaved_documents = False
+        self._timer = None
+        self._listeners = []
+        self._lexical = None
+        self._metadata = None
+        self.version = 0
+        # Changements hors mémoires apprises (documents, réécriture, rechargement) : voir answer_cache.watch
+        self.documents_version = 0
+        # Compteurs du disque correspondant au contenu chargé (voir SegmentStore.epoch / documents_generation)
+        self._epoch = None
+        self._documents_generation = None
+
+    @property
+    def db(self):
+        # Chargement paresseux sous son propre verrou : appelable avec ou sans _lock
+        if self._db is None:
+            with self._load_lock:
+                if self._db is None:
+                    # Compteurs lus avant le contenu : une écriture concurrente sera vue au prochain reload
+                    self._read_counters()
+                    db = load_faiss(self.path, self.embeddings)
+                    if self._epoch is None:
+                        # Store créé à l'instant (conversion de l'ancien format)
+                        self._read_counters()
+                    make_reconstructible(apply_search_params(db.index))
+                    self._db = db
+        return self._db
+
+    def as_retriever(self, **search_kwargs):
+        return LiveRetriever(manager=self, search_kwargs=search_kwargs)
+
+    def as_hybrid_retriever(self, **kwargs):
+        return HybridRetriever(manager=self, **kwargs)
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs):
+        # Le calcul de l'embedding se fait hors verrou, la recherche FAISS sous verrou partagé
+        vector = self.embeddings.embed_query(query)
+        with self._lock.read():
+            return self.db.similarity_search_by_vector(vector, k=k, **kwargs)
+
+    def vector_search_ids(self, query: str, k: int = 4):
+        return self.vector_search_ids_batch([self.embeddings.embed_query(query)], k)[0]
+
+    # 📦 Recherche vectorisée : un seul appel FAISS pour toutes les requêtes d'un lot
+    def vector_search_ids_batch(self, vectors, k: int = 4):
+        vectors = np.ascontiguousarray(vectors, dtype="float32")
+        with self._lock.read():
+            _, positions = self.db.index.search(vectors, k)
+            mapping = self.db.index_to_docstore_id
+            return [[mapping[int(position)] for position in row if position != -1] for row in positions]
+
+    # 🔤 Index lexical BM25 construit à partir du même docstore, à la première utilisation.
+    # Seule la copie des postings de la requête se fait sous verrou, le calcul des scores hors verrou.
+    def lexical_search(self, query: str, k: int = 4):
+        terms = set(tokenize(query))
+        with self._lock.read():
+            if self._lexical is None:
+                # Construit hors de l'attribut : deux lecteurs simultanés ne partagent pas un index à moitié rempli
+                self._lexical = build_lexical_index(self.db.docstore.items())
+            lexical = self._lexical
+            snapshot = lexical.snapshot(terms)
+        return lexical.score(snapshot, k)
+
+    # 🗂️ Index secondaire par date / source / fichier, construit une seule fois (sous _lock)
+    def _metadata_index(self):
+        if self._metadata is None:
+            self._metadata = build_metadata_index(self.db.docstore.items())
+        return self._metadata
+
+    def recent_documents(self, limit=10, offset=0, source=None, file_name=None):
+        with self._lock.read():
+            ids = self._metadata_index().newest(limit, offset, source=source, file_name=file_name)
+            return self.db.docstore.mget(ids)
+
+    def count_documents(self, source=None, file_name=None):
+        with self._lock.read():
+            return self._metadata_index().count(source=source, file_name=file_name)
+
+    def get_documents(self, ids):
+        with self._lock.read():
+            return self.db.docstore.mget(ids)
+
+    def get_vectors(self, ids):
+        """Stored vector of each of ``ids``, read back from FAISS (no embedding call), as a dict."""
+        with self._lock.read():
+            positions = self.db.docstore.positions(ids)
+            vectors = reconstruct_vectors(self.db.index, list(positions.values()))
+            return dict(zip(positions, vectors))
+
+    # 🔄 Relecture depuis le disque (index modifié par un autre processus)
+    def disk_stamp(self):
+        return self.store.generation()
+
+    def _read_counters(self):
+        self._epoch, self._documents_generation = self.store.epoch(), self.store.documents_generation()
+
+    def reload(self):
+        """Pick up what another process wrote; False while local additions are not saved yet."""
+        with self._write_lock:
+            if self._pending:
+                # Des ajouts locaux non encore écrits l'emportent sur la version disque
+                return False
+            documents = self.store.documents_generation()
+            if self._db is not None and self.store.exists():
+                added = self.store.read_since(self._db.index.ntotal, self._epoch)
+                if added is None:
+                    # Contenu réécrit ou compacté ailleurs : relecture complète, index secondaires
+                    # construits sans bloquer les recherches
+                    self._epoch = self.store.epoch()
+                    db = self.store.open(self.embeddings)
+                    make_reconstructible(apply_search_params(db.index))
+                    self._swap(db, *self._secondary_indexes(db.docstore.items()))
+                else:
+                    self._add_committed(*added)
+            with self._lock.write():
+                self.version += 1
+                # Mémoires seules (ex. apprentissage d'un autre processus) : le cache de réponses reste valide
+                if documents != self._documents_generation:
+                    self.documents_version += 1
+                self._documents_generation = documents
+        self._notify()
+        return True
+
+    def _add_committed(self, vectors, rows):
+        # Segments écrits par un autre processus : seuls leurs vecteurs et documents sont ajoutés
+        with self._lock.write():
+            self._db.index.add(vectors)
+            self._db.docstore.committed += len(rows)
+            for _, doc_id, doc in rows:
+                if self._lexical is not None:
+                    self._lexical.add(doc_id, doc.page_content)
+                if self._metadata is not None:
+                    self._metadata.add(doc_id, infer_metadata(doc))
+
+    def _secondary_indexes(self, items):
+        """BM25 and metadata indexes over ``items``, for those already built on the current content."""
+        lexical, metadata = self._lexical is not None, self._metadata is not None
+        if lexical or metadata:
+            items = list(items)
+        return (build_lexical_index(items) if lexical else None,
+                build_metadata_index(items) if metadata else None)
+
+    def _swap(self, db, lexical, metadata):
+        """Install a new content (built beforehand) and return the previous one."""
+        with self._lock.write():
+            previous = self._db, self._lexical, self._metadata
+            self._db, self._lexical, self._metadata = db, lexical, metadata
+        return previous
+
+    def exists(self):
+        return self._db is not None or self.store.exists() or legacy_exists(self.path)
+
+    # ♻️ Réécriture complète (ex. compactage des mémoires) : l'index est construit et écrit sans
+    # bloquer les recherches ; seuls les ajouts attendent, et la bascule finale se fait sous verrou.
+    def entries(self):
+        """Return ``(vectors, [(doc_id, Document), ...])`` for everything stored, in index order."""
+        with self._write_lock:
+            self._flush_locked()
+        with self._lock.read():
+            db = self.db
+            return extract_vectors(db.index), list(db.docstore.items())
+
+    def is_lossy(self):
+        """True when the stored vectors cannot be reconstructed exactly (e.g. IVF-PQ codes)."""
+        with self._lock.read():
+            return is_lossy(self.db.index)
+
+    def rewrite(self, vectors, entries, since, documents=True):
+        """Replace the content with ``vectors``/``entries``, keeping what was added after position ``since``.
+
+        ``documents=False`` tells that only learned memories changed (see answer_cache.watch).
+        """
+        with self._write_lock:
+            self._flush_locked()
+            with self._lock.read():
+                db = self.db
+                index_type = index_type_of(db.index)
+                late, late_vectors = [], None
+                if db.index.ntotal > since:
+                    late = list(db.docstore.items())[since:]
+                    late_vectors = db.index.reconstruct_n(since, db.index.ntotal - since)
+            # Entraînement (IVF), index secondaires et écriture du fichier d'index sans verrou :
+            # les recherches continuent sur l'ancien contenu
+            with span("faiss_build", mode="rewrite"):
+                index = build_index(np.asarray(vectors, dtype="float32").reshape(-1, db.index.d), index_type)
+                if late_vectors is not None:
+                    # Ajouts arrivés pendant le calcul : conservés tels quels
+                    index.add(late_vectors)
+                make_reconstructible(index)
+                entries = list(entries) + late
+                rebuilt = FAISS(self.embeddings, index, MemoryDocstore(entries),
+                                {position: doc_id for position, (doc_id, _) in enumerate(entries)})
+                lexical, metadata = self._secondary_indexes(entries)
+            name = self.store.write_base(index)
+            self.store.wait_for_compaction()
+            # Bascule avant la transaction SQLite : pendant celle-ci, les recherches lisent les documents
+            # réécrits en mémoire, jamais l'ancien index avec les nouveaux documents (ou l'inverse)
+            previous = self._swap(rebuilt, lexical, metadata)
+            try:
+                self.store.commit_base(rebuilt, name, documents=documents)
+            except BaseException:
+                self._swap(*previous)
+                raise
+            # Même index, documents relus à la demande dans store.sqlite
+            self._swap(self.store.attach(self.embeddings, index), lexical, metadata)
+            self._read_counters()
+            with self._lock.write():
+                self.version += 1
+                if documents:
+                    self.documents_version += 1
+            self._publish_due = bool(self.publish_path)
+            self.publish()
+        self._notify()
+
+    def add_texts(self, texts, metadatas=None):
+        texts = list(texts)
+        if not texts:
+            return []
+        vectors = self.embeddings.embed_documents(texts)
+        return self.add_embeddings(list(zip(texts, vectors)), metadatas=metadatas)
+
+    def add_embeddings(self, text_embeddings, metadatas=None):
+        text_embeddings = list(text_embeddings)
+        if not text_embeddings:
+            return []
+        with self._write_lock:
+            with self._lock.write(), span("faiss_add"):
+                ids = self._add_locked(text_embeddings, metadatas)
+            # Écriture du segment hors verrou de lecture : les recherches continuent pendant l'I/O
+            if self._pending >= self.flush_every:
+                self._flush_locked()
+            else:
+                self._schedule_flush()
+        self._notify()
+        return ids
+
+    def _add_locked(self, text_embeddings, metadatas):
+        # Sous _write_lock et _lock en écriture
+        if not self.exists():
+            # Première écriture : création d'un nouvel index
+            self._db = self.store.open(self.embeddings, dim=len(text_embeddings[0][1]))
+            self._read_counters()
+        ids = self.db.add_embeddings(text_embeddings, metadatas=metadatas)
+        self._unsaved.append(np.asarray([vector for _, vector in text_embeddings], dtype="float32"))
+        if self._lexical is not None:
+            for doc_id, (text, _) in zip(ids, text_embeddings):
+                self._lexical.add(doc_id, text)
+        if self._metadata is not None:
+            for doc_id in ids:
+                self._metadata.add(doc_id, infer_metadata(self._db.docstore.search(doc_id)))
+        self._pending += len(text_embeddings)
+        self.version += 1
+        if not metadatas or any((metadata or {}).get("source") != "memory" for metadata in metadatas):
+            self.documents_version += 1
+            self._unsaved_documents = True
+        return ids
+
+    # 🔔 Abonnement aux modifications de l'index (ex. invalidation des caches)
+    def subscribe(self, callback):
+        self._listeners.append(callback)
+
+    def _notify(self):
+        for callback in list(self._listeners):
+            try:
+                callback(self)
+            except Exception as e:
+                print(f"❌ Erreur dans un abonné du vectorstore : {e}")
+
+    def documents(self):
+        with self._lock.read():
+            return [doc for _, doc in self.db.docstore.items()]
+
+    def size(self):
+        with self._lock.read():
+            return self.db.index.ntotal
+
+    def flush(self):
+        with self._write_lock:
+            self._flush_locked()
+
+    def _schedule_flush(self):
+        if self._timer is not None:
+            return
+        self._timer = threading.Timer(self.flush_delay, self.flush)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _flush_locked(self):
+        # Sous _write_lock seulement : aucun ajout ne peut arriver pendant l'écriture,
+        # les recherches continuent (fichier, fsync et transaction SQLite hors de _lock)
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending or self._db is None:
+            return
+        with self._lock.read():
+            # Seuls les nouveaux vecteurs et documents sont écrits, en un segment ajouté au manifeste
+            rows = self._db.docstore.pending_rows()
+            vectors = np.vstack(self._unsaved)
+        self.store.append(vectors, rows, documents=self._unsaved_documents)
+        if self._unsaved_documents:
+            # Notre propre écriture ne doit pas passer pour un changement venu d'ailleurs au prochain reload
+            self._documents_generation = self.store.documents_generation()
+        with self._lock.write():
+            # Les documents écrits sont désormais lus dans store.sqlite
+            self._db.docstore.mark_committed(len(rows))
+            pending, self._pending, self._unsaved = self._pending, 0, []
+            self._unsaved_documents = False
+        print(f"💾 Vectorstore sauvegardé ({pending} ajout(s)) : {os.path.abspath(self.path)}")
+        if self.publish_path:
+            self._publish_due = True
+            self._schedule_publish()
+
+    # 📤 Instantané partagé : publication différée, regroupant toutes les sauvegardes de l'intervalle
+    def publish(self):
+        # Les ajouts attendent (l'index ne bouge pas pendant l'écriture), les recherches continuent :
+        # seul _write_lock est pris, l'instantané ne fait que lire l'index
+        with self._write_lock:
+            self._flush_locked()
+            if self._publish_timer is not None:
+                self._publish_timer.cancel()
+                self._publish_timer = None
+            due, self._publish_due = self._publish_due, False
+            db = self._db
+            if due and db is not None:
+                publish_snapshot(db, self.publish_path)
+
+    def _schedule_publish(self):
+        if self._publish_timer is not None:
+            return
+        self._publish_timer = threading.Timer(self.publish_interval, self.publish)
+        self._publish_timer.daemon = True
+        self._publish_timer.start()
+
+
+def build_lexical_index(items):
+    lexical = BM25Index()
+    for doc_id, doc in items:
+        lexical.add(doc_id, doc.page_content)
+    return lexical
+
+
+def build_metadata_index(items):
+    metadata = MetadataIndex()
+    for doc_id, doc in items:
+        metadata.add(doc_id, infer_metadata(doc))
+    return metadata
+
+
+# 🔎 Retriever branché sur l'index vivant du gestionnaire (voit les ajouts sans rechargement)
+class LiveRetriever(BaseRetriever):
+    manager: Any
+    search_kwargs: dict = {}
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        with span("retrieval", mode="vector"):
+            return self.manager.similarity_search(query, **self.search_kwargs)
+
+
+_managers = {}
+_managers_lock = threading.Lock()
+
+
+def get_vectorstore_manager(path: str, embeddings=None, **kwargs):
+    key = os.path.abspath(path)
+    with _managers_lock:
+        manager = _managers.get(key)
+        if manager is None:
+            if embeddings is None:
+                raise ValueError(f"Aucun gestionnaire pour {path} : fournir les embeddings au premier appel.")
+            manager = VectorStoreManager(path, embeddings, **kwargs)
+            _managers[key] = manager
+        return manager
+
+
+def _vectorstore_sizes():
+    # Seuls les index déjà chargés sont mesurés : un scrape ne déclenche pas de chargement
+    return [({"path": manager.path}, manager._db.index.ntotal)
+            for manager in list(_managers.values()) if manager._db is not None]
+
+
+registry.gauge_function("llmops_vectorstore_documents", _vectorstore_sizes)
+
+
+@atexit.register
+def _flush_all():
+    for manager in list(_managers.values()):
+        try:
+            manager.publish()
+        except Exception as e:
+            print(f"❌ Erreur lors de la sauvegarde du vectorstore : {e}")
@@ -0,0 +1,13 @@
+# 🚀 Point d'entrée WSGI de production : gunicorn -c gunicorn.conf.py wsgi:application
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# 🍪 Plusieurs workers : une clé générée par worker invaliderait les cookies de session
+# (nouvel identifiant et historique vide dès qu'une requête change de worker)
+if not os.getenv("FLASK_SECRET_KEY"):
+    raise ValueError("🔑 Clé de session manquante ! Définissez FLASK_SECRET_KEY (identique pour tous les workers).")
+
+from app_local import app as application